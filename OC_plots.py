@@ -7,6 +7,9 @@ from utils import *
 from pprint import pprint
 from susie.timing_data import TimingData
 from susie.ephemeris import Ephemeris
+from timing_catalog import TimingCatalog, assign_epochs, exowatch_source, SOURCE_COLORS
+from ephemeris import plot_running_delta_bic, compare_ephemeris_models
+from ttv_periodogram import calc_ttv_residual_periodogram, plot_ttv_periodogram
 
 def read_exoWatch_json_data(json_file):
     with open(json_file) as f: 
@@ -29,14 +32,7 @@ def read_exoWatch_json_data(json_file):
                 mid_times.append(float(dat['Tc']))
                 mid_times_err.append(float(obs["errors"]["Tc"]))
                 # observers.append(obs["obscode"]["id"])
-                if len(obs["secondary_obscodes"]) == 0:
-                    src_flg.append("AAVSO")
-                else:
-                    for observer in obs["secondary_obscodes"]:
-                        if observer["id"] == "UNIS":
-                            src_flg.append("Unistellar")
-                        elif observer["id"] == "MOBS":
-                            src_flg.append("MOBS/EXOTIC")
+                src_flg.append(exowatch_source(obs))  # one flag per mid-time
             else: 
                 E = get_epochs(float(obs["parameters"]["Tc"]), 2455642.14768, float(period)) # T0 from A-thano+ 2022 (Table 4)
                 if E > 1400: 
@@ -80,12 +76,59 @@ def get_epochs(T, T0, P, E0=0):
     N = (T-T0)/P
     return int(N + E0)
 
+def scatter_oc_by_source(ax, epochs, oc_vals, sources, colors=SOURCE_COLORS, rasterize_above=1000, zorder=110, **scatter_kwargs):
+    '''Draws O-C points with one scatter collection per source instead of one artist per point, so each
+    source appears in the legend exactly once and thousands of points render quickly.
+
+    Parameters
+    ----------
+    ax : matplotlib Axes
+    epochs, oc_vals : array-like
+        Epochs and O-C values of the points
+    sources : array-like of str
+        Source flag of every point (keys of colors)
+    colors : dict
+        source -> colour
+    rasterize_above : int
+        Sources with more points than this are rasterized, so vector output (pdf/svg) stays small
+        and fast to draw. None never rasterizes.
+
+    Returns
+    -------
+    dict
+        source -> PathCollection
+    '''
+    epochs, oc_vals, sources = np.asarray(epochs), np.asarray(oc_vals), np.asarray(sources)
+    # one sort groups the points by source
+    order = np.argsort(sources, kind="stable")
+    names, starts = np.unique(sources[order], return_index=True)
+    collections = dict()
+    for name, idx in zip(names, np.split(order, starts[1:])):
+        rasterized = rasterize_above is not None and len(idx) > rasterize_above
+        collections[name] = ax.scatter(epochs[idx], oc_vals[idx], label=name, color=colors.get(name), zorder=zorder, 
+                                       rasterized=rasterized, **scatter_kwargs)
+    return collections
+
+def unique_legend(ax):
+    '''Legend with each label once (susie's O-C plot adds its own labelled artists).'''
+    handles, labels = ax.get_legend_handles_labels()
+    unique = dict(zip(labels, handles))
+    ax.legend(list(unique.values()), list(unique.keys()))
+
+def show_or_save(fig, save_path=None, dpi=150):
+    '''Shows the figure, or with a save_path writes it (no display needed) and closes it.'''
+    if save_path is None:
+        plt.show()
+    else:
+        fig.savefig(save_path, dpi=dpi, bbox_inches="tight")
+        plt.close(fig)
+
 #instantiate susie object
-def make_susie_plot(json_file, csv_file):
+def make_susie_plot(json_file, csv_file, save_path=None):
     epochs, mid_times, mid_time_err, src_flg, period, T0 = read_exoWatch_json_data(json_file)
     epochs2, mid_times2, mid_time_errs2 = read_Elisbeth_data(csv_file)
     E_src_flg = ["Elisabeth's Data"] * len(epochs2)
-    new_epochs = np.array([get_epochs(m, T0, period) for m in np.hstack((mid_times, mid_times2))]) # recalculate epochs given Tc prior from EXOTIC
+    new_epochs, _, _ = assign_epochs(np.hstack((mid_times, mid_times2)), T0, period) # recalculate epochs given Tc prior from EXOTIC
     sort_idx = np.argsort(new_epochs)
     all_midtimes = np.hstack((mid_times, mid_times2))
     all_err = np.hstack((mid_time_err, mid_time_errs2))    
@@ -96,51 +139,35 @@ def make_susie_plot(json_file, csv_file):
     oc_vals = ephemeris_obj.oc_vals
     epochs = ephemeris_obj.timing_data.epochs
     all_src_flgs = np.hstack((src_flg, E_src_flg))
-    colors = {'NASA Exoplanet Archive': 'b', 
-              'AAVSO': 'g', 
-              'Unistellar': 'r',
-              'MOBS/EXOTIC': 'y', 
-              "Elisabeth's Data" : 'k'}
-    for data_point, time, src in zip(epochs, oc_vals, all_src_flgs[sort_idx]):
-        ax.scatter(data_point, time, label=src, color=colors[src], zorder=110)
-    handles, labels = ax.get_legend_handles_labels()
-    unique_labels = set(labels)
-    handles = [handles[labels.index(label)] for label in unique_labels]
-    labels = list(unique_labels)
-    ax.legend(handles, labels)
-    plt.show()
+    # the flags were paired with the points by zip(), i.e. only the first len(epochs) are used
+    scatter_oc_by_source(ax, epochs, oc_vals, all_src_flgs[sort_idx][:len(epochs)])
+    unique_legend(ax)
+    show_or_save(ax.figure, None if save_path is None else save_path + "_oc.png")
 
-    ephemeris_obj.plot_running_delta_bic("linear", "quadratic")
-    plt.show()
+    timing_data = ephemeris_obj.timing_data
+    ax = plot_running_delta_bic(timing_data.epochs, timing_data.mid_times, timing_data.mid_time_uncertainties, "linear", "quadratic")
+    show_or_save(ax.figure, None if save_path is None else save_path + "_running_bic.png")
 
-def susie_for_exowatch_only(json_file):
+def susie_for_exowatch_only(json_file, save_path=None):
     epochs, mid_times, mid_time_err, src_flg, period, T0 = read_exoWatch_json_data(json_file)   
     timing_obj = TimingData('jd', epochs, mid_times, mid_time_err, time_scale='tdb')
     ephemeris_obj = Ephemeris(timing_obj)
     ax = ephemeris_obj.plot_oc_plot("quadratic")
     oc_vals = ephemeris_obj.oc_vals
     epochs = ephemeris_obj.timing_data.epochs
-    colors = {'NASA Exoplanet Archive': 'b', 
-              'AAVSO': 'g', 
-              'Unistellar': 'r',
-              'MOBS/EXOTIC': 'y'}
-    for data_point, time, src in zip(epochs, oc_vals, src_flg):
-        ax.scatter(data_point, time, label=src, color=colors[src], zorder=110)
-    handles, labels = ax.get_legend_handles_labels()
-    unique_labels = set(labels)
-    handles = [handles[labels.index(label)] for label in unique_labels]
-    labels = list(unique_labels)
-    ax.legend(handles, labels)
-    plt.show()
+    scatter_oc_by_source(ax, epochs, oc_vals, src_flg)
+    unique_legend(ax)
+    show_or_save(ax.figure, None if save_path is None else save_path + "_oc.png")
 
-    ephemeris_obj.plot_running_delta_bic("linear", "quadratic")
-    plt.show()
+    timing_data = ephemeris_obj.timing_data
+    ax = plot_running_delta_bic(timing_data.epochs, timing_data.mid_times, timing_data.mid_time_uncertainties, "linear", "quadratic")
+    show_or_save(ax.figure, None if save_path is None else save_path + "_running_bic.png")
 
-def make_susie_plot_Athano_exowatch(json_file):
+def make_susie_plot_Athano_exowatch(json_file, save_path=None):
     epochs, mid_times, mid_time_err, src_flg, period, T0_no = read_exoWatch_json_data(json_file)
     epochs2, mid_times2, mid_time_errs2, src_flg2 = read_Athano22_data()
     T0 = 2455642.14768  # data from A-thano+ 2022 (Table 4)
-    new_epochs = np.array([get_epochs(m, T0, period) for m in np.hstack((mid_times, mid_times2))]) # recalculate epochs given T0 from PAPER
+    new_epochs, _, _ = assign_epochs(np.hstack((mid_times, mid_times2)), T0, period) # recalculate epochs given T0 from PAPER
     sort_idx = np.argsort(new_epochs)
     all_midtimes = np.hstack((mid_times, mid_times2))
     all_err = np.hstack((mid_time_err, mid_time_errs2))    
@@ -151,22 +178,34 @@ def make_susie_plot_Athano_exowatch(json_file):
     oc_vals = ephemeris_obj.oc_vals
     epochs = ephemeris_obj.timing_data.epochs
     all_src_flgs = np.hstack((src_flg, src_flg2))
-    colors = {'NASA Exoplanet Archive': 'b', 
-              'AAVSO': 'g', 
-              'Unistellar': 'r',
-              'MOBS/EXOTIC': 'y', 
-              "A-thano+ 2022" : 'k'}
-    for data_point, time, src in zip(epochs, oc_vals, all_src_flgs[sort_idx]):
-        ax.scatter(data_point, time, label=src, color=colors[src], zorder=110)
-    handles, labels = ax.get_legend_handles_labels()
-    unique_labels = set(labels)
-    handles = [handles[labels.index(label)] for label in unique_labels]
-    labels = list(unique_labels)
-    ax.legend(handles, labels)
-    plt.show()
+    # the flags were paired with the points by zip(), i.e. only the first len(epochs) are used
+    scatter_oc_by_source(ax, epochs, oc_vals, all_src_flgs[sort_idx][:len(epochs)])
+    unique_legend(ax)
+    show_or_save(ax.figure, None if save_path is None else save_path + "_oc.png")
+
+    timing_data = ephemeris_obj.timing_data
+    ax = plot_running_delta_bic(timing_data.epochs, timing_data.mid_times, timing_data.mid_time_uncertainties, "linear", "quadratic")
+    show_or_save(ax.figure, None if save_path is None else save_path + "_running_bic.png")
+
+    # periodogram of the residuals of the quadratic ephemeris, to look for TTVs
+    ttv = calc_ttv_residual_periodogram(timing_data.epochs, timing_data.mid_times, timing_data.mid_time_uncertainties, 
+                                        "quadratic", n_bootstraps=1000)
+    ax = plot_ttv_periodogram(ttv)
+    show_or_save(ax.figure, None if save_path is None else save_path + "_ttv.png")
 
-    ephemeris_obj.plot_running_delta_bic("linear", "quadratic")
-    plt.show()
+def compare_ephemerides_Athano_exowatch(json_file, T0=2455642.14768):
+    # linear vs quadratic vs apsidal precession on ExoWatch + A-thano+ 2022, one measurement per transit
+    exowatch = TimingCatalog.from_exowatch_json(json_file)
+    with open(json_file) as f:
+        period = json.load(f)["priors"]["Period"]["value"]
+    catalog = TimingCatalog.merge(exowatch, TimingCatalog.from_Athano22(planet=exowatch.planet[0]))
+    catalog = catalog.reassign_epochs(T0, float(period)).drop_duplicates()
+    fits, delta_BIC = compare_ephemeris_models(catalog.epoch, catalog.Tc, catalog.sigma)
+    for model, fit in fits.items():
+        print(f"{model:>10}: BIC = {fit.BIC:.2f}, chi^2 = {fit.chi_sq:.2f}")
+        pprint(fit.params)
+    print("BIC_linear - BIC_model:", delta_BIC)
+    return fits
 
 if __name__ == "__main__":
     json_name = "WASP-52 b.json"
@@ -177,4 +216,5 @@ if __name__ == "__main__":
     # read_exoWatch_json_data(hatp37_exowatch)
     # susie_for_exowatch_only(hatp37_exowatch)
     make_susie_plot_Athano_exowatch(hatp37_exowatch)
+    # compare_ephemerides_Athano_exowatch(hatp37_exowatch)
     
@@ -1,12 +1,123 @@
 import os
-import json
 import batman
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
+from utils import batman_model_cache, calc_supersampled_flux, calc_batman_curves, BATCH_PARAM_COLUMNS
+import aavso_reports
+
+# parameters freed by fit_mode="full": mid-time, Rp/R*, a/R*, inclination and EXOTIC's airmass terms
+FULL_FIT_PARAMS = ("Tmid", "rp", "a", "inc", "Am1", "Am2")
+# central difference steps of the transit parameters (days, -, -, degrees); the airmass terms are analytic
+JACOBIAN_STEPS = {"Tmid": 1.e-5, "rp": 1.e-5, "a": 1.e-4, "inc": 1.e-4}
+
+def calc_airmass_transit_model(time, airmass, params, free_params, supersample_factor=1, exp_time=0., fac=None):
+    """Transit x airmass model, flux = transit * Am1 * exp(Am2 * airmass) as EXOTIC fits it, and its 
+    Jacobian with respect to free_params from one batched model call.
+
+    The transit at params and at +/- JACOBIAN_STEPS of every free transit parameter are rows of one
+    calc_batman_curves call (central differences); the airmass derivatives are analytic.
+
+    Parameters
+    ----------
+    time : np.ndarray[float]
+        Mid-exposure times.
+    airmass : np.ndarray[float] or None
+        Airmass of every exposure; None for no airmass term (flux = transit * Am1).
+    params : dict
+        "Tmid", "per", "rp", "a", "inc", "ecc", "w", "u", "limb_dark", "Am1" and "Am2".
+    free_params : sequence of str
+        Names from FULL_FIT_PARAMS, in Jacobian column order.
+    supersample_factor : int
+        Samples per exposure (spaced like batman's) when exp_time > 0.
+    exp_time : float
+        Exposure length (days).
+    fac : float, optional
+        batman integration step size factor, passed to calc_batman_curves; find it once per fit.
+
+    Returns
+    -------
+    flux : np.ndarray[float]
+    jacobian : np.ndarray[float]
+        (n_times x len(free_params)) derivatives of flux.
+    """
+    transit_free = [name for name in free_params if name in JACOBIAN_STEPS]
+    row = np.array([params["Tmid"], params["per"], params["rp"], params["a"], params["inc"], params["ecc"], params["w"]]
+                   + list(params["u"]), dtype=float)
+    columns = {"Tmid": 0, "rp": 2, "a": 3, "inc": 4}
+    param_matrix = np.tile(row, (1 + 2*len(transit_free), 1))
+    for idx, name in enumerate(transit_free):
+        param_matrix[1 + 2*idx, columns[name]] += JACOBIAN_STEPS[name]
+        param_matrix[2 + 2*idx, columns[name]] -= JACOBIAN_STEPS[name]
+    if supersample_factor > 1 and exp_time > 0.:
+        offsets = np.linspace(-exp_time/2., exp_time/2., int(supersample_factor))
+        curves = calc_batman_curves((time[:, np.newaxis] + offsets).ravel(), param_matrix, params["limb_dark"], fac=fac)
+        curves = curves.reshape(len(param_matrix), len(time), offsets.size).mean(axis=2)
+    else:
+        curves = calc_batman_curves(time, param_matrix, params["limb_dark"], fac=fac)
+    transit = curves[0]
+    airmass_term = np.full(len(time), params["Am1"]) if airmass is None else params["Am1"]*np.exp(params["Am2"]*airmass)
+    jacobian = np.empty((len(time), len(free_params)))
+    for idx, name in enumerate(free_params):
+        if name == "Am1":
+            jacobian[:, idx] = transit*airmass_term/params["Am1"]
+        elif name == "Am2":
+            jacobian[:, idx] = transit*airmass_term*airmass
+        else:
+            k = transit_free.index(name)
+            jacobian[:, idx] = (curves[1 + 2*k] - curves[2 + 2*k])/(2.*JACOBIAN_STEPS[name])*airmass_term
+    return transit*airmass_term, jacobian
+
+def fit_levenberg_marquardt(model_and_jacobian, x0, data, sigma, max_iterations=100, chi_sq_tol=1.e-3):
+    """Weighted least squares by Levenberg-Marquardt, with one call of model_and_jacobian per iteration.
+
+    model_and_jacobian(x) returns the model and its Jacobian together, so a trial step that is accepted 
+    already carries the Jacobian for the next iteration.
+
+    Returns
+    -------
+    x : np.ndarray[float]
+        Best fit.
+    covariance : np.ndarray[float]
+        Scaled by the reduced chi-square, like curve_fit (absolute_sigma=False).
+    chi_sq : float
+    n_calls : int
+        Number of model_and_jacobian calls.
+    """
+    x = np.asarray(x0, dtype=float)
+    model, jacobian = model_and_jacobian(x)
+    n_calls = 1
+    residuals = (data - model)/sigma
+    weighted_jacobian = jacobian/sigma[:, np.newaxis]
+    chi_sq = residuals @ residuals
+    damping = 1.e-3
+    for _ in range(max_iterations):
+        curvature = weighted_jacobian.T @ weighted_jacobian
+        gradient = weighted_jacobian.T @ residuals
+        scale = np.diag(curvature)
+        scale = np.where(scale > 0., scale, 1.)
+        step = np.linalg.solve(curvature + damping*np.diag(scale), gradient)
+        trial_model, trial_jacobian = model_and_jacobian(x + step)
+        n_calls += 1
+        trial_residuals = (data - trial_model)/sigma
+        trial_chi_sq = trial_residuals @ trial_residuals
+        if trial_chi_sq < chi_sq:
+            improvement = chi_sq - trial_chi_sq
+            x, residuals, chi_sq = x + step, trial_residuals, trial_chi_sq
+            weighted_jacobian = trial_jacobian/sigma[:, np.newaxis]
+            damping = max(damping/10., 1.e-12)
+            if improvement < chi_sq_tol:
+                break
+        else:
+            damping *= 10.
+            if damping > 1.e10:
+                break
+    covariance = np.linalg.pinv(weighted_jacobian.T @ weighted_jacobian)*chi_sq/max(len(data) - len(x), 1)
+    return x, covariance, chi_sq, n_calls
 
 class fit_transit_depth():
-    def __init__(self, transit_directory=None, exotic_output_directory=None, planet_name=None, observation_date=None, telescope_name=None):
+    def __init__(self, transit_directory=None, exotic_output_directory=None, planet_name=None, observation_date=None, telescope_name=None, 
+                 supersample_factor=1, exp_time=0., fit_mode="rp"):
         # default colors 
         self.BoiseStateBlue = "#0033A0"
         self.BoiseStateOrange = "#D64309"
@@ -16,12 +127,18 @@ class fit_transit_depth():
         self.PlanetName = planet_name
         self.ObservationDate = observation_date
         self.TelescopeName = telescope_name
+        # exposure integration for binned/long-cadence data. exp_time in days (e.g. 10./1440 for 10 min bins)
+        self.SupersampleFactor = supersample_factor
+        self.ExpTime = exp_time
+        # "rp" fits Rp/R* only; "full" fits Tmid, Rp/R*, a/R*, inc and the airmass terms (fit_transit_params)
+        self.FitMode = fit_mode
         self._BatmanParams = None
         self._PhotData = None
         self._Priors = None
         self._ExoticResults = None
         self._RpFit = None
         self._FitFlux = None
+        self._TransitFit = None
 
     @property
     def PhotData(self):
@@ -54,84 +171,51 @@ class fit_transit_depth():
     def RpFit(self):
         """returns list [Fit Rp, uncertainty]"""
         if self._RpFit is None:
-            self._RpFit, self._FitFlux = self.fit_transit_depth()
+            self.run_fit()
         return self._RpFit
     
     @property
     def FitFlux(self):
         """returns flux values of the light curve given the fit"""
         if self._FitFlux is None:
-            self._RpFit, self._FitFlux = self.fit_transit_depth()
+            self.run_fit()
         return self._FitFlux
 
-    def load_phot_data(self):
+    @property
+    def TransitFit(self):
+        """returns the fit_transit_params results (fit_mode="full" only)"""
+        if self._TransitFit is None and self.FitMode == "full":
+            self.run_fit()
+        return self._TransitFit
+
+    def run_fit(self):
+        if self.FitMode == "full":
+            self._TransitFit, self._FitFlux = self.fit_transit_params()
+            self._RpFit = [self._TransitFit["rp"], self._TransitFit["rp_unc"]]
+        else:
+            self._RpFit, self._FitFlux = self.fit_transit_depth()
+
+    def load_report(self):
+        """reads the AAVSO report once; later calls reuse the parsed report"""
         txt_name = f"AAVSO_{self.PlanetName}_{self.ObservationDate}.txt"
         data_directory = os.path.join(self.TransitDirectory, self.ExoticOutputDirectory)
-        phot_data = np.loadtxt(os.path.join(data_directory, txt_name), delimiter=",")
-        return {"BJD_TDB" : phot_data[:, 0], 
-                "flux" : phot_data[:, 1], 
-                "error" : phot_data[:, 2]}
+        return aavso_reports.read_aavso_report(os.path.join(data_directory, txt_name))
+
+    def load_phot_data(self):
+        report = self.load_report()
+        phot_data = {"BJD_TDB" : report["BJD_TDB"], 
+                     "flux" : report["flux"], 
+                     "error" : report["error"]}
+        # EXOTIC writes the airmass of every exposure as DETREND_1
+        if "detrend_1" in report:
+            phot_data["airmass"] = report["detrend_1"]
+        return phot_data
     
     def parse_final_params(self):
-        txt_name = f"AAVSO_{self.PlanetName}_{self.ObservationDate}.txt"
-        data_directory = os.path.join(self.TransitDirectory, self.ExoticOutputDirectory)     
-        with open(os.path.join(data_directory, txt_name)) as fn:
-            for line in fn: 
-                if line.startswith("#RESULTS-XC"):
-                    # extract the JSON-like string part
-                    json_str = line.split("=", 1)[1].strip()
-                    # parse the JSON string
-                    results_xc_data = json.loads(json_str)
-        param_dict = dict()
-        Tmid = results_xc_data["Tc"]  # NOTE: units are BJD_TBD
-        param_dict["Tmid"] = float(Tmid["value"])
-        param_dict["Tmid_unc"] = float(Tmid["uncertainty"])
-        rp = results_xc_data["Rp/R*"]
-        param_dict["Rp/R*"] = float(rp["value"])
-        param_dict["Rp/R*_unc"] = float(rp["uncertainty"])
-        a = results_xc_data["a/R*"]
-        param_dict["a/R*"] = float(a["value"])
-        param_dict["a/R*_unc"] = float(a["uncertainty"])
-        Am1 = results_xc_data["Am1"]
-        param_dict["Am1"] = float(Am1["value"])
-        param_dict["Am1_unc"] = float(Am1["uncertainty"])
-        Am2 = results_xc_data["Am2"]
-        param_dict["Am2"] = float(Am2["value"])
-        param_dict["Am2_unc"] = float(Am2["uncertainty"])
-        dur = results_xc_data["Duration"]
-        param_dict["Duration"] = float(dur["value"])
-        param_dict["Duration_unc"] = float(dur["uncertainty"])
-        return param_dict
+        return aavso_reports.parse_results(self.load_report()["results"])
 
     def parse_priors(self):   
-        txt_name = f"AAVSO_{self.PlanetName}_{self.ObservationDate}.txt"
-        data_directory = os.path.join(self.TransitDirectory, self.ExoticOutputDirectory)     
-        with open(os.path.join(data_directory, txt_name)) as fn:
-            for line in fn: 
-                if line.startswith("#PRIORS-XC"):
-                    # extract the JSON-like string part
-                    json_str = line.split("=", 1)[1].strip()
-                    # parse the JSON string
-                    priors_xc_data = json.loads(json_str)
-        param_dict = dict()
-        period = priors_xc_data["Period"]
-        param_dict["per"] = float(period["value"])
-        param_dict["per_unc"] = float(period["uncertainty"])
-        rp = priors_xc_data["Rp/R*"]
-        param_dict["Rp/R*"] = float(rp["value"])
-        param_dict["Rp/R*_unc"] = float(rp["uncertainty"])
-        a = priors_xc_data["a/R*"]
-        param_dict["a/R*"] = float(a["value"])
-        param_dict["a/R*_unc"] = float(a["uncertainty"])
-        inc = priors_xc_data["inc"]
-        param_dict["inc"] = float(inc["value"])
-        param_dict["inc_unc"] = float(inc["uncertainty"])
-        ecc = priors_xc_data["ecc"]
-        param_dict["ecc"] = float(ecc["value"])
-        param_dict["ecc_unc"] = ecc["uncertainty"]
-        param_dict["u"] =[float(priors_xc_data["u0"]["value"]), float(priors_xc_data["u1"]["value"]),
-                        float(priors_xc_data["u2"]["value"]), float(priors_xc_data["u3"]["value"])]                             
-        return param_dict
+        return aavso_reports.parse_priors(self.load_report()["priors"])
 
     def build_param_object(self, use_exotic_data=False):
         if use_exotic_data:
@@ -164,7 +248,10 @@ class fit_transit_depth():
         def calc_batman_curve(time, rp):
             params = self.BatmanParams  # starts with priors
             params.rp = rp
-            m = batman.TransitModel(params, time)
+            if self.SupersampleFactor > 1:
+                # integrate over the exposure, only supersampling ingress & egress
+                return calc_supersampled_flux(time, params, self.SupersampleFactor, self.ExpTime)
+            m = batman_model_cache.get_model(params, time)  # reuses one model across curve_fit iterations
             flux = m.light_curve(params)
             return flux
         
@@ -180,6 +267,47 @@ class fit_transit_depth():
         print(self.Priors["Rp/R*"])
         return [fit_rp, fit_rp_unc], fit_rp_flux
 
+    def fit_transit_params(self, free_params=FULL_FIT_PARAMS, max_iterations=100):
+        """Levenberg-Marquardt fit of the transit x airmass model (calc_airmass_transit_model), starting from
+        the EXOTIC Tmid and airmass terms and the priors. Every iteration is one batched model call, where
+        curve_fit needs one per free parameter for its finite-difference Jacobian. Without an airmass column
+        Am2 is not fit and Am1 is just the baseline level.
+
+        returns dict of the fit values and their uncertainties ("<name>_unc"), "chi_sq" and "n_model_calls", 
+        and the flux of the fit"""
+        time = np.asarray(self.PhotData["BJD_TDB"], dtype=float)
+        flux = np.asarray(self.PhotData["flux"], dtype=float)
+        error = np.asarray(self.PhotData["error"], dtype=float)
+        airmass = self.PhotData.get("airmass")
+        if airmass is None:
+            free_params = [name for name in free_params if name != "Am2"]
+        prior_params = self.build_param_object()
+        params = {"Tmid": self.ExoticResults["Tmid"], "per": prior_params.per, "rp": prior_params.rp, "a": prior_params.a,
+                  "inc": prior_params.inc, "ecc": prior_params.ecc, "w": prior_params.w, "u": list(prior_params.u), 
+                  "limb_dark": prior_params.limb_dark, "Am1": self.ExoticResults["Am1"], 
+                  "Am2": self.ExoticResults["Am2"] if airmass is not None else 0.}
+        # batman's step-size search is most of the cost of a nonlinear-law model, so it's done once per fit
+        fac = batman_model_cache.get_model(prior_params, time).fac
+        
+        def model_and_jacobian(x):
+            return calc_airmass_transit_model(time, airmass, dict(params, **dict(zip(free_params, x))), free_params,
+                                              self.SupersampleFactor, self.ExpTime, fac)
+        
+        x, covariance, chi_sq, n_calls = fit_levenberg_marquardt(model_and_jacobian, [params[name] for name in free_params],
+                                                                 flux, error, max_iterations)
+        fit = dict(params, chi_sq=chi_sq, n_model_calls=n_calls)
+        for name, value, unc in zip(free_params, x, np.sqrt(np.diag(covariance))):
+            fit[name] = value
+            fit[name + "_unc"] = unc
+        # inclinations past 90 deg are the same orbit seen from the other side
+        if fit["inc"] > 90.:
+            fit["inc"] = 180. - fit["inc"]
+        fit_flux = model_and_jacobian(x)[0]
+        print("fit depth:", (fit["rp"]**2)*100)
+        print("fit mid-time:", fit["Tmid"], "+/-", fit.get("Tmid_unc"))
+        print("model calls:", n_calls)
+        return fit, fit_flux
+
     def plot_transit(self, save=False):
         fig = plt.figure(figsize=(16, 9))
         ax = fig.add_subplot(111)
@@ -193,7 +321,8 @@ class fit_transit_depth():
         prior_flux = prior_curve.light_curve(exotic_params)
         ax.plot(time, prior_flux, linewidth = 1.0, color="k", label="EXOTIC fit")
         # plot our fitted transit light curve
-        ax.plot(time, self.FitFlux, linewidth=1.5, color=self.BoiseStateOrange, label="Fit Rp only")
+        fit_label = "Fit Tmid, Rp, a/R*, inc, airmass" if self.FitMode == "full" else "Fit Rp only"
+        ax.plot(time, self.FitFlux, linewidth=1.5, color=self.BoiseStateOrange, label=fit_label)
         # set plot formatting
         ax.grid(True)
         ax.tick_params(labelsize=20)
@@ -203,17 +332,21 @@ class fit_transit_depth():
         # use the fit rp to calc the transit depth & add to plot with midtime
         depth = self.RpFit[0]**2
         depth_unc = self.RpFit[1]**2
-        textstr = '\n'.join((f"Mid-transit time = {self.ExoticResults["Tmid"]:.4f}" + r" $\pm$ " + f"{self.ExoticResults["Tmid_unc"]:.6f}",
+        # the mid-time is EXOTIC's unless we fit it too
+        tmid, tmid_unc = ((self.TransitFit["Tmid"], self.TransitFit["Tmid_unc"]) if self.FitMode == "full" 
+                          else (self.ExoticResults["Tmid"], self.ExoticResults["Tmid_unc"]))
+        textstr = '\n'.join((f"Mid-transit time = {tmid:.4f}" + r" $\pm$ " + f"{tmid_unc:.6f}",
                              f"Depth =  {depth:.4f}" + r" $\pm$ " + f"{depth_unc:.4f}"))                
         ax.text(0.05, 0.05, textstr, transform=ax.transAxes, fontsize=16,
                 verticalalignment='bottom')
         if save: 
+            fit_name = "FitFull" if self.FitMode == "full" else "FitRponly"
             if self.TelescopeName is not None:
-                fig.savefig(f"{self.TransitDirectory}/{self.TelescopeName}_{self.PlanetName}_{self.ObservationDate}_LC_FitRponly.png", dpi=300, bbox_inches="tight")
-                print(f"Figure saved to {self.TransitDirectory}/{self.TelescopeName}_{self.PlanetName}_{self.ObservationDate}_LC_FitRponly.png")
+                fig.savefig(f"{self.TransitDirectory}/{self.TelescopeName}_{self.PlanetName}_{self.ObservationDate}_LC_{fit_name}.png", dpi=300, bbox_inches="tight")
+                print(f"Figure saved to {self.TransitDirectory}/{self.TelescopeName}_{self.PlanetName}_{self.ObservationDate}_LC_{fit_name}.png")
             else:
-                fig.savefig(f"{self.TransitDirectory}/{self.PlanetName}_{self.ObservationDate}_LC_FitRponly_priors.png", dpi=300, bbox_inches="tight")
-                print(f"Figure saved to {self.TransitDirectory}/{self.PlanetName}_{self.ObservationDate}_LC_FitRponly.png")
+                fig.savefig(f"{self.TransitDirectory}/{self.PlanetName}_{self.ObservationDate}_LC_{fit_name}_priors.png", dpi=300, bbox_inches="tight")
+                print(f"Figure saved to {self.TransitDirectory}/{self.PlanetName}_{self.ObservationDate}_LC_{fit_name}.png")
         else:
             plt.show()
 
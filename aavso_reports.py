@@ -0,0 +1,255 @@
+# One reader for the AAVSO reports written by EXOTIC, shared by all of the plotting/fitting scripts.
+import os
+import json
+import numpy as np
+from collections import OrderedDict
+
+# names of the data columns in an EXOTIC AAVSO report (#DATE,DIFF,ERR,DETREND_1,DETREND_2)
+PHOT_COLUMNS = ("BJD_TDB", "flux", "error", "detrend_1", "detrend_2")
+
+# parsed reports, keyed by absolute path -> ((mtime, size), report), least recently used first; only the
+# REPORT_CACHE_SIZE most recently read reports are kept so long compile runs don't hold every report
+REPORT_CACHE_SIZE = 64
+_report_cache = OrderedDict()
+
+# binary copies of the reports are kept in this folder next to the reports (like __pycache__)
+SIDECAR_DIRECTORY = ".aavso_cache"
+
+def parse_header(header_lines):
+    '''Turns the "#KEY=VALUE" header lines of a report into a dictionary.
+    The #RESULTS-XC and #PRIORS-XC blocks are JSON and are decoded.
+
+    Parameters
+    ----------
+    header_lines : list[str]
+        Lines of the report that start with "#".
+
+    Returns
+    -------
+    dict
+    '''
+    header = dict()
+    for line in header_lines:
+        if "=" not in line:
+            continue
+        key, value = line[1:].split("=", 1)
+        key, value = key.strip(), value.strip()
+        if key in ("RESULTS-XC", "PRIORS-XC"):
+            value = json.loads(value)
+        header[key] = value
+    return header
+
+def read_report_text(file_path):
+    '''Reads an AAVSO report in a single pass over the file: header lines are collected and every
+    other non-empty line is handed to numpy as comma separated data.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the AAVSO report.
+
+    Returns
+    -------
+    header_lines : list[str]
+        Lines starting with "#", in order (includes the "#DATE,DIFF,..." column line).
+    data : np.ndarray[float]
+        2D array of the photometry, one row per data point.
+    '''
+    header_lines = []
+    data_lines = []
+    with open(file_path) as fn:
+        for line in fn:
+            if line.startswith("#"):
+                header_lines.append(line.rstrip("\n"))
+            elif line.strip():
+                data_lines.append(line)
+    data = np.loadtxt(data_lines, delimiter=",", ndmin=2)
+    return header_lines, data
+
+def sidecar_paths(file_path):
+    '''Paths of the binary data (.npy) and header (.json) sidecars of a report.'''
+    directory, name = os.path.split(os.path.abspath(file_path))
+    base = os.path.join(directory, SIDECAR_DIRECTORY, name)
+    return base + ".npy", base + ".json"
+
+def read_sidecar(file_path, signature):
+    '''Loads a report from its sidecar if one exists for this exact version (mtime, size) of the text file.
+
+    Returns
+    -------
+    (header_lines, header, data) or None
+        data is memory-mapped read-only from the .npy file.
+    '''
+    npy_path, json_path = sidecar_paths(file_path)
+    try:
+        with open(json_path) as f:
+            meta = json.load(f)
+        if (meta["source_mtime_ns"], meta["source_size"]) != tuple(signature):
+            return None
+        data = np.load(npy_path, mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    return meta["header_lines"], meta["header"], data
+
+def write_sidecar(file_path, signature, header_lines, header, data):
+    '''Writes the binary sidecar of a report. The header is written last, so a sidecar is only ever used
+    once both files are complete. Directories we can't write to just don't get a cache.'''
+    npy_path, json_path = sidecar_paths(file_path)
+    meta = {"source_mtime_ns": signature[0], "source_size": signature[1], 
+            "header_lines": header_lines, "header": header}
+    try:
+        os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+        with open(npy_path + ".tmp", "wb") as f:
+            np.save(f, data)
+        os.replace(npy_path + ".tmp", npy_path)
+        with open(json_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(json_path + ".tmp", json_path)
+    except OSError:
+        pass
+
+def read_aavso_report(file_path, use_sidecar=True):
+    '''Reads an EXOTIC AAVSO report once and returns the photometry, priors and results together.
+
+    Reports are memoized on (path, modification time, size), so a plotting session that asks for
+    the same report many times only parses it once; the REPORT_CACHE_SIZE most recently used reports
+    are kept. With use_sidecar the first read also writes a binary copy to .aavso_cache/ next to the 
+    report, and later sessions memory-map that instead of parsing the text; the sidecar is ignored (and
+    rewritten) as soon as the report changes. The arrays are shared between calls and are read-only; 
+    copy them before modifying in place.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the AAVSO report.
+    use_sidecar : bool
+        Read from/write to the binary sidecar cache.
+
+    Returns
+    -------
+    dict
+        "BJD_TDB", "flux", "error" (and "detrend_1", "detrend_2" when present) 1D arrays,
+        "data" the full 2D array, "header" all "#KEY=VALUE" entries, "header_lines" the raw header,
+        and "results"/"priors" the decoded #RESULTS-XC/#PRIORS-XC blocks (None if missing).
+    '''
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _report_cache.get(path)
+    if cached is None or cached[0] != signature:
+        sidecar = read_sidecar(path, signature) if use_sidecar else None
+        if sidecar is not None:
+            header_lines, header, data = sidecar
+        else:
+            header_lines, data = read_report_text(path)
+            header = parse_header(header_lines)
+            if use_sidecar:
+                write_sidecar(path, signature, header_lines, header, data)
+            data.setflags(write=False)
+        cached = (signature, {"data": data, "header_lines": header_lines, "header": header})
+        _report_cache[path] = cached
+        while len(_report_cache) > REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+    _report_cache.move_to_end(path)
+    report = dict(cached[1])
+    for idx, name in enumerate(PHOT_COLUMNS[:report["data"].shape[1]]):
+        report[name] = report["data"][:, idx]
+    report["results"] = report["header"].get("RESULTS-XC")
+    report["priors"] = report["header"].get("PRIORS-XC")
+    return report
+
+def write_aavso_report(file_path, columns, header_lines=None, round_columns=None, chunk_size=100000):
+    '''Writes an AAVSO report, formatting whole blocks of rows at once.
+
+    Rows are written in chunks of chunk_size: each chunk is turned into text with a single string
+    format operation and handed to the file in one buffered write, so even multi-million row reports
+    never hold more than one chunk of text in memory. Values are written with their shortest exact
+    representation, like the original per-line f-string writer.
+
+    Parameters
+    ----------
+    file_path : str
+        Where to write the report.
+    columns : list[np.ndarray[float]]
+        Data columns in file order (e.g. BJD_TDB, flux, error, detrend_1, detrend_2).
+    header_lines : list[str], optional
+        "#..." header lines to carry forward (e.g. read_aavso_report(...)["header_lines"]), including
+        the #RESULTS-XC/#PRIORS-XC blocks. The "#DATE,DIFF,ERR,DETREND_1,DETREND_2" column line is
+        added if it is missing.
+    round_columns : dict[int, int], optional
+        Column index -> number of decimals to round that column to.
+    chunk_size : int
+        Number of rows formatted and written per write call.
+    '''
+    header_lines = [line.rstrip("\n") for line in (header_lines or [])]
+    if not any(line.startswith("#DATE") for line in header_lines):
+        header_lines.append("#DATE,DIFF,ERR,DETREND_1,DETREND_2")
+    columns = [np.asarray(col, dtype=float) for col in columns]
+    if round_columns:
+        columns = [np.round(col, round_columns[idx]) if idx in round_columns else col for idx, col in enumerate(columns)]
+    row_format = ", ".join(["%r"]*len(columns)) + "\n"
+    n_rows = len(columns[0])
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(header_lines) + "\n")
+        for start in range(0, n_rows, chunk_size):
+            chunk = np.column_stack([col[start:start + chunk_size] for col in columns])
+            f.write((row_format*len(chunk)) % tuple(chunk.ravel().tolist()))
+
+def clear_report_cache():
+    _report_cache.clear()
+
+def parse_results(results_xc_data):
+    '''Pulls the EXOTIC fit results out of a decoded #RESULTS-XC block.'''
+    param_dict = dict()
+    Tmid = results_xc_data["Tc"]  # NOTE: units are BJD_TBD
+    param_dict["Tmid"] = float(Tmid["value"])
+    param_dict["Tmid_unc"] = float(Tmid["uncertainty"])
+    rp = results_xc_data["Rp/R*"]
+    param_dict["Rp/R*"] = float(rp["value"])
+    param_dict["Rp/R*_unc"] = float(rp["uncertainty"])
+    a = results_xc_data["a/R*"]
+    param_dict["a/R*"] = float(a["value"])
+    param_dict["a/R*_unc"] = float(a["uncertainty"])
+    Am1 = results_xc_data["Am1"]
+    param_dict["Am1"] = float(Am1["value"])
+    param_dict["Am1_unc"] = float(Am1["uncertainty"])
+    Am2 = results_xc_data["Am2"]
+    param_dict["Am2"] = float(Am2["value"])
+    param_dict["Am2_unc"] = float(Am2["uncertainty"])
+    dur = results_xc_data["Duration"]
+    param_dict["Duration"] = float(dur["value"])
+    param_dict["Duration_unc"] = float(dur["uncertainty"])
+    return param_dict
+
+def parse_priors(priors_xc_data):
+    '''Pulls the priors EXOTIC used out of a decoded #PRIORS-XC block.'''
+    param_dict = dict()
+    period = priors_xc_data["Period"]
+    param_dict["per"] = float(period["value"])
+    param_dict["per_unc"] = float(period["uncertainty"])
+    rp = priors_xc_data["Rp/R*"]
+    param_dict["Rp/R*"] = float(rp["value"])
+    param_dict["Rp/R*_unc"] = float(rp["uncertainty"])
+    a = priors_xc_data["a/R*"]
+    param_dict["a/R*"] = float(a["value"])
+    param_dict["a/R*_unc"] = float(a["uncertainty"])
+    inc = priors_xc_data["inc"]
+    param_dict["inc"] = float(inc["value"])
+    param_dict["inc_unc"] = float(inc["uncertainty"])
+    ecc = priors_xc_data["ecc"]
+    param_dict["ecc"] = float(ecc["value"])
+    param_dict["ecc_unc"] = ecc["uncertainty"]
+    param_dict["u"] =[float(priors_xc_data["u0"]["value"]), float(priors_xc_data["u1"]["value"]),
+                      float(priors_xc_data["u2"]["value"]), float(priors_xc_data["u3"]["value"])]
+    return param_dict
+
+def parse_final_params(report):
+    '''Combined parameters used to draw the EXOTIC model: fit Tmid, Rp/R*, airmass terms and duration
+    from the results, with a/R*, period, inc, ecc and limb darkening from the priors.'''
+    results = parse_results(report["results"])
+    priors = parse_priors(report["priors"])
+    param_dict = {key: results[key] for key in ("Tmid", "Tmid_unc", "Rp/R*", "Rp/R*_unc", "Am1", "Am1_unc",
+                                                "Am2", "Am2_unc", "Duration", "Duration_unc")}
+    for key in ("a/R*", "a/R*_unc", "per", "per_unc", "inc", "inc_unc", "ecc", "ecc_unc", "u"):
+        param_dict[key] = priors[key]
+    return param_dict
@@ -0,0 +1,302 @@
+# quick timing checks for the faster model/fitting paths. Run with: python benchmarks.py
+import os
+import json
+import time
+import tempfile
+import batman
+import numpy as np
+from utils import *
+import aavso_reports
+from time_converter import convert_times, convert_times_batch, convert_times_interpolated
+from ephemeris import fit_ephemeris, calc_running_BIC, calc_sufficient_stats, solve_ephemeris, calc_transit_time_bands
+from ttv_periodogram import calc_ttv_periodogram, calc_bootstrap_false_alarm
+
+def time_call(func, n_repeat=10):
+    '''Returns the best wall time (seconds) of n_repeat calls to func.'''
+    best = np.inf
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchmark_transit_window(n_repeat=10):
+    '''Full vs transit-window-restricted calc_batman_curve on a synthetic 27 day, 2 min cadence TESS sector.'''
+    # HAT-P-37 b like system
+    t0, per, rp, a, inc = 2459000.5, 2.797436, 0.1378, 9.32, 86.9
+    tess_time = np.arange(2459000., 2459027., 2./1440)
+    n_window = calc_transit_window_indices(tess_time, t0, per, rp, a, inc).size
+    print(f"Synthetic TESS sector: {tess_time.size} points, {n_window} ({100*n_window/tess_time.size:.1f}%) inside transit windows")
+    for limb_dark, u in [("uniform", []), ("quadratic", [0.4, 0.2]), ("nonlinear", [0.35, 0.2, 0.1, -0.05])]:
+        full = calc_batman_curve(tess_time, t0, per, rp, a, inc, u, limb_dark=limb_dark)
+        windowed = calc_batman_curve(tess_time, t0, per, rp, a, inc, u, limb_dark=limb_dark, transit_window=True)
+        # new t0 each call, like a fit, so batman has to recompute the geometry every time
+        t0_steps = iter(t0 + 1.0e-6*np.arange(2*n_repeat))
+        t_full = time_call(lambda: calc_batman_curve(tess_time, next(t0_steps), per, rp, a, inc, u, limb_dark=limb_dark), n_repeat)
+        t_window = time_call(lambda: calc_batman_curve(tess_time, next(t0_steps), per, rp, a, inc, u, limb_dark=limb_dark, 
+                                                       transit_window=True), n_repeat)
+        print(f"{limb_dark:>10}: full {1e3*t_full:7.2f} ms, windowed {1e3*t_window:7.2f} ms ({t_full/t_window:5.1f}x faster), "
+              f"max difference {np.max(np.abs(full - windowed)):.1e}")
+    print("(the nonlinear law is dominated by its in-transit integration, which both paths have to do)")
+
+def write_synthetic_reports(directory, n_reports, n_points=400):
+    '''Writes n_reports EXOTIC-style AAVSO reports (header blocks + 5 data columns) to directory.'''
+    rng = np.random.default_rng(42)
+    results = {key: {"value": "1.0", "uncertainty": "0.01"} for key in ("Tc", "Rp/R*", "a/R*", "Am1", "Am2", "Duration")}
+    priors = {key: {"value": "1.0", "uncertainty": "0.01"} for key in ("Period", "Rp/R*", "a/R*", "inc", "ecc", "u0", "u1", "u2", "u3")}
+    paths = []
+    for idx in range(n_reports):
+        data = np.column_stack((2460000. + idx + np.linspace(0., 0.2, n_points), rng.normal(1., 0.002, n_points), 
+                                np.full(n_points, 0.002), rng.normal(1., 0.01, n_points), rng.normal(0.3, 0.01, n_points)))
+        path = os.path.join(directory, f"AAVSO_Synthetic b_{idx:04d}.txt")
+        with open(path, "w") as f:
+            f.write(f"#TYPE=EXOPLANET\n#OBSCODE=BSU\n#RESULTS-XC={json.dumps(results)}\n#PRIORS-XC={json.dumps(priors)}\n")
+            f.write("#DATE,DIFF,ERR,DETREND_1,DETREND_2\n")
+            np.savetxt(f, data, delimiter=", ", fmt="%.7f")
+        paths.append(path)
+    return paths
+
+def benchmark_report_sidecars(n_reports=1000):
+    '''Cold (text parse + sidecar write) vs warm (memory-mapped sidecar) loads of a directory of AAVSO reports.'''
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_synthetic_reports(directory, n_reports)
+        timings = dict()
+        for label, use_sidecar in [("text only (np.loadtxt)", False), ("cold (writes sidecars)", True), ("warm (sidecars)", True)]:
+            aavso_reports.clear_report_cache()  # a new session, so nothing is memoized in memory
+            start = time.perf_counter()
+            for path in paths:
+                aavso_reports.read_aavso_report(path, use_sidecar=use_sidecar)
+            timings[label] = time.perf_counter() - start
+        print(f"Loading {n_reports} synthetic AAVSO reports:")
+        for label, seconds in timings.items():
+            print(f"{label:>24}: {seconds:6.2f} s")
+        print(f"warm sidecar loads are {timings['text only (np.loadtxt)']/timings['warm (sidecars)']:.1f}x faster than parsing the text")
+
+
+def benchmark_barycentric_batch(n_times=100000, n_sites=5, n_targets=20, n_loop=500):
+    '''convert_times_batch vs a loop over convert_times for n_times time stamps across sites and targets.
+    The loop is timed on the first n_loop rows and scaled up, since the full loop takes many minutes.'''
+    rng = np.random.default_rng(42)
+    targets = {f"target_{idx}": (rng.uniform(0., 360.), rng.uniform(-30., 70.)) for idx in range(n_targets)}
+    sites = {f"site_{idx}": (rng.uniform(-180., 180.), rng.uniform(-40., 50.)) for idx in range(n_sites)}
+    times = 2460000. + rng.uniform(0., 365., n_times)
+    target_ids = rng.choice(list(targets), n_times)
+    site_ids = rng.choice(list(sites), n_times)
+    start = time.perf_counter()
+    batch = convert_times_batch(times, "jd", "utc", target_ids, site_ids, targets, sites)
+    t_batch = time.perf_counter() - start
+    start = time.perf_counter()
+    looped = np.array([convert_times(times[idx], "jd", "utc", targets[target_ids[idx]], sites[site_ids[idx]]) for idx in range(n_loop)])
+    t_loop = (time.perf_counter() - start)*n_times/n_loop
+    print(f"BJD_TDB conversion of {n_times} times ({n_sites} sites x {n_targets} targets):")
+    print(f"loop over convert_times: {t_loop:8.1f} s (extrapolated from {n_loop} rows)")
+    print(f"convert_times_batch:     {t_batch:8.1f} s  ({t_loop/t_batch:.0f}x faster), "
+          f"max difference {86400*np.max(np.abs(batch[:n_loop] - looped)):.1e} s")
+
+
+def benchmark_interpolated_ltt(n_frames=5000):
+    '''Exact vs grid-interpolated BJD_TDB conversion of a 5,000 frame night (TrES-3 b from Boise State).'''
+    tres3_objcoords = [267.927808748, 37.5897197633]
+    bsu_obscoords = [-116.19, 43.590500]
+    frames = 2460478.12 + np.arange(n_frames)*6./86400  # 6 s cadence, crosses 00:00 UTC
+    start = time.perf_counter()
+    exact = convert_times(frames, "jd", "utc", tres3_objcoords, bsu_obscoords)
+    t_exact = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        convert_times_interpolated(frames, "jd", "utc", tres3_objcoords, bsu_obscoords, cache_dir=cache_dir)
+        t_cold = time.perf_counter() - start
+        start = time.perf_counter()
+        interpolated = convert_times_interpolated(frames, "jd", "utc", tres3_objcoords, bsu_obscoords, cache_dir=cache_dir)
+        t_warm = time.perf_counter() - start
+    print(f"BJD_TDB conversion of a {n_frames} frame night:")
+    print(f"exact convert_times:            {t_exact:6.3f} s")
+    print(f"interpolated, grids computed:   {t_cold:6.3f} s")
+    print(f"interpolated, grids from disk:  {t_warm:6.3f} s  ({t_exact/t_warm:.0f}x faster), "
+          f"max difference {1e6*86400*np.max(np.abs(exact - interpolated)):.0f} us (float64 JD resolution)")
+
+
+def benchmark_running_bic(n_epochs=1000, n_loop=200):
+    '''Running Delta BIC from prefix sufficient statistics vs refitting every prefix of a synthetic decay signal.'''
+    rng = np.random.default_rng(1)
+    epochs = np.sort(rng.choice(5000, n_epochs, replace=False))
+    sigma = rng.uniform(2.e-4, 1.e-3, n_epochs)
+    mid_times = 2455642.14768 + 2.797436*epochs + 0.5*-1.e-9*epochs**2 + rng.normal(0., sigma)
+    def refit_prefixes(n_prefixes):
+        return [fit_ephemeris(epochs[:i + 1], mid_times[:i + 1], sigma[:i + 1], "linear").BIC - 
+                fit_ephemeris(epochs[:i + 1], mid_times[:i + 1], sigma[:i + 1], "quadratic").BIC for i in range(3, n_prefixes)]
+    t_loop = time_call(lambda: refit_prefixes(n_loop), 1)*(n_epochs - 3)/(n_loop - 3)
+    t_running = time_call(lambda: calc_running_BIC(epochs, mid_times, sigma))
+    difference = np.max(np.abs(np.array(refit_prefixes(n_loop)) - calc_running_BIC(epochs, mid_times, sigma)["delta_BIC"][3:n_loop]))
+    stats = calc_sufficient_stats(epochs, mid_times, sigma)
+    t_solve = time_call(lambda: solve_ephemeris(stats), 100)
+    print(f"Running Delta BIC over {n_epochs} epochs: refitting every prefix {t_loop:.3f} s (extrapolated from {n_loop}), "
+          f"sufficient statistics {1e3*t_running:.2f} ms ({t_loop/t_running:.0f}x faster), max difference {difference:.1e}")
+    print(f"One ephemeris update from stored statistics: {1e6*t_solve:.0f} us")
+
+
+def benchmark_ttv_periodogram(n_epochs=300, n_frequencies=100000, n_bootstraps=100):
+    '''Fast vs exact generalized Lomb-Scargle of synthetic O-C residuals, and the parallel bootstrap FAP.'''
+    rng = np.random.default_rng(2)
+    epochs = np.sort(rng.choice(4000, n_epochs, replace=False))
+    sigma = rng.uniform(0.3, 1.2, n_epochs)
+    oc = 0.5*np.sin(2*np.pi*epochs/137.) + rng.normal(0., sigma)
+    # up to, but not at, 0.5 cycles/epoch, where the power is ill-defined for integer epochs
+    frequency = np.linspace(1.e-5, 0.5, n_frequencies + 1)[:-1]
+    t_fast = time_call(lambda: calc_ttv_periodogram(epochs, oc, sigma, frequency), 3)
+    t_exact = time_call(lambda: calc_ttv_periodogram(epochs, oc, sigma, frequency, method="cython"), 1)
+    difference = np.max(np.abs(calc_ttv_periodogram(epochs, oc, sigma, frequency)["power"] 
+                               - calc_ttv_periodogram(epochs, oc, sigma, frequency, method="cython")["power"]))
+    result = calc_ttv_periodogram(epochs, oc, sigma)
+    t_boot = time_call(lambda: calc_bootstrap_false_alarm(epochs, oc, sigma, result["max_power"], result["frequency"], n_bootstraps), 1)
+    print(f"TTV periodogram of {n_epochs} mid-times at {n_frequencies} frequencies: fast {t_fast:.3f} s, "
+          f"exact {t_exact:.3f} s ({t_exact/t_fast:.0f}x faster), max power difference {difference:.1e}; "
+          f"{n_bootstraps} bootstraps on {os.cpu_count()} CPUs {t_boot:.2f} s")
+
+
+def benchmark_transit_time_bands(n_epochs=1000, n_samples=10000):
+    '''Monte Carlo mid-time uncertainty bands for the next n_epochs transits of a synthetic HAT-P-37 b like fit.'''
+    rng = np.random.default_rng(3)
+    epochs = np.sort(rng.choice(2000, 100, replace=False))
+    sigma = rng.uniform(2.e-4, 1.e-3, len(epochs))
+    fit = fit_ephemeris(epochs, 2455642.14768 + 2.797436*epochs + rng.normal(0., sigma), sigma, "quadratic")
+    future = np.arange(epochs.max() + 1, epochs.max() + 1 + n_epochs)
+    t_bands = time_call(lambda: calc_transit_time_bands(fit, future, n_samples), 3)
+    bands = calc_transit_time_bands(fit, future, n_samples)
+    print(f"Mid-time bands for {n_epochs} future epochs x {n_samples} ephemeris draws: {t_bands:.3f} s "
+          f"(sigma grows from {24*60*bands['sigma'][0]:.1f} to {24*60*bands['sigma'][-1]:.1f} min)")
+
+
+def benchmark_oc_rendering(n_points=5000):
+    '''One scatter artist per point (the old O-C loop) vs one collection per source, saved headless to png and pdf.'''
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from OC_plots import scatter_oc_by_source, unique_legend
+    from timing_catalog import SOURCE_COLORS
+    rng = np.random.default_rng(4)
+    epochs = np.sort(rng.integers(0, 3000, n_points))
+    oc_vals = rng.normal(0., 1., n_points)
+    sources = rng.choice(list(SOURCE_COLORS)[:5], n_points)
+    def per_point(file_path):
+        fig, ax = plt.subplots()
+        for data_point, time, src in zip(epochs, oc_vals, sources):
+            ax.scatter(data_point, time, label=src, color=SOURCE_COLORS[src], zorder=110)
+        handles, labels = ax.get_legend_handles_labels()
+        unique_labels = set(labels)
+        ax.legend([handles[labels.index(label)] for label in unique_labels], list(unique_labels))
+        fig.savefig(file_path)
+        plt.close(fig)
+    def grouped(file_path):
+        fig, ax = plt.subplots()
+        scatter_oc_by_source(ax, epochs, oc_vals, sources)
+        unique_legend(ax)
+        fig.savefig(file_path)
+        plt.close(fig)
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in ("png", "pdf"):
+            file_path = os.path.join(directory, "oc." + extension)
+            t_point = time_call(lambda: per_point(file_path), 1)
+            t_grouped = time_call(lambda: grouped(file_path), 3)
+            print(f"O-C plot of {n_points} points ({extension}): one artist per point {t_point:.2f} s, "
+                  f"one collection per source {t_grouped:.3f} s ({t_point/t_grouped:.0f}x faster)")
+
+
+def benchmark_transit_coverage(n_targets=300, n_days=182):
+    '''Ingress/flat/egress/baseline coverage of every transit of n_targets random targets over a semester at Boise State.'''
+    import pandas as pd
+    from astropy.time import Time
+    import astropy.units as u
+    from transitcalendar import boiseState, predict_transits, evaluate_transit_coverage, get_night_table
+    rng = np.random.default_rng(5)
+    targets = pd.DataFrame({"name": [f"target {idx}" for idx in range(n_targets)], "ra": rng.uniform(0., 360., n_targets),
+                            "dec": rng.uniform(-20., 80., n_targets), "T0": 2460000. + rng.uniform(0., 5., n_targets),
+                            "P": rng.uniform(1., 5., n_targets), "duration": rng.uniform(1.5, 4., n_targets),
+                            "depth": rng.uniform(0.003, 0.03, n_targets), "T0_unc": 0., "P_unc": 0.})
+    start_time = Time("2026-01-01")
+    end_time = start_time + n_days*u.day
+    events = predict_transits(targets, start_time, end_time)
+    # night table cached before timing
+    get_night_table(boiseState, start_time, end_time)
+    t_coverage = time_call(lambda: evaluate_transit_coverage(events, targets), 1)
+    coverage = evaluate_transit_coverage(events, targets)
+    print(f"Coverage of {len(events)} transits of {n_targets} targets over {n_days} days (2 min steps, 1 h baselines): "
+          f"{t_coverage:.2f} s")
+    print(coverage["coverage"].value_counts().to_string())
+
+
+def benchmark_network_schedule(n_targets=300, n_days=182):
+    '''Season plan for one telescope at each of 5 sites and n_targets random targets, by both scheduling methods.'''
+    import pandas as pd
+    import astropy.units as u
+    from astropy.time import Time
+    from astroplan import Observer
+    from network_scheduler import schedule_network
+    rng = np.random.default_rng(6)
+    targets = pd.DataFrame({"name": [f"target {idx}" for idx in range(n_targets)], "ra": rng.uniform(0., 360., n_targets),
+                            "dec": rng.uniform(-20., 80., n_targets), "T0": 2460000. + rng.uniform(0., 5., n_targets),
+                            "P": rng.uniform(1., 5., n_targets), "duration": rng.uniform(1.5, 4., n_targets),
+                            "depth": rng.uniform(0.003, 0.03, n_targets), "T0_unc": 0., "P_unc": 0.})
+    sites = {"BoiseState": (-116.20871, 43.602, 821.), "La Palma": (-17.88, 28.76, 2396.), "Siding Spring": (149.07, -31.27, 1165.),
+             "Mt Lemmon": (-110.79, 32.44, 2790.), "Xinglong": (117.57, 40.39, 900.)}
+    telescopes = [{"name": name, "site": name, "observer": Observer(longitude=lon*u.deg, latitude=lat*u.deg, elevation=elevation*u.m)}
+                  for name, (lon, lat, elevation) in sites.items()]
+    start_time = Time("2026-01-01")
+    end_time = start_time + n_days*u.day
+    # first call builds the night tables and Moon tables
+    schedule_network(telescopes, targets, start_time, end_time)
+    for method in ("intervals", "greedy"):
+        t_schedule = time_call(lambda: schedule_network(telescopes, targets, start_time, end_time, method=method), 1)
+        schedule = schedule_network(telescopes, targets, start_time, end_time, method=method)
+        print(f"{method:>9} schedule of {n_targets} targets x {len(telescopes)} sites over {n_days} days: {t_schedule:.2f} s, "
+              f"{len(schedule)} transits ({np.sum(schedule['coverage'] == 'full')} full), score {schedule['score'].sum():.1f}")
+
+
+def benchmark_full_transit_fit(n_points=400, noise=2.e-3):
+    '''Tmid, Rp/R*, a/R*, inc, Am1, Am2 fit of a synthetic TrES-3 b like light curve with an airmass trend:
+    Levenberg-Marquardt with batched Jacobians vs curve_fit with one model call per parameter, for a 
+    uniform disk and for the nonlinear law of real EXOTIC priors.'''
+    from scipy.optimize import curve_fit
+    from TransitDepthFitting import FULL_FIT_PARAMS, calc_airmass_transit_model, fit_levenberg_marquardt
+    for limb_dark, u in (("uniform", []), ("nonlinear", [0.62, -0.35, 0.72, -0.30])):
+        rng = np.random.default_rng(7)
+        params = {"Tmid": 2460477.8321, "per": 1.30618608, "rp": 0.1655, "a": 5.93, "inc": 81.85, "ecc": 0., "w": 90., "u": u,
+                  "limb_dark": limb_dark, "Am1": 0.98, "Am2": 0.03}
+        time = np.linspace(2460477.70, 2460477.96, n_points)
+        airmass = 1.05 + 150.*(time - time.mean())**2
+        flux = calc_airmass_transit_model(time, airmass, params, ())[0] + rng.normal(0., noise, n_points)
+        error = np.full(n_points, noise)
+        x0 = [params["Tmid"] + 0.002, 0.16, 6.1, 81.3, 1., 0.]
+        # the step size is found once per fit, as fit_transit_depth.fit_transit_params does
+        batman_params = batman.TransitParams()
+        batman_params.t0, batman_params.per, batman_params.rp, batman_params.a, batman_params.inc = x0[0], params["per"], x0[1], x0[2], x0[3]
+        batman_params.ecc, batman_params.w, batman_params.u, batman_params.limb_dark = 0., 90., u, limb_dark
+        fac = batman.TransitModel(batman_params, time[:1]).fac
+        def model_and_jacobian(x):
+            return calc_airmass_transit_model(time, airmass, dict(params, **dict(zip(FULL_FIT_PARAMS, x))), FULL_FIT_PARAMS, fac=fac)
+        n_calls = [0]
+        def model(t, Tmid, rp, a, inc, Am1, Am2):
+            n_calls[0] += 1
+            return calc_batman_curve(t, Tmid, params["per"], rp, a, inc, u, limb_dark)*Am1*np.exp(Am2*airmass)
+        t_lm = time_call(lambda: fit_levenberg_marquardt(model_and_jacobian, x0, flux, error), 5)
+        x, covariance, chi_sq, n_lm = fit_levenberg_marquardt(model_and_jacobian, x0, flux, error)
+        t_cf = time_call(lambda: curve_fit(model, time, flux, sigma=error, p0=x0), 5)
+        n_calls[0] = 0
+        popt, pcov = curve_fit(model, time, flux, sigma=error, p0=x0)
+        print(f"6 parameter {limb_dark} transit fit of {n_points} points: batched Levenberg-Marquardt {1e3*t_lm:.1f} ms, "
+              f"{n_lm} model calls, Tmid = {x[0]:.5f} +/- {np.sqrt(covariance[0, 0])*86400.:.0f} s; curve_fit {1e3*t_cf:.1f} ms, "
+              f"{n_calls[0]} model calls, Tmid = {popt[0]:.5f} +/- {np.sqrt(pcov[0, 0])*86400.:.0f} s (true {params['Tmid']:.5f})")
+
+
+if __name__ == "__main__":
+    benchmark_transit_window()
+    benchmark_report_sidecars()
+    benchmark_barycentric_batch()
+    benchmark_interpolated_ltt()
+    benchmark_running_bic()
+    benchmark_ttv_periodogram()
+    benchmark_transit_time_bands()
+    benchmark_oc_rendering()
+    benchmark_transit_coverage()
+    benchmark_network_schedule()
+    benchmark_full_transit_fit()
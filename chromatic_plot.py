@@ -6,13 +6,15 @@ import matplotlib.pyplot as plt
 import statistics as stat
 
 from utils import *
+from aavso_reports import read_aavso_report
 
 home_dir = os.path.expanduser('~')
 
 def load_transit_data(transit_dir, planet_name, date):
-    red_data = np.loadtxt(os.path.join(transit_dir, "output_red_10min", f"AAVSO_{planet_name}_{date}.txt"), delimiter=",")
-    green_data = np.loadtxt(os.path.join(transit_dir, "output_green_10min", f"AAVSO_{planet_name}_{date}.txt"), delimiter=",")
-    blue_data = np.loadtxt(os.path.join(transit_dir, "output_blue_10min", f"AAVSO_{planet_name}_{date}.txt"), delimiter=",")
+    # copies, since the plotting shifts the time column in place
+    red_data = read_aavso_report(os.path.join(transit_dir, "output_red_10min", f"AAVSO_{planet_name}_{date}.txt"))["data"].copy()
+    green_data = read_aavso_report(os.path.join(transit_dir, "output_green_10min", f"AAVSO_{planet_name}_{date}.txt"))["data"].copy()
+    blue_data = read_aavso_report(os.path.join(transit_dir, "output_blue_10min", f"AAVSO_{planet_name}_{date}.txt"))["data"].copy()
     return red_data, green_data, blue_data
 
 def parse_final_params(transit_dir, output_dir, json_name, txt_name):
@@ -35,13 +37,8 @@ def parse_final_params(transit_dir, output_dir, json_name, txt_name):
     residuals = final_params["Scatter in the residuals of the lightcurve fit is"].split()
     param_dict["residuals"] = float(residuals[0])
     
-    with open(os.path.join(transit_dir, output_dir, txt_name)) as fn:
-        for line in fn: 
-            if line.startswith("#PRIORS-XC"):
-                # extract the JSON-like string part
-                json_str = line.split("=", 1)[1].strip()
-                # parse the JSON string
-                priors_xc_data = json.loads(json_str)
+    # the report was already read (and memoized) by load_transit_data
+    priors_xc_data = read_aavso_report(os.path.join(transit_dir, output_dir, txt_name))["priors"]
     period = priors_xc_data["Period"]
     param_dict["per"] = float(period["value"])
     param_dict["per_unc"] = float(period["uncertainty"])
@@ -1,63 +1,25 @@
 # messy for now, just enough to make this work. 
 import os
 import numpy as np
-import json
 import matplotlib.pyplot as plt
 from utils import *
+import aavso_reports
+from aavso_reports import read_aavso_report
 
 # Use load_phot_data, parse_final_params, calc_model_fit, and plot_data_with_curve 
-def load_phot_data(PlanetName, ObservationDate, TransitDirectory, data_set):
+def report_path(PlanetName, ObservationDate, TransitDirectory, data_set):
         txt_name = f"AAVSO_{PlanetName}_{ObservationDate}_{data_set}.txt"
-        phot_data = np.loadtxt(os.path.join(TransitDirectory, txt_name), delimiter=",")
-        return {"BJD_TDB" : phot_data[:, 0], 
-                "flux" : phot_data[:, 1], 
-                "error" : phot_data[:, 2]}
+        return os.path.join(TransitDirectory, txt_name)
+
+def load_phot_data(PlanetName, ObservationDate, TransitDirectory, data_set):
+        report = read_aavso_report(report_path(PlanetName, ObservationDate, TransitDirectory, data_set))
+        return {"BJD_TDB" : report["BJD_TDB"], 
+                "flux" : report["flux"], 
+                "error" : report["error"]}
 
 def parse_final_params(PlanetName, ObservationDate, TransitDirectory, data_set):
-        txt_name = f"AAVSO_{PlanetName}_{ObservationDate}_{data_set}.txt"    
-        with open(os.path.join(TransitDirectory, txt_name)) as fn:
-            for line in fn: 
-                if line.startswith("#RESULTS-XC"):
-                    # extract the JSON-like string part
-                    json_str = line.split("=", 1)[1].strip()
-                    # parse the JSON string
-                    results_xc_data = json.loads(json_str)
-                elif line.startswith("#PRIORS-XC"):
-                     # extract the JSON-like string part
-                    json_str = line.split("=", 1)[1].strip()
-                    # parse the JSON string
-                    priors_xc_data = json.loads(json_str)
-        param_dict = dict()
-        Tmid = results_xc_data["Tc"]  # NOTE: units are BJD_TBD
-        param_dict["Tmid"] = float(Tmid["value"])
-        param_dict["Tmid_unc"] = float(Tmid["uncertainty"])
-        rp = results_xc_data["Rp/R*"]
-        param_dict["Rp/R*"] = float(rp["value"])
-        param_dict["Rp/R*_unc"] = float(rp["uncertainty"])
-        a = priors_xc_data["a/R*"]
-        param_dict["a/R*"] = float(a["value"])
-        param_dict["a/R*_unc"] = float(a["uncertainty"])
-        per = priors_xc_data["Period"]
-        param_dict["per"] = float(per["value"])
-        param_dict["per_unc"] = float(per["uncertainty"])
-        Am1 = results_xc_data["Am1"]
-        param_dict["Am1"] = float(Am1["value"])
-        param_dict["Am1_unc"] = float(Am1["uncertainty"])
-        Am2 = results_xc_data["Am2"]
-        param_dict["Am2"] = float(Am2["value"])
-        param_dict["Am2_unc"] = float(Am2["uncertainty"])
-        dur = results_xc_data["Duration"]
-        param_dict["Duration"] = float(dur["value"])
-        param_dict["Duration_unc"] = float(dur["uncertainty"])
-        inc = priors_xc_data["inc"]
-        param_dict["inc"] = float(inc["value"])
-        param_dict["inc_unc"] = float(inc["uncertainty"])
-        ecc = priors_xc_data["ecc"]
-        param_dict["ecc"] = float(ecc["value"])
-        param_dict["ecc_unc"] = ecc["uncertainty"]
-        param_dict["u"] =[float(priors_xc_data["u0"]["value"]), float(priors_xc_data["u1"]["value"]),
-                        float(priors_xc_data["u2"]["value"]), float(priors_xc_data["u3"]["value"])]   
-        return param_dict
+        # same (memoized) report as load_phot_data, so the file is only parsed once
+        return aavso_reports.parse_final_params(read_aavso_report(report_path(PlanetName, ObservationDate, TransitDirectory, data_set)))
 
 def calc_model_fit(transit_times, param_dict):
     transit_model = calc_batman_curve(transit_times, param_dict["Tmid"], param_dict["per"], param_dict["Rp/R*"], 
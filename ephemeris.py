@@ -0,0 +1,516 @@
+# Closed-form weighted least-squares ephemerides (linear and quadratic/orbital decay) for O-C analysis.
+import os
+import json
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import least_squares
+from utils import calc_chi_sq, calc_BIC, BoiseState_blue, BoiseState_orange
+
+# number of free parameters of each model: T0, P (and dPdE)
+EPHEMERIS_MODELS = {"linear": 2, "quadratic": 3}
+# names of the parameters, in the order of the design matrix columns
+EPHEMERIS_PARAMS = ("T0", "P", "dPdE")
+# apsidal precession model (nonlinear, so not in EPHEMERIS_MODELS)
+PRECESSION_PARAMS = ("T0", "P", "e", "w0", "dwdE")
+
+# sufficient statistics of each planet for incremental updates are saved here, one file per planet
+EPHEMERIS_STATS_DIRECTORY = os.path.join(os.path.expanduser('~'), ".pychromatic_cache", "ephemeris_stats")
+
+# Weighted sums that fully describe a timing data set for a linear/quadratic fit. Epochs are divided
+# by E_scale and a reference linear ephemeris (T_ref, P_ref) is subtracted from the mid-times first,
+# which keeps the normal equations well conditioned and the chi-squared free of cancellation.
+#   n  : number of points
+#   EE : sum(w*E^j), j = 0..4
+#   EY : sum(w*E^j*y), j = 0..2
+#   YY : sum(w*y^2)
+EphemerisStats = namedtuple("EphemerisStats", ["n", "EE", "EY", "YY", "T_ref", "P_ref", "E_scale"])
+EphemerisFit = namedtuple("EphemerisFit", ["model", "params", "covariance", "uncertainties", "chi_sq", "BIC", "n"])
+
+def calc_ephemeris_model(epochs, T0, P, dPdE=0.):
+    '''Mid-times of a linear (dPdE = 0) or quadratic ephemeris: T0 + P*E + 0.5*dPdE*E^2.'''
+    epochs = np.asarray(epochs, dtype=float)
+    return T0 + P*epochs + 0.5*dPdE*epochs**2
+
+def calc_reference_ephemeris(epochs, mid_times, sigma):
+    '''Weighted linear ephemeris (T0, P), used only to center the data before the real fits.'''
+    w = 1./np.asarray(sigma, dtype=float)**2
+    if len(np.unique(epochs)) < 2:
+        return float(np.average(mid_times, weights=w)), 0.
+    E_mean = np.average(epochs, weights=w)
+    T_mean = np.average(mid_times, weights=w)
+    P_ref = np.sum(w*(epochs - E_mean)*(mid_times - T_mean))/np.sum(w*(epochs - E_mean)**2)
+    return float(T_mean - P_ref*E_mean), float(P_ref)
+
+def calc_sufficient_stats(epochs, mid_times, sigma, T_ref=None, P_ref=None, E_scale=None, cumulative=False):
+    '''Weighted sums needed to fit linear and quadratic ephemerides to a set of mid-times.
+
+    Parameters
+    ----------
+    epochs : array-like of int
+    mid_times : array-like of float
+        Mid-times (BJD_TDB).
+    sigma : array-like of float
+        Mid-time uncertainties (days).
+    T_ref, P_ref : float, optional
+        Reference linear ephemeris subtracted from the mid-times. Defaults to a weighted linear fit to
+        all of the data. Statistics can only be added together if they share T_ref, P_ref and E_scale.
+    E_scale : float, optional
+        Epochs are divided by this. Defaults to the largest |epoch|.
+    cumulative : bool
+        Return the statistics of every prefix of the data (arrays with one row per point) instead of
+        the totals.
+
+    Returns
+    -------
+    EphemerisStats
+    '''
+    epochs = np.asarray(epochs, dtype=float)
+    mid_times = np.asarray(mid_times, dtype=float)
+    w = 1./np.asarray(sigma, dtype=float)**2
+    if T_ref is None or P_ref is None:
+        T_ref, P_ref = calc_reference_ephemeris(epochs, mid_times, sigma)
+    if E_scale is None:
+        E_scale = max(float(np.max(np.abs(epochs))), 1.) if len(epochs) > 0 else 1.
+    E = epochs/E_scale
+    y = mid_times - (T_ref + P_ref*epochs)
+    powers = E[:, None]**np.arange(5)
+    EE = w[:, None]*powers
+    EY = EE[:, :3]*y[:, None]
+    YY = w*y**2
+    if cumulative:
+        return EphemerisStats(np.arange(1, len(E) + 1), np.cumsum(EE, axis=0), np.cumsum(EY, axis=0),
+                              np.cumsum(YY), T_ref, P_ref, E_scale)
+    return EphemerisStats(len(E), EE.sum(axis=0), EY.sum(axis=0), YY.sum(), T_ref, P_ref, E_scale)
+
+def solve_ephemeris(stats, model="quadratic"):
+    '''Solves the weighted normal equations of an ephemeris from its sufficient statistics.
+
+    Works on any number of data sets at once: every leading axis of stats.EE/EY/YY (e.g. one row per
+    prefix from calc_sufficient_stats(..., cumulative=True), or one row per planet) is solved in a
+    single batched call.
+
+    Parameters
+    ----------
+    stats : EphemerisStats
+    model : str
+        "linear" or "quadratic".
+
+    Returns
+    -------
+    params : np.ndarray
+        (..., k) best fit T0, P (and dPdE).
+    covariance : np.ndarray
+        (..., k, k) parameter covariance.
+    chi_sq : np.ndarray
+        (...) chi-squared of the best fit.
+    '''
+    k = EPHEMERIS_MODELS[model]
+    EE, EY, YY = np.asarray(stats.EE), np.asarray(stats.EY), np.asarray(stats.YY)
+    # design matrix columns are 1, E, E^2/2
+    c = np.array([1., 1., 0.5])[:k]
+    idx = np.add.outer(np.arange(k), np.arange(k))
+    A = EE[..., idx]*np.outer(c, c)
+    b = EY[..., :k]*c
+    try:
+        covariance = np.linalg.inv(A)
+    except np.linalg.LinAlgError:
+        # too few distinct epochs somewhere in the batch
+        covariance = np.linalg.pinv(A, hermitian=True)
+    delta = np.einsum("...ij,...j->...i", covariance, b)
+    chi_sq = YY - np.einsum("...i,...i->...", delta, b)
+    # undo the epoch scaling and add back the reference ephemeris
+    scale = float(stats.E_scale)**-np.arange(k)
+    params = delta*scale
+    params[..., 0] += stats.T_ref
+    params[..., 1] += stats.P_ref
+    covariance = covariance*np.outer(scale, scale)
+    return params, covariance, np.maximum(chi_sq, 0.)
+
+def fit_ephemeris(epochs, mid_times, sigma, model="quadratic"):
+    '''Weighted least-squares linear or quadratic ephemeris, solved in closed form.
+
+    Parameters
+    ----------
+    epochs : array-like of int
+    mid_times : array-like of float
+        Mid-times (BJD_TDB).
+    sigma : array-like of float
+        Mid-time uncertainties (days).
+    model : str
+        "linear" (T0 + P*E) or "quadratic" (T0 + P*E + 0.5*dPdE*E^2).
+
+    Returns
+    -------
+    EphemerisFit
+        params and uncertainties are dictionaries keyed by "T0", "P" (and "dPdE"); chi_sq and BIC are
+        from utils.calc_chi_sq/calc_BIC.
+    '''
+    mid_times = np.asarray(mid_times, dtype=float)
+    params, covariance, _ = solve_ephemeris(calc_sufficient_stats(epochs, mid_times, sigma), model)
+    names = EPHEMERIS_PARAMS[:len(params)]
+    model_mid_times = calc_ephemeris_model(epochs, *params)
+    return EphemerisFit(model, dict(zip(names, params)), covariance, dict(zip(names, np.sqrt(np.diag(covariance)))),
+                        calc_chi_sq(mid_times, model_mid_times, sigma), calc_BIC(mid_times, model_mid_times, sigma, len(params)),
+                        len(mid_times))
+
+def calc_running_BIC(epochs, mid_times, sigma, model1="linear", model2="quadratic"):
+    '''chi-squared, BIC and Delta BIC = BIC_model1 - BIC_model2 using only the data up to each epoch.
+
+    Replaces refitting every prefix (as susie's plot_running_delta_bic does): the sufficient statistics
+    of all prefixes come from one cumulative sum and all the prefix fits are solved in one batched call,
+    so the whole curve costs O(N). Data are sorted by epoch first.
+
+    Returns
+    -------
+    dict
+        "epochs" (sorted), "chi_sq" and "BIC" (dictionaries model -> array) and "delta_BIC". Prefixes
+        with no more points than parameters are NaN.
+    '''
+    order = np.argsort(epochs, kind="stable")
+    epochs = np.asarray(epochs)[order]
+    stats = calc_sufficient_stats(epochs, np.asarray(mid_times)[order], np.asarray(sigma)[order], cumulative=True)
+    n = stats.n
+    chi_sq, BIC = dict(), dict()
+    for model in (model1, model2):
+        k = EPHEMERIS_MODELS[model]
+        chi_sq[model] = np.full(len(n), np.nan)
+        BIC[model] = np.full(len(n), np.nan)
+        enough = n > k
+        if np.any(enough):
+            prefix_stats = stats._replace(EE=stats.EE[enough], EY=stats.EY[enough], YY=stats.YY[enough])
+            chi_sq[model][enough] = solve_ephemeris(prefix_stats, model)[2]
+            BIC[model][enough] = chi_sq[model][enough] + k*np.log(n[enough])
+    return {"epochs": epochs, "chi_sq": chi_sq, "BIC": BIC, "delta_BIC": BIC[model1] - BIC[model2]}
+
+def plot_running_delta_bic(epochs, mid_times, sigma, model1="linear", model2="quadratic", ax=None):
+    '''Delta BIC against epoch for all the data up to each epoch (see calc_running_BIC).'''
+    import matplotlib.pyplot as plt
+    running = calc_running_BIC(epochs, mid_times, sigma, model1, model2)
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(6*(16/9), 6))
+    ax.plot(running["epochs"], running["delta_BIC"], color=BoiseState_blue, ls="-", linewidth=2)
+    ax.scatter(running["epochs"], running["delta_BIC"], color=BoiseState_blue, linewidth=2)
+    ax.scatter(running["epochs"][-1], running["delta_BIC"][-1], zorder=10, color=BoiseState_orange,
+               label=rf"Final $\Delta$BIC=BIC$_{{{model1}}}$ - BIC$_{{{model2}}}$={running['delta_BIC'][-1]:.2f}")
+    ax.set_xlabel("Epoch")
+    ax.set_ylabel(r"$\Delta$BIC")
+    ax.legend()
+    return ax
+
+def calc_precession_model(epochs, T0, P, e, w0, dwdE):
+    '''Transit mid-times of an apsidally precessing orbit (Gimenez & Bastero 1995, as in susie):
+    T0 + P*E - (e*Pa/pi)*cos(w0 + dwdE*E), with anomalistic period Pa = P/(1 - dwdE/(2 pi)).
+
+    Parameters broadcast against each other, so arrays of shape (n_sets, 1) evaluate n_sets models
+    on all of the epochs at once. w0 and dwdE are in radians (per epoch).
+    '''
+    epochs = np.asarray(epochs, dtype=float)
+    P_a = P/(1. - dwdE/(2.*np.pi))
+    return T0 + P*epochs - (e*P_a/np.pi)*np.cos(w0 + dwdE*epochs)
+
+def scan_precession_grid(epochs, mid_times, sigma, dwdE_grid):
+    '''Best precession model at each fixed precession rate in dwdE_grid, all solved in one batched call.
+
+    For a fixed dwdE (and Pa ~ P in the small amplitude term) the model is linear in T0, P, e*cos(w0) and
+    e*sin(w0), so every grid point is a 4 parameter weighted least-squares fit.
+
+    Returns
+    -------
+    params : np.ndarray
+        (n_grid, 5) T0, P, e, w0, dwdE.
+    chi_sq : np.ndarray
+        (n_grid,) chi-squared of each fit.
+    '''
+    epochs = np.asarray(epochs, dtype=float)
+    mid_times = np.asarray(mid_times, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    dwdE_grid = np.asarray(dwdE_grid, dtype=float)
+    T_ref, P_ref = calc_reference_ephemeris(epochs, mid_times, sigma)
+    E_scale = max(float(np.max(np.abs(epochs))), 1.)
+    y = (mid_times - (T_ref + P_ref*epochs))/sigma
+    phase = dwdE_grid[:, None]*epochs
+    amplitude = (P_ref/(np.pi*(1. - dwdE_grid/(2.*np.pi))))[:, None]
+    # weighted design matrices, (n_grid, n_points, 4): columns 1, E, and the e*cos(w0), e*sin(w0) terms
+    X = np.empty((len(dwdE_grid), len(epochs), 4))
+    X[..., 0] = 1./sigma
+    X[..., 1] = epochs/E_scale/sigma
+    X[..., 2] = -amplitude*np.cos(phase)/sigma
+    X[..., 3] = amplitude*np.sin(phase)/sigma
+    A = np.einsum("gni,gnj->gij", X, X)
+    b = np.einsum("gni,n->gi", X, y)
+    coeffs = np.linalg.solve(A + 1.e-12*np.eye(4)*np.trace(A, axis1=1, axis2=2)[:, None, None], b[..., None])[..., 0]
+    chi_sq = np.sum(y**2) - np.einsum("gi,gi->g", coeffs, b)
+    params = np.column_stack((T_ref + coeffs[:, 0], P_ref + coeffs[:, 1]/E_scale, np.hypot(coeffs[:, 2], coeffs[:, 3]),
+                              np.arctan2(coeffs[:, 3], coeffs[:, 2]) % (2.*np.pi), dwdE_grid))
+    return params, chi_sq
+
+def refine_precession_fit(epochs, mid_times, sigma, start):
+    '''Levenberg-Marquardt refinement of one precession starting point. Fits e*cos(w0) and e*sin(w0)
+    instead of e and w0 so the fit never sits on the e = 0 boundary.
+
+    Returns
+    -------
+    params : np.ndarray
+        T0, P, e, w0, dwdE.
+    covariance : np.ndarray
+        5x5 covariance of those parameters.
+    chi_sq : float
+    '''
+    T0, P, e, w0, dwdE = start
+    def residuals(x):
+        return (mid_times - calc_precession_model(epochs, T0 + x[0], x[1], np.hypot(x[2], x[3]), np.arctan2(x[3], x[2]), x[4]))/sigma
+    x0 = np.array([0., P, e*np.cos(w0), e*np.sin(w0), dwdE])
+    result = least_squares(residuals, x0, method="lm", x_scale="jac")
+    dT0, P, ecosw, esinw, dwdE = result.x
+    e = np.hypot(ecosw, esinw)
+    w0 = np.arctan2(esinw, ecosw) % (2.*np.pi)
+    # covariance of (T0, P, e*cos(w0), e*sin(w0), dwdE), then propagated to (T0, P, e, w0, dwdE)
+    covariance = np.linalg.pinv(result.jac.T @ result.jac)
+    J = np.eye(5)
+    if e > 0:
+        J[2, 2:4] = [ecosw/e, esinw/e]
+        J[3, 2:4] = [-esinw/e**2, ecosw/e**2]
+    return np.array([T0 + dT0, P, e, w0, dwdE]), J @ covariance @ J.T, float(np.sum(result.fun**2))
+
+def _refine_precession_fit(args):
+    # unpacks the arguments for ProcessPoolExecutor.map
+    return refine_precession_fit(*args)
+
+def fit_precession_ephemeris(epochs, mid_times, sigma, n_starts=16, dwdE_grid=None, max_dwdE=0.1, max_workers=None):
+    '''Apsidal precession ephemeris, fit from many starting points.
+
+    The precession model has many local minima in dwdE. Starting points are the n_starts best local minima
+    of a vectorized scan over precession rates (scan_precession_grid), and each one is refined with
+    refine_precession_fit on a process pool.
+
+    Parameters
+    ----------
+    epochs : array-like of int
+    mid_times : array-like of float
+        Mid-times (BJD_TDB).
+    sigma : array-like of float
+        Mid-time uncertainties (days).
+    n_starts : int
+        Number of starting points to refine.
+    dwdE_grid : array-like of float, optional
+        Precession rates (radians/epoch) to scan. Defaults to 5 points per cycle over the baseline, from
+        half a cycle over the baseline up to max_dwdE (a single rate for baselines too short for that).
+    max_dwdE : float
+        Largest precession rate of the default grid.
+    max_workers : int, optional
+        Number of processes (defaults to one per CPU). 1 refines in this process.
+
+    Returns
+    -------
+    EphemerisFit
+        params/uncertainties keyed by "T0", "P", "e", "w0", "dwdE"; BIC from utils.calc_BIC.
+    '''
+    epochs = np.asarray(epochs, dtype=float)
+    mid_times = np.asarray(mid_times, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    if dwdE_grid is None:
+        baseline = max(float(np.ptp(epochs)), 1.)
+        dwdE_grid = np.arange(np.pi/baseline, max_dwdE, 2.*np.pi/baseline/5.)
+        if len(dwdE_grid) == 0:
+            # short baselines: half a cycle over the baseline is already beyond max_dwdE
+            dwdE_grid = np.array([min(np.pi/baseline, max_dwdE)])
+    dwdE_grid = np.atleast_1d(np.asarray(dwdE_grid, dtype=float))
+    if len(dwdE_grid) == 0:
+        raise ValueError("dwdE_grid is empty, so there are no starting points for the precession fit.")
+    grid_params, grid_chi_sq = scan_precession_grid(epochs, mid_times, sigma, dwdE_grid)
+    # local minima of the scan, best first
+    padded = np.r_[np.inf, grid_chi_sq, np.inf]
+    minima = np.flatnonzero((grid_chi_sq <= padded[:-2]) & (grid_chi_sq <= padded[2:]))
+    starts = grid_params[minima[np.argsort(grid_chi_sq[minima])][:n_starts]]
+    tasks = [(epochs, mid_times, sigma, start) for start in starts]
+    if max_workers == 1 or len(tasks) == 1:
+        results = list(map(_refine_precession_fit, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_refine_precession_fit, tasks))
+    params, covariance, _ = min(results, key=lambda result: result[2])
+    model_mid_times = calc_precession_model(epochs, *params)
+    return EphemerisFit("precession", dict(zip(PRECESSION_PARAMS, params)), covariance,
+                        dict(zip(PRECESSION_PARAMS, np.sqrt(np.diag(covariance)))),
+                        calc_chi_sq(mid_times, model_mid_times, sigma),
+                        calc_BIC(mid_times, model_mid_times, sigma, len(PRECESSION_PARAMS)), len(mid_times))
+
+def compare_ephemeris_models(epochs, mid_times, sigma, **precession_kwargs):
+    '''Linear, quadratic and apsidal precession fits of the same data.
+
+    Returns
+    -------
+    fits : dict
+        model -> EphemerisFit.
+    delta_BIC : dict
+        "quadratic"/"precession" -> BIC_linear - BIC_model (positive favours the model over linear).
+    '''
+    fits = {model: fit_ephemeris(epochs, mid_times, sigma, model) for model in EPHEMERIS_MODELS}
+    fits["precession"] = fit_precession_ephemeris(epochs, mid_times, sigma, **precession_kwargs)
+    delta_BIC = {model: fits["linear"].BIC - fits[model].BIC for model in ("quadratic", "precession")}
+    return fits, delta_BIC
+
+def sample_ephemeris(fit, n_samples=10000, seed=None):
+    '''Draws parameter sets from the fitted (Gaussian) covariance of an ephemeris, all in one step.
+
+    Returns
+    -------
+    np.ndarray
+        (n_samples, k) offsets of the parameters from the best fit, in the order of fit.params.
+        Offsets rather than absolute values keep full precision on T0.
+    '''
+    rng = np.random.default_rng(seed)
+    covariance = np.asarray(fit.covariance)
+    # eigen-decomposition rather than Cholesky so a marginally singular covariance still works
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    transform = eigenvectors*np.sqrt(np.clip(eigenvalues, 0., None))
+    return rng.standard_normal((n_samples, len(covariance))) @ transform.T
+
+def calc_transit_time_bands(fit, epochs, n_samples=10000, quantiles=(0.15865, 0.84135), seed=None, return_samples=False):
+    '''Monte Carlo uncertainty of predicted mid-times: n_samples ephemerides drawn from the fit covariance
+    are evaluated at every epoch in one vectorized step.
+
+    Parameters
+    ----------
+    fit : EphemerisFit
+        Linear, quadratic (from fit_ephemeris/IncrementalEphemeris.fit) or precession fit.
+    epochs : array-like of int
+        Epochs to predict, e.g. the next 1000 transits.
+    n_samples : int
+        Number of ephemeris draws.
+    quantiles : tuple of float
+        Lower and upper quantiles of the band (defaults to +/- 1 sigma).
+    return_samples : bool
+        Also return the (n_epochs, n_samples) predicted mid-time offsets from the best fit (days).
+
+    Returns
+    -------
+    dict
+        "epochs", "mid_times" (best fit, BJD_TDB), "sigma" (standard deviation of the draws, days), and
+        "lower"/"upper" (BJD_TDB at the quantiles).
+    '''
+    epochs = np.asarray(epochs, dtype=float)
+    params = np.array(list(fit.params.values()))
+    offsets = sample_ephemeris(fit, n_samples, seed)
+    if fit.model == "precession":
+        best = calc_precession_model(epochs, *params)
+        draws = (calc_precession_model(epochs[:, None], *(params + offsets).T) - best[:, None])
+    else:
+        # the models are linear in their parameters, so the draws are one matrix product
+        design = np.column_stack((np.ones_like(epochs), epochs, 0.5*epochs**2))[:, :len(params)]
+        best = design @ params
+        draws = design @ offsets.T
+    lower, upper = np.quantile(draws, quantiles, axis=1)
+    bands = {"epochs": epochs, "mid_times": best, "sigma": np.std(draws, axis=1), "lower": best + lower, "upper": best + upper}
+    if return_samples:
+        bands["samples"] = draws
+    return bands
+
+class IncrementalEphemeris():
+    '''Linear and quadratic ephemerides that are updated, not refit, when mid-times are added or removed.
+
+    Only the sufficient statistics (EphemerisStats: weighted normal-equation sums and sum of w*y^2) are
+    kept. Adding a mid-time is a rank-one update of the normal equations and removing one is the matching
+    downdate, so both, and solving for T0, P, dPdE and the BIC afterwards, take constant time no matter
+    how many mid-times the planet has. Removing a mid-time needs the same (epoch, Tc, sigma) that was added.
+
+    Parameters
+    ----------
+    stats : EphemerisStats
+        Totals (not cumulative) from calc_sufficient_stats.
+    planet : str, optional
+    '''
+    def __init__(self, stats, planet=None):
+        self.Stats = stats
+        self.Planet = planet
+
+    @classmethod
+    def from_data(cls, epochs, mid_times, sigma, planet=None):
+        '''Starts from a set of mid-times (e.g. a TimingCatalog selection).'''
+        return cls(calc_sufficient_stats(epochs, mid_times, sigma), planet)
+
+    @classmethod
+    def from_catalog(cls, catalog, planet):
+        '''Starts from every mid-time of planet in a TimingCatalog.'''
+        rows = catalog.PlanetIndex[planet]
+        return cls.from_data(catalog.epoch[rows], catalog.Tc[rows], catalog.sigma[rows], planet)
+
+    @classmethod
+    def empty(cls, T0, P, E_scale=1000., planet=None):
+        '''No mid-times yet; (T0, P) is the prior ephemeris that the data are centered on.'''
+        return cls(EphemerisStats(0, np.zeros(5), np.zeros(3), 0., float(T0), float(P), float(E_scale)), planet)
+
+    def __len__(self):
+        return int(self.Stats.n)
+
+    def _update(self, epochs, mid_times, sigma, sign):
+        stats = self.Stats
+        point = calc_sufficient_stats(np.atleast_1d(epochs), np.atleast_1d(mid_times), np.atleast_1d(sigma),
+                                      stats.T_ref, stats.P_ref, stats.E_scale)
+        self.Stats = stats._replace(n=stats.n + sign*point.n, EE=stats.EE + sign*point.EE, EY=stats.EY + sign*point.EY,
+                                    YY=stats.YY + sign*point.YY)
+        return self
+
+    def add(self, epochs, mid_times, sigma):
+        '''Adds one (scalars) or a few (arrays) mid-times.'''
+        return self._update(epochs, mid_times, sigma, 1)
+
+    def remove(self, epochs, mid_times, sigma):
+        '''Removes mid-times that were added before (same epoch, mid-time and uncertainty).'''
+        if len(self) < np.size(epochs):
+            raise ValueError(f"Can't remove {np.size(epochs)} mid-time(s) from an ephemeris with {len(self)}.")
+        return self._update(epochs, mid_times, sigma, -1)
+
+    def fit(self, model="quadratic"):
+        '''Current best ephemeris from the sufficient statistics.
+
+        Returns
+        -------
+        EphemerisFit
+            chi_sq is from the statistics and BIC = chi_sq + k ln(n), as utils.calc_BIC.
+        '''
+        k = EPHEMERIS_MODELS[model]
+        if len(self) <= k:
+            raise ValueError(f"A {model} ephemeris needs more than {k} mid-times, this one has {len(self)}.")
+        params, covariance, chi_sq = solve_ephemeris(self.Stats, model)
+        names = EPHEMERIS_PARAMS[:k]
+        return EphemerisFit(model, dict(zip(names, params)), covariance, dict(zip(names, np.sqrt(np.diag(covariance)))),
+                            float(chi_sq), float(chi_sq + k*np.log(len(self))), len(self))
+
+    def save(self, file_path):
+        '''Writes the statistics to a JSON file (floats are written exactly), replacing it atomically.'''
+        stats = self.Stats
+        contents = {"planet": self.Planet, "n": int(stats.n), "EE": np.asarray(stats.EE).tolist(), 
+                    "EY": np.asarray(stats.EY).tolist(), "YY": float(stats.YY), "T_ref": float(stats.T_ref), 
+                    "P_ref": float(stats.P_ref), "E_scale": float(stats.E_scale)}
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path + ".tmp", "w") as f:
+            json.dump(contents, f)
+        os.replace(file_path + ".tmp", file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path) as f:
+            contents = json.load(f)
+        return cls(EphemerisStats(contents["n"], np.array(contents["EE"]), np.array(contents["EY"]), contents["YY"],
+                                  contents["T_ref"], contents["P_ref"], contents["E_scale"]), contents["planet"])
+
+def ephemeris_stats_path(planet, directory=EPHEMERIS_STATS_DIRECTORY):
+    '''File the sufficient statistics of planet are kept in.'''
+    return os.path.join(directory, planet.replace(" ", "_") + ".json")
+
+def update_planet_ephemeris(planet, epochs, mid_times, sigma, remove=False, model="quadratic", directory=EPHEMERIS_STATS_DIRECTORY):
+    '''Adds (or removes) mid-times to the saved statistics of planet and returns the updated ephemeris
+    (EphemerisFit), or None while there are still too few mid-times for the model. The statistics have to
+    be started first, e.g. IncrementalEphemeris.from_catalog(...).save(ephemeris_stats_path(planet)).'''
+    file_path = ephemeris_stats_path(planet, directory)
+    ephemeris = IncrementalEphemeris.load(file_path)
+    if remove:
+        ephemeris.remove(epochs, mid_times, sigma)
+    else:
+        ephemeris.add(epochs, mid_times, sigma)
+    ephemeris.save(file_path)
+    if len(ephemeris) <= EPHEMERIS_MODELS[model]:
+        return None
+    return ephemeris.fit(model)
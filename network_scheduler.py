@@ -0,0 +1,189 @@
+# Plans transit observations over a network of telescopes, each with its own site, horizon and constraints.
+import json
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from bisect import bisect_right
+from astroplan import Observer
+from transitcalendar import read_target_catalog, predict_transits, evaluate_transit_coverage, add_timing_precision
+
+# evaluate_transit_coverage keywords a telescope can set for itself
+TELESCOPE_CONSTRAINTS = ("baseline_hours", "min_altitude", "max_airmass", "min_moon_separation", "twilight", "horizon",
+                         "min_coverage")
+# photometric performance a telescope can give (fractional noise per exposure, exposure time in s), for timing precision
+TELESCOPE_PHOTOMETRY = ("noise", "cadence")
+# value of an event by coverage class, for score="transits"
+COVERAGE_SCORES = {"full": 1., "one-sided baseline": 0.8, "no baseline": 0.5, "ingress only": 0.2, "egress only": 0.2,
+                   "partial": 0.1, "unobservable": 0.}
+
+def read_telescope_network(file_path):
+    '''Reads the sites and telescopes of a network from a JSON file like
+    
+        {"sites": {"BoiseState": {"longitude": -116.20871, "latitude": 43.602, "elevation": 821, 
+                                  "timezone": "US/Mountain"}},
+         "telescopes": [{"name": "Annie", "site": "BoiseState", "min_altitude": 25, 
+                         "horizon": [[0, 15], [90, 30], [180, 15], [270, 20]]}]}
+
+    with longitude/latitude in degrees and elevation in m. Each telescope can set any of the 
+    TELESCOPE_CONSTRAINTS (see evaluate_transit_coverage), the rest take its defaults, and its 
+    TELESCOPE_PHOTOMETRY ("noise", "cadence"; see add_timing_precision).
+
+    Returns
+    -------
+    list of dict
+        One dictionary per telescope with "name", "site", "observer" (astroplan Observer) and its constraints
+    '''
+    with open(file_path) as f:
+        network = json.load(f)
+    observers = {name: Observer(longitude=site["longitude"]*u.deg, latitude=site["latitude"]*u.deg,
+                                elevation=site.get("elevation", 0.)*u.m, name=name, timezone=site.get("timezone", "UTC"))
+                 for name, site in network["sites"].items()}
+    telescopes = []
+    for telescope in network["telescopes"]:
+        unknown = [key for key in telescope if key not in ("name", "site") + TELESCOPE_CONSTRAINTS + TELESCOPE_PHOTOMETRY]
+        if unknown:
+            raise ValueError(f"Telescope {telescope['name']} has unknown key(s) {unknown}.")
+        telescopes.append(dict(telescope, observer=observers[telescope["site"]]))
+    return telescopes
+
+def score_coverage(coverage, score="transits"):
+    '''Value of observing each event of a coverage table (evaluate_transit_coverage).
+
+    score is "transits" (COVERAGE_SCORES of the coverage class, i.e. counting full transits with partial
+    credit for the rest), the name of a numeric column of the table, or a function of the table that 
+    returns one value per row.
+    '''
+    if callable(score):
+        return np.asarray(score(coverage), dtype=float)
+    if score == "transits":
+        return coverage["coverage"].map(COVERAGE_SCORES).to_numpy(dtype=float)
+    return coverage[score].to_numpy(dtype=float)
+
+def evaluate_network_coverage(telescopes, targets, start_time, end_time, n_sigma=3., step_minutes=2.):
+    '''Coverage (evaluate_transit_coverage) of every transit of every target from every telescope.
+
+    Transits are predicted once for the whole network; telescopes at the same site with the same 
+    constraints share one evaluation. Telescopes with a "noise" (and optionally "cadence", default 60 s)
+    also get the expected mid-time precision of every transit (add_timing_precision).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (telescope, transit) with "telescope" (name), "telescope_idx" (position in telescopes),
+        "event" (row of predict_transits), the evaluate_transit_coverage columns and, for telescopes with a
+        noise, the add_timing_precision columns
+    '''
+    if isinstance(targets, str):
+        targets = read_target_catalog(targets)
+    events = predict_transits(targets, start_time, end_time, n_sigma)
+    evaluated = dict()
+    tables = []
+    for idx, telescope in enumerate(telescopes):
+        constraints = {key: telescope[key] for key in TELESCOPE_CONSTRAINTS if key in telescope}
+        key = (telescope["site"], json.dumps({key: np.asarray(value).tolist() for key, value in constraints.items()}, 
+                                             sort_keys=True))
+        if key not in evaluated:
+            evaluated[key] = evaluate_transit_coverage(events, targets, telescope["observer"], step_minutes=step_minutes, 
+                                                       **constraints)
+        table = evaluated[key].assign(telescope=telescope["name"], telescope_idx=idx, event=np.arange(len(events)))
+        if "noise" in telescope:
+            table = add_timing_precision(table, targets, telescope["noise"], telescope.get("cadence", 60.))
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+def _schedule_greedy(candidates, n_telescopes, overhead):
+    # best candidates first (earliest end on ties); take one if its event is still free and its telescope is idle
+    order = np.lexsort((candidates["window_end"], -candidates["score"]))
+    starts = [[] for _ in range(n_telescopes)]
+    ends = [[] for _ in range(n_telescopes)]
+    assigned_events = set()
+    chosen = []
+    for row, event, telescope, start, end in zip(order, candidates["event"][order], candidates["telescope_idx"][order],
+                                                 candidates["window_start"][order], candidates["window_end"][order] + overhead):
+        if event in assigned_events:
+            continue
+        # busy intervals of each telescope are kept sorted and never overlap
+        idx = bisect_right(starts[telescope], start)
+        if (idx > 0 and ends[telescope][idx - 1] > start) or (idx < len(starts[telescope]) and starts[telescope][idx] < end):
+            continue
+        starts[telescope].insert(idx, start)
+        ends[telescope].insert(idx, end)
+        assigned_events.add(event)
+        chosen.append(row)
+    return np.array(chosen, dtype=int)
+
+def _schedule_intervals(candidates, n_telescopes, overhead):
+    # telescope by telescope, the best possible set of non-overlapping events still free (weighted interval scheduling)
+    assigned_events = np.zeros(candidates["event"].max() + 1, dtype=bool)
+    chosen = []
+    for telescope in range(n_telescopes):
+        rows = np.flatnonzero((candidates["telescope_idx"] == telescope) & ~assigned_events[candidates["event"]])
+        rows = rows[np.argsort(candidates["window_end"][rows], kind="stable")]
+        start, end = candidates["window_start"][rows], candidates["window_end"][rows] + overhead
+        score = candidates["score"][rows]
+        # last earlier candidate that ends before each one starts
+        previous = np.searchsorted(end, start, side="right") - 1
+        best = np.zeros(len(rows) + 1)
+        for idx in range(len(rows)):
+            best[idx + 1] = max(best[idx], best[previous[idx] + 1] + score[idx])
+        idx = len(rows) - 1
+        while idx >= 0:
+            if best[idx + 1] > best[idx]:
+                chosen.append(rows[idx])
+                idx = previous[idx]
+            else:
+                idx -= 1
+        assigned_events[candidates["event"][chosen]] = True
+    return np.array(chosen, dtype=int)
+
+def schedule_network(telescopes, targets, start_time, end_time, score="transits", method="intervals", overhead_minutes=10.,
+                     n_sigma=3., step_minutes=2.):
+    '''Assigns the transits of a target catalog to the telescopes of a network for a date range.
+
+    Every telescope's coverage of every transit is evaluated (evaluate_network_coverage) and scored 
+    (score_coverage). Each transit goes to at most one telescope and a telescope observes one transit at 
+    a time, holding it for the whole window (T1 - baseline to T4 + baseline) plus overhead_minutes.
+
+    Parameters
+    ----------
+    telescopes : list of dict or str
+        Telescopes ("name", "site", "observer" and optional TELESCOPE_CONSTRAINTS), or the path to a 
+        network file (read_telescope_network)
+    targets : pd.DataFrame or str
+        Target catalog, or the path to one (read_target_catalog)
+    start_time, end_time : Time
+        Date range
+    score : str or callable
+        What to maximize, see score_coverage; the default counts full transits, "timing_information" or
+        "information_gain" go for the best mid-time measurements (every telescope needs a "noise")
+    method : str
+        "intervals" gives each telescope in turn (in the order of telescopes, so list the most valuable
+        first) the highest total score it can reach from the transits still free, by weighted interval
+        scheduling. "greedy" takes the highest scoring (telescope, transit) pairs first, over the whole 
+        network; it usually reaches a lower total score.
+    overhead_minutes : float
+        Time between two observations with the same telescope (slewing, calibrations)
+    n_sigma : float
+        Transit windows are widened by n_sigma mid-time uncertainties
+    step_minutes : float
+        Sampling of the coverage evaluation
+
+    Returns
+    -------
+    pd.DataFrame
+        The schedule, one row per assigned transit with the telescope, the coverage columns and "score", 
+        sorted by telescope and time
+    '''
+    if isinstance(telescopes, str):
+        telescopes = read_telescope_network(telescopes)
+    coverage = evaluate_network_coverage(telescopes, targets, start_time, end_time, n_sigma, step_minutes)
+    coverage["score"] = score_coverage(coverage, score)
+    coverage = coverage[coverage["score"] > 0].reset_index(drop=True)
+    if len(coverage) == 0:
+        return coverage
+    candidates = {column: coverage[column].to_numpy() for column in ("event", "telescope_idx", "window_start", "window_end", "score")}
+    schedulers = {"greedy": _schedule_greedy, "intervals": _schedule_intervals}
+    if method not in schedulers:
+        raise ValueError(f"Unknown scheduling method {method!r}, use one of {list(schedulers)}.")
+    chosen = schedulers[method](candidates, len(telescopes), overhead_minutes/24./60.)
+    return coverage.iloc[chosen].sort_values(["telescope_idx", "window_start"], kind="stable").reset_index(drop=True)
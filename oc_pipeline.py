@@ -0,0 +1,204 @@
+# Batch O-C analysis of every ExoWatch planet JSON in a directory.
+# Run with: python oc_pipeline.py <json directory> [-o output directory] [-j workers] [--force] [--precession]
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timing_catalog import TimingCatalog, SOURCE_COLORS
+from ephemeris import fit_ephemeris, fit_precession_ephemeris, calc_ephemeris_model, EPHEMERIS_MODELS
+
+# remembers which version of each JSON file has been processed, in the output directory
+STATE_FILE = "oc_pipeline_state.json"
+SUMMARY_FILE = "oc_summary.csv"
+
+def planet_file_name(planet):
+    '''"HAT-P-37 b" -> "HAT-P-37_b", for output file names.'''
+    return "".join(char if char.isalnum() or char in "-_." else "_" for char in planet)
+
+def read_exowatch_json(path):
+    '''Contents of an ExoWatch planet JSON (a dictionary with "name", "ephemeris" and "timestamp" keys),
+    or None for any other file.'''
+    try:
+        with open(path) as f:
+            json_data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(json_data, dict) and all(key in json_data for key in ("name", "ephemeris", "timestamp")):
+        return json_data
+    return None
+
+def load_state(output_dir):
+    try:
+        with open(os.path.join(output_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+def save_state(output_dir, state):
+    # written to a temporary file first so an interrupted run never leaves a broken state file
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def plot_oc(catalog, fits, planet, file_path):
+    '''O-C (minutes) against the linear ephemeris, one colour per source, with the quadratic ephemeris.'''
+    # figures are made without pyplot, so workers never need a display
+    from matplotlib.figure import Figure
+    linear = fits["linear"].params
+    oc = catalog.calc_oc(linear["T0"], linear["P"])*24.*60.
+    fig = Figure(figsize=(6*(16/9), 6))
+    ax = fig.add_subplot()
+    for source in np.unique(catalog.source):
+        in_source = catalog.source == source
+        ax.errorbar(catalog.epoch[in_source], oc[in_source], yerr=catalog.sigma[in_source]*24.*60., fmt="o",
+                    color=SOURCE_COLORS.get(source), label=source, zorder=110)
+    model_epochs = np.linspace(catalog.epoch.min(), catalog.epoch.max(), 500)
+    quadratic = calc_ephemeris_model(model_epochs, *fits["quadratic"].params.values())
+    ax.plot(model_epochs, (quadratic - calc_ephemeris_model(model_epochs, linear["T0"], linear["P"]))*24.*60.,
+            color="#D64309", label="quadratic ephemeris")
+    ax.axhline(0., color="#0033A0", ls="--", label="linear ephemeris")
+    ax.set_xlabel("Epoch")
+    ax.set_ylabel("O-C [min]")
+    ax.set_title(planet)
+    ax.legend()
+    fig.savefig(file_path, bbox_inches="tight")
+
+def process_planet(json_file, output_dir, fit_precession=False):
+    '''Fits the ephemerides of one ExoWatch planet JSON and writes its tables and O-C figure.
+
+    Writes <planet>_timing.csv (the mid-times used, with epochs and O-C), <planet>_ephemeris.csv (one row
+    per model) and <planet>_oc.png to output_dir.
+
+    Returns
+    -------
+    dict
+        Row of the summary table.
+    '''
+    with open(json_file) as f:
+        json_data = json.load(f)
+    planet = json_data["name"]
+    priors = json_data["priors"]
+    catalog = TimingCatalog.from_exowatch_json(json_file)
+    # common epochs from the EXOTIC priors, keeping the most precise of repeated transits
+    catalog = catalog.reassign_epochs(float(priors["Tc"]["value"]), float(priors["Period"]["value"])).drop_duplicates().sorted()
+    fits = {model: fit_ephemeris(catalog.epoch, catalog.Tc, catalog.sigma, model) for model in EPHEMERIS_MODELS}
+    if fit_precession:
+        # already inside a worker, so no nested pool
+        fits["precession"] = fit_precession_ephemeris(catalog.epoch, catalog.Tc, catalog.sigma, max_workers=1)
+
+    base_name = os.path.join(output_dir, planet_file_name(planet))
+    timing_table = pd.DataFrame(catalog.columns)
+    linear = fits["linear"].params
+    timing_table["oc_linear_min"] = catalog.calc_oc(linear["T0"], linear["P"])*24.*60.
+    timing_table.to_csv(base_name + "_timing.csv", index=False)
+    ephemeris_table = []
+    for model, fit in fits.items():
+        row = {"model": model, "n": fit.n, "chi_sq": fit.chi_sq, "BIC": fit.BIC}
+        for name, value in fit.params.items():
+            row[name] = value
+            row[name + "_unc"] = fit.uncertainties[name]
+        ephemeris_table.append(row)
+    pd.DataFrame(ephemeris_table).to_csv(base_name + "_ephemeris.csv", index=False)
+    plot_oc(catalog, fits, planet, base_name + "_oc.png")
+
+    summary = {"planet": planet, "json_file": os.path.basename(json_file), "timestamp": json_data["timestamp"],
+               "n_midtimes": len(catalog), "n_sources": len(np.unique(catalog.source)),
+               "T0": fits["linear"].params["T0"], "T0_unc": fits["linear"].uncertainties["T0"],
+               "P": fits["linear"].params["P"], "P_unc": fits["linear"].uncertainties["P"],
+               "dPdE": fits["quadratic"].params["dPdE"], "dPdE_unc": fits["quadratic"].uncertainties["dPdE"],
+               "BIC_linear": fits["linear"].BIC, "BIC_quadratic": fits["quadratic"].BIC,
+               "delta_BIC_quadratic": fits["linear"].BIC - fits["quadratic"].BIC}
+    if fit_precession:
+        summary["BIC_precession"] = fits["precession"].BIC
+        summary["delta_BIC_precession"] = fits["linear"].BIC - fits["precession"].BIC
+    return summary
+
+def run_oc_pipeline(directory, output_dir=None, max_workers=None, force=False, fit_precession=False):
+    '''O-C analysis of every ExoWatch planet JSON in directory, one planet per worker process.
+
+    The run is resumable: a planet is skipped when its JSON file is unchanged (same size and modification
+    time) or its "timestamp" is the same as in the last successful run. Progress is saved after every
+    planet, so an interrupted run picks up where it stopped. Planets that fail are reported and retried
+    on the next run.
+
+    Parameters
+    ----------
+    directory : str
+        Folder with the ExoWatch planet JSON files.
+    output_dir : str, optional
+        Where the per-planet tables/figures, the summary CSV and the state file go. Defaults to
+        <directory>/oc_results.
+    max_workers : int, optional
+        Number of worker processes (defaults to one per CPU).
+    force : bool
+        Reprocess every planet.
+    fit_precession : bool
+        Also fit the apsidal precession model.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary table (also written to oc_summary.csv).
+    '''
+    output_dir = os.path.join(directory, "oc_results") if output_dir is None else output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    state = dict() if force else load_state(output_dir)
+    json_files = sorted(file_name for file_name in os.listdir(directory) 
+                        if os.path.splitext(file_name)[1] == ".json" and file_name != STATE_FILE)
+    state = {key: entry for key, entry in state.items() if key in json_files}
+    to_process = []
+    n_up_to_date = 0
+    for key in json_files:
+        json_file = os.path.join(directory, key)
+        stat = os.stat(json_file)
+        previous = state.get(key)
+        up_to_date = previous is not None and previous.get("fit_precession", False) >= fit_precession
+        # unchanged files aren't even opened
+        if up_to_date and (previous["mtime_ns"], previous["size"]) == (stat.st_mtime_ns, stat.st_size):
+            n_up_to_date += 1
+            continue
+        json_data = read_exowatch_json(json_file)
+        if json_data is None:
+            continue
+        if up_to_date and json_data["timestamp"] == previous["summary"]["timestamp"]:
+            previous["mtime_ns"], previous["size"] = stat.st_mtime_ns, stat.st_size
+            n_up_to_date += 1
+            continue
+        to_process.append((json_file, stat))
+    print(f"{len(to_process)} planet(s) to process, {n_up_to_date} up to date")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_planet, json_file, output_dir, fit_precession): (json_file, stat)
+                   for json_file, stat in to_process}
+        for future in as_completed(futures):
+            json_file, stat = futures[future]
+            try:
+                summary = future.result()
+            except Exception as error:
+                print(f"{os.path.basename(json_file)}: failed ({error!r})")
+                continue
+            state[os.path.basename(json_file)] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                                                  "fit_precession": fit_precession, "summary": summary}
+            save_state(output_dir, state)
+            print(f"{summary['planet']}: {summary['n_midtimes']} mid-times, Delta BIC (linear - quadratic) = "
+                  f"{summary['delta_BIC_quadratic']:.2f}")
+    save_state(output_dir, state)
+
+    summary_table = pd.DataFrame([entry["summary"] for entry in state.values()])
+    if len(summary_table) > 0:
+        summary_table = summary_table.sort_values("planet")
+    summary_table.to_csv(os.path.join(output_dir, SUMMARY_FILE), index=False)
+    return summary_table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="O-C analysis of every ExoWatch planet JSON in a directory.")
+    parser.add_argument("directory", help="folder with the ExoWatch planet JSON files")
+    parser.add_argument("-o", "--output", default=None, help="output folder (default: <directory>/oc_results)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--force", action="store_true", help="reprocess planets that have not changed")
+    parser.add_argument("--precession", action="store_true", help="also fit the apsidal precession model")
+    args = parser.parse_args()
+    run_oc_pipeline(args.directory, args.output, args.workers, args.force, args.precession)
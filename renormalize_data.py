@@ -4,17 +4,19 @@ import numpy as np
 import json
 import matplotlib.pyplot as plt
 from utils import *
+from aavso_reports import read_aavso_report, write_aavso_report
 from pathlib import Path
 
 # Use load_phot_data, parse_final_params, calc_model_fit, and plot_data_with_curve 
 def load_phot_data(PlanetName, ObservationDate, TransitDirectory, data_set):
         txt_name = f"AAVSO_{PlanetName}_{ObservationDate}_{data_set}.txt"
-        phot_data = np.loadtxt(os.path.join(TransitDirectory, txt_name), delimiter=",")
-        return {"BJD_TDB" : phot_data[:, 0], 
-                "flux" : phot_data[:, 1], 
-                "error" : phot_data[:, 2], 
-                "detrend_1": phot_data[:, 3], 
-                "detrend_2": phot_data[:, 4]}
+        report = read_aavso_report(os.path.join(TransitDirectory, txt_name))
+        return {"BJD_TDB" : report["BJD_TDB"], 
+                "flux" : report["flux"], 
+                "error" : report["error"], 
+                "detrend_1": report["detrend_1"], 
+                "detrend_2": report["detrend_2"], 
+                "header_lines": report["header_lines"]}
 
 def renormalize_data(PhotData, ingress_time):
       # pull out data before ingress
@@ -50,11 +52,10 @@ def plot_data(photdata, TransitDirectory, PlanetName, ObservationDate, data_set)
       plt.close()
 
 def create_AAVSO_report(photdata, TransitDirectory, PlanetName, ObservationDate, data_set):
+      # keeps the header of the original report (#RESULTS-XC, #PRIORS-XC, ...) & writes the data in bulk
       filename = Path(TransitDirectory) / f"NEW_AAVSO_{PlanetName}_{ObservationDate}_{data_set}.txt"
-      with filename.open('w', encoding="utf-8") as f:
-            f.write("#DATE,DIFF,ERR,DETREND_1,DETREND_2\n")
-            for idx in range(0, len(photdata["BJD_TDB"])):
-                  f.write(f"{photdata["BJD_TDB"][idx]}, {round(photdata["normalized_flux"][idx], 7)}, {photdata["error"][idx]}, {photdata["detrend_1"][idx]}, {photdata["detrend_2"][idx]}\n")      
+      columns = [photdata["BJD_TDB"], photdata["normalized_flux"], photdata["error"], photdata["detrend_1"], photdata["detrend_2"]]
+      write_aavso_report(filename, columns, header_lines=photdata.get("header_lines"), round_columns={1: 7})
 
 
 if __name__ == "__main__":
@@ -1,8 +1,26 @@
+import os
+import tempfile
+import zipfile
 import numpy as np
+from functools import lru_cache
+from scipy.interpolate import CubicSpline
 from astropy import time
 from astropy import coordinates as coord
 from astropy import units as u
 
+# precomputed light travel time grids are saved here, one file per (target, site, date)
+LTT_GRID_DIRECTORY = os.path.join(os.path.expanduser('~'), ".pychromatic_cache", "ltt_grids")
+
+@lru_cache(maxsize=None)
+def get_earth_location(longitude, latitude):
+    """Memoized EarthLocation for an observatory (longitude/latitude in degrees)."""
+    return coord.EarthLocation.from_geodetic(longitude, latitude)
+
+@lru_cache(maxsize=None)
+def get_sky_coord(ra, dec):
+    """Memoized ICRS SkyCoord for a target (right ascension/declination in degrees)."""
+    return coord.SkyCoord(ra=ra, dec=dec, unit="deg", frame="icrs")
+
 def convert_times(time_data, format, scale, obj_coords, obs_coords):
         """Validates object and observatory information and populates Astropy objects for barycentric light travel time correction.
 
@@ -42,8 +60,8 @@ def convert_times(time_data, format, scale, obj_coords, obs_coords):
                 information.
         """
         # Get observatory and object location
-        obs_location = coord.EarthLocation.from_geodetic(obs_coords[0], obs_coords[1])
-        obj_location = coord.SkyCoord(ra=obj_coords[0], dec=obj_coords[1], unit="deg", frame="icrs")
+        obs_location = get_earth_location(float(obs_coords[0]), float(obs_coords[1]))
+        obj_location = get_sky_coord(float(obj_coords[0]), float(obj_coords[1]))
         # Create time object and convert format to JD
         time_obj = time.Time(time_data, format=format, scale=scale, location=obs_location)
         time_obj_converted_format = time.Time(time_obj.to_value("jd"), format="jd", scale=scale, location=obs_location)
@@ -51,6 +69,157 @@ def convert_times(time_data, format, scale, obj_coords, obs_coords):
         corrected_time_vals = (time_obj_converted_format.tdb+ltt_bary).value
         # Perform barycentric correction for scale conversion, will return array of corrected times
         return corrected_time_vals
+
+def convert_times_batch(time_data, format, scale, target_ids, site_ids, targets, sites):
+    """Barycentric (BJD_TDB) conversion of many times observed of many targets from many observatories.
+
+    Rows are grouped by (target, site) and each group is converted with a single vectorized astropy call,
+    reusing memoized SkyCoord and EarthLocation objects, instead of rebuilding every astropy object for
+    every time stamp as a loop over `convert_times` does. Results match `convert_times` row by row.
+
+    Parameters
+    ----------
+        time_data: np.ndarray
+            Array of times, in any format astropy accepts (e.g. floats for "jd", strings for "isot").
+        format: str
+            A valid Astropy abbreviation of the data's time system.
+        scale: str
+            A valid Astropy abbreviation of the data's time scale.
+        target_ids: np.ndarray
+            Target ID of each row, a key of `targets`.
+        site_ids: np.ndarray
+            Observatory ID of each row, a key of `sites`.
+        targets: dict
+            Target ID -> (right ascension, declination) in degrees.
+        sites: dict
+            Observatory ID -> (longitude, latitude) in degrees.
+
+    Returns
+    -------
+        An array of the times converted to Barycentric Julian Date (Astropy JD format, TDB scale), in input order.
+
+    Raises
+    ------
+        KeyError:
+            Error if a row refers to a target or site that is not in `targets`/`sites`.
+    """
+    time_data = np.asarray(time_data)
+    target_ids = np.asarray(target_ids)
+    site_ids = np.asarray(site_ids)
+    corrected_time_vals = np.empty(len(time_data))
+    # label every row with its (target, site) group
+    target_names, target_idx = np.unique(target_ids, return_inverse=True)
+    site_names, site_idx = np.unique(site_ids, return_inverse=True)
+    group_ids = target_idx.ravel()*len(site_names) + site_idx.ravel()
+    order = np.argsort(group_ids, kind="stable")
+    groups, starts = np.unique(group_ids[order], return_index=True)
+    stops = np.append(starts[1:], len(order))
+    for group, start, stop in zip(groups, starts, stops):
+        rows = order[start:stop]
+        target, site = target_names[group // len(site_names)], site_names[group % len(site_names)]
+        obs_location = get_earth_location(*map(float, sites[site]))
+        obj_location = get_sky_coord(*map(float, targets[target]))
+        time_obj = time.Time(time_data[rows], format=format, scale=scale, location=obs_location)
+        ltt_bary = time_obj.light_travel_time(obj_location)
+        corrected_time_vals[rows] = (time_obj.tdb + ltt_bary).jd
+    return corrected_time_vals
+
+def light_travel_time_grid(obj_coords, obs_coords, date, scale="utc", step_minutes=10., cache_dir=LTT_GRID_DIRECTORY):
+    """Exact barycentric light travel time on a coarse grid covering one (UTC) calendar date.
+
+    The grid runs from 00:00 to 24:00 of `date` every `step_minutes`, plus two extra nodes on either 
+    side so a cubic spline is well behaved at the ends. Grids are saved to `cache_dir` keyed by 
+    (target, site, date, scale, step) and loaded from there on later calls.
+
+    Parameters
+    ----------
+        obj_coords: (float, float)
+            Tuple of the right ascension and declination in degrees of the object being observed.
+        obs_coords: (float, float)    
+            Tuple of the longitude and latitude in degrees of the site of observation.
+        date: int
+            Julian Date at 00:00 of the day (i.e. JD - 0.5 rounded down, plus 0.5).
+        scale: str
+            A valid Astropy abbreviation of the time scale the grid is sampled in.
+        step_minutes: float
+            Spacing of the exact calculations.
+        cache_dir: str or None
+            Directory for the saved grids. None disables the disk cache.
+
+    Returns
+    -------
+        grid_jd: np.ndarray[float]
+            Grid times, JD in `scale`.
+        ltt: np.ndarray[float]
+            Light travel time (days) at each grid time.
+    """
+    obj_coords = tuple(float(x) for x in obj_coords)
+    obs_coords = tuple(float(x) for x in obs_coords)
+    file_name = (f"ltt_{obj_coords[0]:.6f}_{obj_coords[1]:+.6f}_{obs_coords[0]:+.6f}_{obs_coords[1]:+.6f}"
+                 f"_{date:.1f}_{scale}_{step_minutes:g}min.npz")
+    if cache_dir is not None and os.path.exists(os.path.join(cache_dir, file_name)):
+        try:
+            with np.load(os.path.join(cache_dir, file_name)) as grid:
+                return grid["grid_jd"], grid["ltt"]
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            pass    # unreadable grid (e.g. written by an older version that was interrupted): recompute it
+    step = step_minutes/1440.
+    grid_jd = date + step*np.arange(-2, int(np.ceil(1./step)) + 3)
+    grid_obj = time.Time(grid_jd, format="jd", scale=scale, location=get_earth_location(*obs_coords))
+    ltt = grid_obj.light_travel_time(get_sky_coord(*obj_coords)).to_value(u.day)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written to a temporary file that is moved into place, so an interrupted or concurrent run never
+        # leaves a truncated grid behind
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as f:
+            np.savez(f, grid_jd=grid_jd, ltt=ltt)
+        os.replace(f.name, os.path.join(cache_dir, file_name))
+    return grid_jd, ltt
+
+def convert_times_interpolated(time_data, format, scale, obj_coords, obs_coords, step_minutes=10., cache_dir=LTT_GRID_DIRECTORY):
+    """Fast BJD_TDB conversion of the frames of a night, interpolating a precomputed light travel time grid.
+
+    The scale conversion to TDB is done exactly for every frame; only the light travel time (the expensive 
+    solar system ephemeris term) is interpolated, with a cubic spline through the exact values of
+    `light_travel_time_grid`. Over a day the light travel time is the smooth sum of the Earth's orbital 
+    motion (~500 s amplitude, 1 yr period) and the site's rotation about the Earth's axis (<= 21 ms, 1 day period). 
+    The cubic spline error is at most (5/384) h^4 max|d^4(ltt)/dt^4|, which for the 10 minute default step is 
+    ~1e-9 s, dominated by the diurnal term -- far below 1 ms (about 1 us even for hour-long steps). The result 
+    then agrees with `convert_times` to the ~40 us resolution of a float64 Julian Date.
+
+    Parameters
+    ----------
+        time_data: np.ndarray[float]
+            An array of timing data values.
+        format: str
+            A valid Astropy abbreviation of the data's time system.
+        scale: str
+            A valid Astropy abbreviation of the data's time scale.
+        obj_coords: (float, float)
+            Tuple of the right ascension and declination in degrees of the object being observed.
+        obs_coords: (float, float)    
+            Tuple of the longitude and latitude in degrees of the site of observation.
+        step_minutes: float
+            Spacing of the exact light travel time grid.
+        cache_dir: str or None
+            Directory for the saved grids. None disables the disk cache.
+
+    Returns
+    -------
+        An array of timing data converted to Barycentric Julian Date timing format and scale (Astropy JD format, TDB scale).
+    """
+    obs_location = get_earth_location(float(obs_coords[0]), float(obs_coords[1]))
+    time_obj = time.Time(time_data, format=format, scale=scale, location=obs_location)
+    time_jd = np.atleast_1d(time_obj.jd)
+    ltt = np.empty(time_jd.shape)
+    # one grid per calendar date covered by the frames (usually one or two for a night)
+    dates = np.floor(time_jd - 0.5) + 0.5
+    for date in np.unique(dates):
+        on_date = dates == date
+        grid_jd, grid_ltt = light_travel_time_grid(obj_coords, obs_coords, date, scale, step_minutes, cache_dir)
+        ltt[on_date] = CubicSpline(grid_jd - date, grid_ltt)(time_jd[on_date] - date)
+    corrected_time_vals = np.atleast_1d(time_obj.tdb.jd) + ltt
+    return corrected_time_vals if np.ndim(time_obj.jd) else corrected_time_vals[0]
     
 if __name__ == "__main__":
     tres3_objcoords = [267.927808748, 37.5897197633]
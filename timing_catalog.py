@@ -0,0 +1,219 @@
+# Columnar catalog of transit mid-times from every source we use (ExoWatch, literature tables, ...)
+import json
+import numpy as np
+import pandas as pd
+
+# catalog columns, in order
+CATALOG_COLUMNS = ("planet", "epoch", "Tc", "sigma", "source", "observer")
+
+# O-C plot colour of each source
+SOURCE_COLORS = {'NASA Exoplanet Archive': 'b', 
+                 'AAVSO': 'g', 
+                 'Unistellar': 'r',
+                 'MOBS/EXOTIC': 'y', 
+                 "Elisabeth's Data": 'k',
+                 "A-thano+ 2022": 'k'}
+
+def exowatch_source(obs):
+    '''Source flag of one ExoWatch observation. Exactly one flag per observation, even when it has
+    several (or unrecognized) secondary obscodes, so flags always line up with the mid-times.'''
+    secondary_ids = [observer["id"] for observer in obs["secondary_obscodes"]]
+    if "UNIS" in secondary_ids:
+        return "Unistellar"
+    elif "MOBS" in secondary_ids:
+        return "MOBS/EXOTIC"
+    return "AAVSO"
+
+def assign_epochs(T, T0, P, E0=0, ambiguity_tol=0.1):
+    """
+    Vectorized epoch assignment for any number of mid-times. Rounds to the nearest epoch (get_epochs 
+    truncates, so a mid-time slightly before its predicted transit lands one epoch early).
+    T: array of floats
+        Mid-times to assign epochs to
+    T0: float or array of floats
+        The mid-time of epoch zero. Can be an array matching T (e.g. one T0 per planet in a merged catalog)
+    P: float or array of floats
+        Orbital period, same broadcasting as T0
+    E0: int
+        The first epoch number, if not zero. Will be added to make sure initial epoch number is accounted for
+    ambiguity_tol: float
+        Points within this fraction of a period of +/-0.5 period from the predicted transit are flagged as ambiguous
+
+    Returns: epochs (array of ints), phase residuals (T - predicted, in units of the period, within [-0.5, 0.5]),
+        and a boolean array that is True for ambiguous points
+    """
+    N = (np.asarray(T, dtype=float) - T0)/P
+    epochs = np.rint(N)
+    phase_residuals = N - epochs
+    ambiguous = np.abs(phase_residuals) >= 0.5 - ambiguity_tol
+    return epochs.astype(int) + E0, phase_residuals, ambiguous
+
+class TimingCatalog():
+    '''Transit mid-times stored as one numpy array per column (planet, epoch, Tc, sigma, source, observer).
+
+    Catalogs are never modified in place: merging, selecting and re-assigning epochs return new catalogs,
+    so the planet and (planet, epoch) indexes can be built once, lazily, with a single sort.
+
+    Parameters
+    ----------
+    planet, source, observer : array-like of str
+    epoch : array-like of int
+    Tc, sigma : array-like of float
+        Mid-times (BJD_TDB) and their uncertainties (days).
+    '''
+    def __init__(self, planet=(), epoch=(), Tc=(), sigma=(), source=(), observer=()):
+        self.Tc = np.asarray(Tc, dtype=float).ravel()
+        n_rows = len(self.Tc)
+        self.planet = np.broadcast_to(np.asarray(planet, dtype=str), (n_rows,)).copy()
+        self.epoch = np.asarray(epoch, dtype=int).ravel()
+        self.sigma = np.asarray(sigma, dtype=float).ravel()
+        self.source = np.broadcast_to(np.asarray(source, dtype=str), (n_rows,)).copy()
+        self.observer = np.broadcast_to(np.asarray(observer, dtype=str), (n_rows,)).copy()
+        if not (len(self.epoch) == len(self.sigma) == n_rows):
+            raise ValueError("All catalog columns must have the same length.")
+        self._PlanetIndex = None
+        self._EpochIndex = None
+
+    def __len__(self):
+        return len(self.Tc)
+
+    def __repr__(self):
+        return f"TimingCatalog({len(self)} mid-times, planets={list(self.PlanetIndex)})"
+
+    @property
+    def columns(self):
+        return {name: getattr(self, name) for name in CATALOG_COLUMNS}
+
+    @property
+    def PlanetIndex(self):
+        '''dictionary planet -> row indices, sorted by epoch'''
+        if self._PlanetIndex is None:
+            self._build_indexes()
+        return self._PlanetIndex
+
+    @property
+    def EpochIndex(self):
+        '''dictionary (planet, epoch) -> row indices of every measurement of that transit'''
+        if self._EpochIndex is None:
+            self._build_indexes()
+        return self._EpochIndex
+
+    def _build_indexes(self):
+        # one lexsort by (planet, epoch), then split into runs
+        order = np.lexsort((self.epoch, self.planet))
+        planets, epochs = self.planet[order], self.epoch[order]
+        planet_starts = np.flatnonzero(np.r_[True, planets[1:] != planets[:-1]])
+        self._PlanetIndex = dict(zip(planets[planet_starts], np.split(order, planet_starts[1:])))
+        run_starts = np.flatnonzero(np.r_[True, (planets[1:] != planets[:-1]) | (epochs[1:] != epochs[:-1])])
+        self._EpochIndex = dict(zip(zip(planets[run_starts], epochs[run_starts].tolist()), np.split(order, run_starts[1:])))
+
+    def take(self, idx):
+        '''New catalog with the rows idx (an index array or boolean mask).'''
+        return TimingCatalog(**{name: col[idx] for name, col in self.columns.items()})
+
+    def select(self, planet=None, source=None):
+        '''Rows of one planet and/or source.'''
+        mask = np.ones(len(self), dtype=bool)
+        if planet is not None:
+            mask &= self.planet == planet
+        if source is not None:
+            mask &= np.isin(self.source, np.atleast_1d(source))
+        return self.take(mask)
+
+    def sorted(self):
+        '''Catalog sorted by planet, then epoch, then mid-time.'''
+        return self.take(np.lexsort((self.Tc, self.epoch, self.planet)))
+
+    @staticmethod
+    def merge(*catalogs):
+        '''Concatenates catalogs column by column.'''
+        return TimingCatalog(**{name: np.concatenate([getattr(cat, name) for cat in catalogs]) for name in CATALOG_COLUMNS})
+
+    def reassign_epochs(self, T0, P, planet=None):
+        '''Epochs recomputed against one ephemeris (T0, P), e.g. so literature tables and ExoWatch share
+        epoch numbers. T0/P can be dictionaries planet -> value to do every planet in one pass. Only
+        rows of `planet` are changed if it is given.'''
+        if isinstance(T0, dict):
+            T0 = np.array([T0[name] for name in self.planet])
+            P = np.array([P[name] for name in self.planet])
+        epochs, _, _ = assign_epochs(self.Tc, T0, P)
+        columns = self.columns
+        columns["epoch"] = epochs if planet is None else np.where(self.planet == planet, epochs, self.epoch)
+        return TimingCatalog(**columns)
+
+    def calc_oc(self, T0, P):
+        '''O-C (days) of every row against a linear ephemeris; T0/P scalars or per-row arrays.'''
+        return self.Tc - (T0 + self.epoch*P)
+
+    def _duplicate_runs(self, max_separation=None):
+        # rows sorted by (planet, epoch, sigma); runs of equal (planet, epoch) are one transit
+        order = np.lexsort((self.sigma, self.epoch, self.planet))
+        planets, epochs = self.planet[order], self.epoch[order]
+        run_starts = np.flatnonzero(np.r_[True, (planets[1:] != planets[:-1]) | (epochs[1:] != epochs[:-1])])
+        run_sizes = np.diff(np.r_[run_starts, len(order)])
+        # a run is a cross-source duplicate if any row's source differs from the first row's
+        run_id = np.repeat(np.arange(len(run_starts)), run_sizes)
+        source_differs = self.source[order] != self.source[order][run_starts][run_id]
+        is_duplicate = np.bincount(run_id, weights=source_differs, minlength=len(run_starts)) > 0
+        if max_separation is not None and len(order) > 0:
+            Tc = self.Tc[order]
+            spread = np.maximum.reduceat(Tc, run_starts) - np.minimum.reduceat(Tc, run_starts)
+            is_duplicate &= spread <= max_separation
+        return order, run_starts, run_sizes, run_id, is_duplicate
+
+    def find_duplicates(self, max_separation=None):
+        '''Groups of rows that measure the same transit (same planet and epoch) in more than one source.
+
+        Parameters
+        ----------
+        max_separation : float, optional
+            Only count rows as duplicates if their mid-times are also within this many days of each other.
+
+        Returns
+        -------
+        list[np.ndarray[int]]
+            Row indices of each duplicate group, most precise measurement first.
+        '''
+        order, run_starts, run_sizes, run_id, is_duplicate = self._duplicate_runs(max_separation)
+        groups = np.split(order, run_starts[1:]) if len(order) > 0 else []
+        return [groups[run] for run in np.flatnonzero(is_duplicate)]
+
+    def drop_duplicates(self, max_separation=None):
+        '''Keeps only the most precise measurement of each duplicated transit.'''
+        order, run_starts, run_sizes, run_id, is_duplicate = self._duplicate_runs(max_separation)
+        # within a run the rows are sorted by sigma, so the first row is the one to keep
+        is_first = np.zeros(len(order), dtype=bool)
+        is_first[run_starts] = True
+        keep = np.zeros(len(self), dtype=bool)
+        keep[order] = is_first | ~is_duplicate[run_id]
+        return self.take(keep)
+
+    @classmethod
+    def from_exowatch_json(cls, json_file, planet=None):
+        '''NASA Exoplanet Archive and ephemeris-flagged observations of an ExoWatch planet JSON.'''
+        with open(json_file) as f:
+            json_data = json.load(f)
+        planet = json_data["name"] if planet is None else planet
+        ephem_dict = json_data["ephemeris"]
+        observations = [obs for obs in json_data["observations"] if obs["data_flag_ephemeris"] == True]
+        nea = cls(planet, np.array(ephem_dict["nea_epochs"], dtype=float), np.array(ephem_dict["nea_tmids"], dtype=float),
+                  np.array(ephem_dict["nea_tmids_err"], dtype=float), "NASA Exoplanet Archive",
+                  [ref.replace("%20", " ") for ref in ephem_dict["nea_references"]])
+        exowatch = cls(planet, np.array(ephem_dict["epochs"], dtype=float), [float(obs["parameters"]["Tc"]) for obs in observations],
+                       [float(obs["errors"]["Tc"]) for obs in observations], [exowatch_source(obs) for obs in observations],
+                       [obs["obscode"]["id"] for obs in observations])
+        return cls.merge(nea, exowatch)
+
+    @classmethod
+    def from_Athano22(cls, file_name="Athano2022_Table6.csv", planet="HAT-P-37 b"):
+        '''A-thano+ 2022 Table 6. Their mid-times are given as BJD_TDB - 2450000.'''
+        data = pd.read_csv(file_name, comment='#', header=0)
+        return cls(planet, data["Epoch"].astype('int'), np.array(data["Tm"]) + 2450000, data["sigma_Tm"],
+                   "A-thano+ 2022", "A-thano+ 2022")
+
+    @classmethod
+    def from_Elisabeth_csv(cls, file_name, planet="WASP-52 b"):
+        '''O-C tables like oMinusC_WASP-52b.csv, keeping the reference of each mid-time as the observer.'''
+        data = pd.read_csv(file_name, comment='#', header=0)
+        return cls(planet, data["N_tr"].astype('int'), data["Midtime"], data["Midtime_err_days"],
+                   "Elisabeth's Data", data["Source"].fillna("").astype(str))
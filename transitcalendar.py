@@ -1,20 +1,46 @@
 ## Testing the astroplan classes to make transit calendars for BSU. 
+import os
+import json
+from functools import lru_cache
 import numpy as np
+import pandas as pd
 from astropy.time import Time
 import pytz
 import astropy.units as u
 from astroplan import EclipsingSystem
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import SkyCoord, EarthLocation
+from astropy.coordinates.erfa_astrom import erfa_astrom, ErfaAstromInterpolator
+from scipy.interpolate import CubicSpline
 from astroplan import FixedTarget, Observer, EclipsingSystem
 from astroplan import (PrimaryEclipseConstraint, is_event_observable,
                        AtNightConstraint, AltitudeConstraint, LocalTimeConstraint)
 import datetime as dt
 import matplotlib.pyplot as plt
+from ephemeris import calc_transit_time_bands
 
 ### Set global variable Boise State Observer 
 boiseState = Observer(longitude=-116.208710*u.deg, latitude=43.602*u.deg,
                   elevation=821*u.m, name="BoiseState", timezone="US/Mountain")
 
+# precession/nutation and the Earth's position are interpolated at this resolution when many times are
+# transformed at once (altitudes change by < 1 mas); Earth rotation is always computed exactly
+ERFA_TIME_RESOLUTION = 6*u.hour
+
+# sunset/sunrise and twilight tables are saved here, one file per (site, years)
+NIGHT_TABLE_DIRECTORY = os.path.join(os.path.expanduser('~'), ".pychromatic_cache", "night_tables")
+# Sun altitude (deg) that defines each pair of night table columns; sunset/sunrise include refraction and the solar radius
+TWILIGHT_ALTITUDES = {"sun": -0.833, "civil": -6., "nautical": -12., "astronomical": -18.}
+
+# columns every target catalog needs (duration in hours, T0 in JD, P in days); T0_unc and P_unc (days) are optional
+TARGET_COLUMNS = ("name", "ra", "dec", "T0", "P", "duration")
+
+# the Moon is computed at this resolution and spline interpolated in between (separations good to < 0.1 deg)
+MOON_TIME_RESOLUTION = 3*u.hour
+# hour angle change per day (radians) of a fixed star
+SIDEREAL_RATE = 2.*np.pi*1.00273781191
+# parts of a transit window evaluate_transit_coverage reports: baseline before T1, T1-T2, T2-T3, T3-T4, baseline after T4
+COVERAGE_PHASES = ("pre", "ingress", "flat", "egress", "post")
+
 def create_target(RA, DEC, target_name):
     '''Creates a FixedTarget object from a given RA/DEC with object name. 
 
@@ -62,27 +88,211 @@ def create_eclipsingsystem(primary_eclipse_time, orbital_period, eclipse_duratio
                            name=target_name)
     return system
 
-def calculate_next_transits(start_time, dusk, dawn, number_of_transits, target, system):
+def calc_night_index(jd, longitude):
+    '''Night number of JD times at a site. Nights run from local mean noon to noon, and night N is the one
+    whose evening falls on the civil date with JD N at 12:00 UT.'''
+    return np.floor(np.asarray(jd) + longitude/360.).astype(int)
+
+def twilight_columns(twilight):
+    '''Night table columns (start, end) of the dark interval for a TWILIGHT_ALTITUDES key.'''
+    return ("sunset", "sunrise") if twilight == "sun" else (f"{twilight}_dusk", f"{twilight}_dawn")
+
+def calc_night_table(observer, first_night, last_night, step_minutes=30.):
+    '''Sunset, sunrise and civil, nautical and astronomical dusk/dawn for every night in a range.
+
+    The Sun altitude is computed once on a grid (step_minutes apart) covering all of the nights, with one
+    coordinate transformation, and every crossing of each TWILIGHT_ALTITUDES level is then found at once
+    as the roots of a cubic spline through the grid.
+
+    Parameters
+    ----------
+    observer : Observer
+    first_night, last_night : int
+        Night numbers (calc_night_index) of the range
+    step_minutes : float
+        Spacing of the Sun altitude grid
+
+    Returns
+    -------
+    dict
+        "night", "date" (evening date) and, as JD (UTC), "sunset", "sunrise", "<twilight>_dusk" and
+        "<twilight>_dawn" for civil/nautical/astronomical twilight. Nights when the Sun never goes below a
+        level have NaN for that pair; nights when it never rises above it span the whole night.
+    '''
+    longitude = observer.location.lon.deg
+    nights = np.arange(first_night, last_night + 1)
+    night_start = nights - longitude/360.
+    step = step_minutes/1440.
+    grid_jd = night_start[0] + step*np.arange(-2, int(np.ceil(len(nights)/step)) + 3)
+    with erfa_astrom.set(ErfaAstromInterpolator(ERFA_TIME_RESOLUTION)):
+        sun_altitude = observer.sun_altaz(Time(grid_jd, format="jd")).alt.deg
+    table = {"night": nights, "date": Time(nights, format="jd").strftime("%Y-%m-%d"), "longitude": longitude}
+    for twilight, altitude in TWILIGHT_ALTITUDES.items():
+        spline = CubicSpline(grid_jd, sun_altitude - altitude)
+        roots = spline.roots(extrapolate=False)
+        rising = spline(roots, 1) > 0
+        night_of_root = calc_night_index(roots, longitude) - first_night
+        in_range = (night_of_root >= 0) & (night_of_root < len(nights))
+        dusk = np.full(len(nights), np.nan)
+        dawn = np.full(len(nights), np.nan)
+        dusk[night_of_root[in_range & ~rising]] = roots[in_range & ~rising]
+        dawn[night_of_root[in_range & rising]] = roots[in_range & rising]
+        # no crossing at all: either dark the whole night or never dark
+        dark_all_night = np.isnan(dusk) & np.isnan(dawn) & (spline(night_start + 0.5) < 0)
+        dusk[dark_all_night] = night_start[dark_all_night]
+        dawn[dark_all_night] = night_start[dark_all_night] + 1.
+        start_column, end_column = twilight_columns(twilight)
+        table[start_column], table[end_column] = dusk, dawn
+    return table
+
+def get_night_table(observer, start_time, end_time, step_minutes=30., cache_dir=NIGHT_TABLE_DIRECTORY):
+    '''Night table (calc_night_table) covering whole calendar years around start_time..end_time. Tables are
+    saved to cache_dir keyed by (site, years) and loaded from there on later calls, so they are computed once.'''
+    location = observer.location
+    first_year, last_year = int(start_time.datetime.year), int(end_time.datetime.year)
+    file_name = (f"night_{location.lon.deg:+.6f}_{location.lat.deg:+.6f}_{location.height.to_value(u.m):.0f}m"
+                 f"_{first_year}-{last_year}_{step_minutes:g}min.npz")
+    if cache_dir is not None and os.path.exists(os.path.join(cache_dir, file_name)):
+        with np.load(os.path.join(cache_dir, file_name)) as table:
+            return {key: table[key] for key in table.files}
+    first_night = calc_night_index(Time(f"{first_year}-01-01 12:00").jd, location.lon.deg) - 1
+    last_night = calc_night_index(Time(f"{last_year}-12-31 12:00").jd, location.lon.deg)
+    table = calc_night_table(observer, first_night, last_night, step_minutes)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(os.path.join(cache_dir, file_name), **table)
+    return table
+
+def is_dark(jd, night_table, twilight="nautical"):
+    '''True for the JD (UTC) times that fall between dusk and dawn of their night: an interval lookup in 
+    the night table instead of a Sun position calculation.'''
+    jd = np.asarray(jd, dtype=float)
+    idx = calc_night_index(jd, float(night_table["longitude"])) - night_table["night"][0]
+    in_table = (idx >= 0) & (idx < len(night_table["night"]))
+    if not np.all(in_table):
+        raise ValueError("Times outside of the night table; get a table for the whole range.")
+    start_column, end_column = twilight_columns(twilight)
+    return (jd >= night_table[start_column][idx]) & (jd <= night_table[end_column][idx])
+
+def overlaps_dark(start_jd, end_jd, night_table, twilight="nautical"):
+    '''True for the [start_jd, end_jd] intervals (JD UTC, shorter than a day) that overlap the dark part of
+    the night they start or end in.'''
+    start_jd = np.asarray(start_jd, dtype=float)
+    end_jd = np.asarray(end_jd, dtype=float)
+    start_column, end_column = twilight_columns(twilight)
+    overlaps = np.zeros(start_jd.shape, dtype=bool)
+    for jd in (start_jd, end_jd):
+        idx = calc_night_index(jd, float(night_table["longitude"])) - night_table["night"][0]
+        if np.any((idx < 0) | (idx >= len(night_table["night"]))):
+            raise ValueError("Times outside of the night table; get a table for the whole range.")
+        overlaps |= (start_jd <= night_table[end_column][idx]) & (end_jd >= night_table[start_column][idx])
+    return overlaps
+
+def altaz_to_hadec(alt, az, latitude):
+    '''Topocentric hour angle (-pi..pi, negative = east) and declination, in radians, straight from alt/az 
+    (radians, azimuth from north through east) at a site at latitude (radians).'''
+    hour_angle = np.arctan2(-np.sin(az)*np.cos(alt), np.cos(latitude)*np.sin(alt) - np.sin(latitude)*np.cos(alt)*np.cos(az))
+    dec = np.arcsin(np.clip(np.sin(latitude)*np.sin(alt) + np.cos(latitude)*np.cos(alt)*np.cos(az), -1., 1.))
+    return hour_angle, dec
+
+def calc_event_altaz(observer, ra, dec, times):
+    '''Altitude, azimuth, airmass and hour angle of targets at many instants with a single coordinate
+    transformation (instead of one Observer.altaz call per instant).
+
+    Parameters
+    ----------
+    observer : Observer
+    ra, dec : array-like of float
+        Target coordinates in degrees, one per event (shape (n_events,))
+    times : Time
+        Instants to evaluate, shape (n_events,) or (n_events, k) e.g. ingress, mid-time and egress of each event
+
+    Returns
+    -------
+    dict
+        "alt", "az", "hour_angle" (degrees; hour angle in -180..180, negative = east) and "airmass" 
+        (sec z, NaN below the horizon), each shaped like times. The hour angle is the apparent one of date;
+        Observer.target_hour_angle uses the J2000 RA and differs by the precession since then (~0.2 deg).
+    '''
+    shape = times.shape
+    if times.size == 0:
+        # the interpolated transformation needs at least one time
+        return {key: np.zeros(shape) for key in ("alt", "az", "airmass", "hour_angle")}
+    ra = np.broadcast_to(np.reshape(ra, (-1,) + (1,)*(len(shape) - 1)), shape).ravel()
+    dec = np.broadcast_to(np.reshape(dec, (-1,) + (1,)*(len(shape) - 1)), shape).ravel()
+    with erfa_astrom.set(ErfaAstromInterpolator(ERFA_TIME_RESOLUTION)):
+        altaz = observer.altaz(times.ravel(), SkyCoord(ra=ra*u.deg, dec=dec*u.deg))
+    alt, az = altaz.alt.rad, altaz.az.rad
+    hour_angle, _ = altaz_to_hadec(alt, az, observer.location.lat.rad)
+    airmass = np.where(alt > 0, 1./np.sin(np.clip(alt, 1.e-10, None)), np.nan)
+    return {"alt": np.degrees(alt).reshape(shape), "az": np.degrees(az).reshape(shape), 
+            "airmass": airmass.reshape(shape), "hour_angle": np.degrees(hour_angle).reshape(shape)}
+
+def widen_transit_windows(ing_egr, midtimes, ephemeris_fit, n_sigma=3., n_samples=10000):
+    '''Re-centers each predicted ingress/egress window on the mid-time of the fitted ephemeris and pads it by
+    n_sigma times the Monte Carlo uncertainty of that mid-time, so windows far in the future open early and
+    close late enough.
+
+    Parameters
+    ----------
+    ing_egr : Time
+        (n_transits, 2) ingress and egress times from EclipsingSystem.next_primary_ingress_egress_time
+    midtimes : Time
+        Predicted mid-times of the same transits
+    ephemeris_fit : EphemerisFit
+        Fitted ephemeris of the planet (ephemeris.fit_ephemeris, IncrementalEphemeris.fit, ...), in the same 
+        time scale as the system's T0
+    n_sigma : float
+        Number of standard deviations to pad by on each side
+    n_samples : int
+        Number of ephemeris draws
+
+    Returns
+    -------
+    Time
+        Widened (n_transits, 2) windows
+    Time
+        Mid-times of the transits from the fitted ephemeris
+    np.ndarray
+        Mid-time uncertainty of each transit in days
+    '''
+    T0, P = ephemeris_fit.params["T0"], ephemeris_fit.params["P"]
+    epochs = np.rint((midtimes.jd - T0)/P)
+    bands = calc_transit_time_bands(ephemeris_fit, epochs, n_samples)
+    # the windows keep their length but move to the fit's mid-times, since sigma is about those
+    shift = bands["mid_times"] - midtimes.jd
+    pad = n_sigma*bands["sigma"]
+    fit_midtimes = midtimes + shift*u.day
+    return ing_egr + np.column_stack((shift - pad, shift + pad))*u.day, fit_midtimes, bands["sigma"]
+
+def calculate_next_transits(start_time, dusk, dawn, number_of_transits, target, system, ephemeris_fit=None, n_sigma=3.):
     '''_summary_
 
     Parameters
     ----------
     start_time : _type_
         _description_
-    dusk : _type_
-        _description_
-    dawn : _type_
-        _description_
+    dusk : time or None
+        UTC start of the LocalTimeConstraint; None checks darkness with the site's night table instead
+    dawn : time or None
+        UTC end of the LocalTimeConstraint
     number_of_transits : _type_
         _description_
     target : _type_
         _description_
     system : _type_
         _description_
+    ephemeris_fit : EphemerisFit, optional
+        If given, each window is centered on the fit's mid-time and widened by n_sigma times its uncertainty,
+        which is printed with the mid-time
+    n_sigma : float
+        Padding of the windows in units of the mid-time uncertainty
     '''
-    constraints = [LocalTimeConstraint(min=dusk, max=dawn)]  # AltitudeConstraint(min=20*u.deg),
     ing_egr = system.next_primary_ingress_egress_time(start_time, n_eclipses=number_of_transits)
     midtimes = system.next_primary_eclipse_time(start_time, n_eclipses=number_of_transits)
+    midtime_sigma = None
+    if ephemeris_fit is not None:
+        ing_egr, midtimes, midtime_sigma = widen_transit_windows(ing_egr, midtimes, ephemeris_fit, n_sigma)
     # Convert ingress/egress times from JD to ISO format
     ingress_times_iso = [Time(t[0], format="jd").iso for t in ing_egr]
     egress_times_iso = [Time(t[1], format="jd").iso for t in ing_egr]
@@ -95,21 +305,436 @@ def calculate_next_transits(start_time, dusk, dawn, number_of_transits, target,
         # print(f"Transit {i+1}: Padded Ingress: {ingress}, Padded Egress: {egress}")
         # print(f"Mountain: Ingress - {ingress_mdt[i]}, Egress - {egress_mdt[i]}")
     # filter transits to observable ones & print
-    observable_bool = is_event_observable(constraints, boiseState, target, times_ingress_egress=ing_egr)
+    if dusk is None or dawn is None:
+        # dark (nautical twilight) at both ingress and egress, from the cached night table
+        night_table = get_night_table(boiseState, ing_egr.min(), ing_egr.max())
+        observable_bool = (is_dark(ing_egr[:, 0].utc.jd, night_table) & is_dark(ing_egr[:, 1].utc.jd, night_table))[None, :]
+    else:
+        constraints = [LocalTimeConstraint(min=dusk, max=dawn)]  # AltitudeConstraint(min=20*u.deg),
+        observable_bool = is_event_observable(constraints, boiseState, target, times_ingress_egress=ing_egr)
     # (ingress_mdt, egress_mdt)
     filtered_transits = [time for time, is_observable in zip(np.column_stack((ingress_times_iso, egress_times_iso)), 
                                                              observable_bool[0]) if is_observable]
     filtered_midtimes = [midtime for midtime, is_observable in zip(midtimes, observable_bool[0]) if is_observable]
+    # altitudes of every visible transit's ingress, mid-time and egress in one transformation
+    visible = np.flatnonzero(observable_bool[0])
+    if visible.size == 0:
+        return filtered_transits
+    event_times = Time(np.column_stack((ing_egr[visible, 0].jd, midtimes[visible].jd, ing_egr[visible, 1].jd)), format="jd")
+    event_altaz = calc_event_altaz(boiseState, np.full(len(visible), target.ra.deg), np.full(len(visible), target.dec.deg), 
+                                   event_times)
     for i, (ingress, egress) in enumerate(filtered_transits):
         # print(f"Visible Transit {i+1}: Padded Ingress (MDT) - {ingress}, Padded Egress (MDT) - {egress}")
         print(f"Visible Transit {i+1}: Ingress (UTC) - {ingress}, Egress (UTC) - {egress}")
-        print(f"Transit {i+1} Midtime (UTC): {filtered_midtimes[i]}")
-        starting_alt = boiseState.altaz(ingress, target).alt
-        mid_alt = boiseState.altaz(filtered_midtimes[i], target).alt
-        ending_alt = boiseState.altaz(egress, target).alt
-        print(f"Transit {i+1} Altitude: Ingress: {starting_alt:.{3}f}, Midtime: {mid_alt:.{3}f}, Egress: {ending_alt:.{3}f}")
+        if midtime_sigma is None:
+            print(f"Transit {i+1} Midtime (UTC): {filtered_midtimes[i]}")
+        else:
+            # windows above were widened by n_sigma of this
+            print(f"Transit {i+1} Midtime (UTC): {filtered_midtimes[i]} +/- {midtime_sigma[visible[i]]*24.*60.:.{2}f} min")
+        starting_alt, mid_alt, ending_alt = event_altaz["alt"][i]
+        print(f"Transit {i+1} Altitude: Ingress: {starting_alt:.{3}f} deg, Midtime: {mid_alt:.{3}f} deg, Egress: {ending_alt:.{3}f} deg")
+        print(f"Transit {i+1} Airmass: Ingress: {event_altaz['airmass'][i, 0]:.{3}f}, Midtime: {event_altaz['airmass'][i, 1]:.{3}f}, "
+              f"Egress: {event_altaz['airmass'][i, 2]:.{3}f}; Hour angle at midtime: {event_altaz['hour_angle'][i, 1]/15.:.{2}f} h")
     return filtered_transits
 
+def read_target_catalog(file_path):
+    '''Reads a target catalog for calc_transit_calendar from a CSV file, or a JSON file holding a list of
+    targets (or a dictionary name -> target).
+
+    Parameters
+    ----------
+    file_path : str
+        CSV/JSON with the columns in TARGET_COLUMNS: RA/DEC in degrees, T0 (mid-transit time, JD), 
+        P (days), duration (hours), and optionally T0_unc and P_unc (days), and for add_timing_precision
+        rp (Rp/R*) or depth, and b or a (a/R*) and inc (degrees) (see calc_ingress_duration)
+
+    Returns
+    -------
+    pd.DataFrame
+    '''
+    if os.path.splitext(file_path)[1].lower() == ".json":
+        with open(file_path) as f:
+            contents = json.load(f)
+        if isinstance(contents, dict):
+            contents = [dict(target, name=name) for name, target in contents.items()]
+        targets = pd.DataFrame(contents)
+    else:
+        targets = pd.read_csv(file_path, comment='#', skipinitialspace=True)
+    missing = [column for column in TARGET_COLUMNS if column not in targets.columns]
+    if missing:
+        raise ValueError(f"Target catalog {file_path} is missing the column(s) {missing}.")
+    for column in ("T0_unc", "P_unc"):
+        targets[column] = targets[column].fillna(0.) if column in targets.columns else 0.
+    return targets.reset_index(drop=True)
+
+def predict_transits(targets, start_time, end_time, n_sigma=3.):
+    '''Every transit of every target between start_time and end_time, computed for all targets x epochs in 
+    one vectorized pass (no loop over targets).
+
+    Parameters
+    ----------
+    targets : pd.DataFrame
+        Target catalog (read_target_catalog)
+    start_time, end_time : Time
+        Range to predict transits in
+    n_sigma : float
+        Ingress/egress are widened by n_sigma times the mid-time uncertainty propagated from T0_unc and P_unc
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per transit: target (row of targets), name, epoch, ingress, mid and egress (JD) and 
+        sigma (mid-time uncertainty, days)
+    '''
+    T0 = targets["T0"].to_numpy(dtype=float)
+    P = targets["P"].to_numpy(dtype=float)
+    first_epoch = np.ceil((start_time.jd - T0)/P).astype(int)
+    n_transits = np.maximum(np.floor((end_time.jd - T0)/P).astype(int) - first_epoch + 1, 0)
+    # flatten the ragged targets x epochs grid: target index and epoch of every transit
+    target = np.repeat(np.arange(len(targets)), n_transits)
+    epoch = first_epoch[target] + np.arange(n_transits.sum()) - np.repeat(np.cumsum(n_transits) - n_transits, n_transits)
+    mid = T0[target] + epoch*P[target]
+    sigma = np.hypot(targets["T0_unc"].to_numpy(dtype=float)[target], epoch*targets["P_unc"].to_numpy(dtype=float)[target])
+    half_window = targets["duration"].to_numpy(dtype=float)[target]/24./2. + n_sigma*sigma
+    return pd.DataFrame({"target": target, "name": targets["name"].to_numpy()[target], "epoch": epoch,
+                         "ingress": mid - half_window, "mid": mid, "egress": mid + half_window, "sigma": sigma})
+
+def calc_transit_calendar(targets, start_time, end_time, observer=boiseState, min_altitude=20., twilight="nautical", 
+                          n_sigma=3., only_observable=True, noise=None, cadence=60., sort_by="mid"):
+    '''Observable transits of every target in a catalog over a date range, as one table sorted by mid-time.
+
+    Transits are predicted for all targets at once (predict_transits); the target altitude, airmass and hour
+    angle at ingress, mid-time and egress (calc_event_altaz) and the Sun altitude at ingress and egress are
+    found for all events with one coordinate transformation, and darkness at ingress and egress is looked 
+    up in the site's cached night table.
+
+    Parameters
+    ----------
+    targets : pd.DataFrame or str
+        Target catalog, or the path to one (read_target_catalog)
+    start_time, end_time : Time
+        Date range
+    observer : Observer
+        Site (default Boise State)
+    min_altitude : float
+        Lowest target altitude (deg) allowed at ingress, mid-time and egress
+    twilight : str
+        It must be darker than this twilight ("sun", "civil", "nautical" or "astronomical") at ingress and egress
+    n_sigma : float
+        Windows are widened by n_sigma mid-time uncertainties
+    only_observable : bool
+        Return only the events that pass all the constraints
+    noise : float, optional
+        Fractional flux uncertainty of one exposure; if given, the expected mid-time precision of every
+        event is added (add_timing_precision), which needs a "depth" or "rp" catalog column
+    cadence : float
+        Exposure time (seconds) for the timing precision
+    sort_by : str
+        Column to sort by: "mid" (time order), or e.g. "timing_information" or "information_gain" to put
+        the events most valuable for the O-C analysis first (sorted high to low)
+
+    Returns
+    -------
+    pd.DataFrame
+        predict_transits columns plus UTC ISO times, altitudes, airmasses, mid-time hour angle (deg), darkness
+        at ingress/egress, "observable" and, with noise, the add_timing_precision columns
+    '''
+    if isinstance(targets, str):
+        targets = read_target_catalog(targets)
+    events = predict_transits(targets, start_time, end_time, n_sigma)
+    if len(events) == 0:
+        # no transits in the range: the same columns, without any coordinate transformation
+        for instant in ("ingress", "mid", "egress"):
+            events[f"alt_{instant}"] = np.zeros(0)
+            events[f"airmass_{instant}"] = np.zeros(0)
+            events[f"{instant}_utc"] = np.zeros(0, dtype=object)
+        events["hour_angle_mid"] = np.zeros(0)
+        for column in ("dark_ingress", "dark_egress", "observable"):
+            events[column] = np.zeros(0, dtype=bool)
+        if noise is not None:
+            events = add_timing_precision(events, targets, noise, cadence)
+        return events
+    # ingress, mid and egress of every event in one Time array and one transformation
+    times = Time(np.column_stack((events["ingress"], events["mid"], events["egress"])), format="jd")
+    event_altaz = calc_event_altaz(observer, targets["ra"].to_numpy(dtype=float)[events["target"]], 
+                                   targets["dec"].to_numpy(dtype=float)[events["target"]], times)
+    altitude = event_altaz["alt"].T
+    night_table = get_night_table(observer, start_time, end_time)
+    for idx, instant in enumerate(("ingress", "mid", "egress")):
+        events[f"alt_{instant}"] = altitude[idx]
+        events[f"airmass_{instant}"] = event_altaz["airmass"][:, idx]
+        events[f"{instant}_utc"] = times[:, idx].iso
+    events["hour_angle_mid"] = event_altaz["hour_angle"][:, 1]
+    events["dark_ingress"] = is_dark(events["ingress"].to_numpy(), night_table, twilight)
+    events["dark_egress"] = is_dark(events["egress"].to_numpy(), night_table, twilight)
+    events["observable"] = np.all(altitude >= min_altitude, axis=0) & events["dark_ingress"] & events["dark_egress"]
+    if only_observable:
+        events = events[events["observable"]]
+    if noise is not None:
+        events = add_timing_precision(events, targets, noise, cadence)
+    return events.sort_values(sort_by, ascending=sort_by in ("mid", "sigma_t0"), kind="stable").reset_index(drop=True)
+
+@lru_cache(maxsize=16)
+def _moon_hadec_splines(longitude, latitude, elevation, first_step, n_steps):
+    # splines of the Moon's unwrapped hour angle and declination at a site, every MOON_TIME_RESOLUTION from
+    # step number first_step on; cached so telescopes at the same site share them
+    step = MOON_TIME_RESOLUTION.to_value(u.day)
+    grid = step*(first_step + np.arange(n_steps))
+    observer = Observer(location=EarthLocation.from_geodetic(longitude*u.deg, latitude*u.deg, elevation*u.m))
+    with erfa_astrom.set(ErfaAstromInterpolator(ERFA_TIME_RESOLUTION)):
+        moon = observer.moon_altaz(Time(grid, format="jd"))
+    hour_angle, dec = altaz_to_hadec(moon.alt.rad, moon.az.rad, np.radians(latitude))
+    return CubicSpline(grid, np.unwrap(hour_angle)), CubicSpline(grid, dec)
+
+def calc_moon_hadec(observer, jd):
+    '''Topocentric apparent hour angle (-pi..pi) and declination of the Moon, in radians, at the JD (UTC) 
+    times jd (any shape): the Moon is only computed every MOON_TIME_RESOLUTION over their range, which is 
+    much cheaper than get_body at every instant, and spline interpolated.'''
+    jd = np.asarray(jd, dtype=float)
+    step = MOON_TIME_RESOLUTION.to_value(u.day)
+    first_step = int(np.floor(jd.min()/step)) - 1
+    location = observer.location
+    hour_angle, dec = _moon_hadec_splines(float(location.lon.deg), float(location.lat.deg), float(location.height.to_value(u.m)),
+                                          first_step, int(np.ceil(jd.max()/step)) - first_step + 2)
+    return np.mod(hour_angle(jd) + np.pi, 2.*np.pi) - np.pi, dec(jd)
+
+def calc_ingress_duration(targets):
+    '''Ingress (= egress) duration in hours of every target in a catalog: the "ingress_duration" column 
+    (hours) where there is one, otherwise from the duration T14, rp = Rp/R* (an "rp" column or the square 
+    root of a fractional "depth" column) and the impact parameter b (a "b" column, or a/R* and inclination 
+    in degrees from "a" and "inc" columns, for a circular orbit), otherwise a tenth of the duration.
+
+    With b, the ingress is (T14 - T23)/2 with T23/T14 = sqrt((1 - rp)^2 - b^2)/sqrt((1 + rp)^2 - b^2) 
+    (Winn 2010, small angles), or T14/2 for a grazing transit. Without it, b = 0 is assumed, which gives
+    T14 rp/(1 + rp): this underestimates the ingress, and so overestimates the timing precision, more the 
+    higher b is (sigma_t0 by ~20% at b = 0.6 for rp = 0.16, and more for near-grazing transits), which 
+    favors grazing targets when ranking by timing precision.'''
+    duration = targets["duration"].to_numpy(dtype=float)
+    ingress = np.full(len(targets), np.nan)
+    if "ingress_duration" in targets.columns:
+        ingress = targets["ingress_duration"].to_numpy(dtype=float)
+    rp = np.full(len(targets), np.nan)
+    if "rp" in targets.columns:
+        rp = targets["rp"].to_numpy(dtype=float)
+    if "depth" in targets.columns:
+        rp = np.where(np.isfinite(rp), rp, np.sqrt(targets["depth"].to_numpy(dtype=float)))
+    impact = np.full(len(targets), np.nan)
+    if "b" in targets.columns:
+        impact = targets["b"].to_numpy(dtype=float)
+    if "a" in targets.columns and "inc" in targets.columns:
+        impact = np.where(np.isfinite(impact), impact, 
+                          targets["a"].to_numpy(dtype=float)*np.cos(np.radians(targets["inc"].to_numpy(dtype=float))))
+    impact = np.where(np.isfinite(impact), np.abs(impact), 0.)
+    with np.errstate(invalid="ignore"):
+        ratio = np.sqrt(np.clip((1. - rp)**2 - impact**2, 0., None)/((1. + rp)**2 - impact**2))
+    ingress = np.where(np.isfinite(ingress), ingress, duration*(1. - ratio)/2.)
+    ingress = np.where(np.isfinite(ingress), ingress, 0.1*duration)
+    return np.minimum(ingress, duration/2.)
+
+def calc_timing_precision(depth, ingress_duration, noise, cadence, coverage_ingress=1., coverage_egress=1.):
+    '''Mid-transit time uncertainty (minutes) from the Fisher information of a transit around t0.
+
+    The light curve is approximated by a trapezoid (Carter et al. 2008), whose only dependence on t0 is 
+    through the ingress and egress ramps. A ramp of depth d and duration tau, observed in exposures of 
+    length c with noise s each, carries the information d^2 (b - a/3)/(b^2 c s^2) about t0, with 
+    a = min(tau, c) and b = max(tau, c) (the ramp smeared by the exposures); for c << tau this gives the 
+    Carter et al. result sigma = (s/d) sqrt(tau c/2) for a full transit. The ingress and egress count in 
+    proportion to how much of them is observed. Every argument broadcasts, so thousands of events are 
+    evaluated at once.
+
+    Parameters
+    ----------
+    depth : float or array-like
+        Transit depth (fractional)
+    ingress_duration : float or array-like
+        Ingress (= egress) duration in hours
+    noise : float or array-like
+        Fractional flux uncertainty of one exposure
+    cadence : float or array-like
+        Exposure time (seconds)
+    coverage_ingress, coverage_egress : float or array-like
+        Observed fraction of the ingress and of the egress
+
+    Returns
+    -------
+    np.ndarray
+        Uncertainty of the mid-transit time in minutes (inf if neither ingress nor egress is observed)
+    '''
+    tau = np.asarray(ingress_duration, dtype=float)*60.
+    cadence = np.asarray(cadence, dtype=float)/60.
+    short, long = np.minimum(tau, cadence), np.maximum(tau, cadence)
+    information = (np.asarray(depth, dtype=float)**2*(long - short/3.)/(long**2*cadence*np.asarray(noise, dtype=float)**2)
+                   *(np.asarray(coverage_ingress, dtype=float) + np.asarray(coverage_egress, dtype=float)))
+    return np.divide(1., np.sqrt(information), out=np.full(np.shape(information), np.inf), where=information > 0)
+
+def add_timing_precision(events, targets, noise, cadence=60.):
+    '''Expected mid-time precision of every event of a calendar (calc_transit_calendar, evaluate_transit_coverage,
+    predict_transits), from calc_timing_precision with the catalog's depth and ingress duration.
+
+    The depth comes from the catalog's "depth" column, or "rp" squared; ingress durations from 
+    calc_ingress_duration. Events with "cov_ingress"/"cov_egress" columns (evaluate_transit_coverage) count
+    only the observable part of their ingress and egress; the others are taken as fully observed.
+
+    Parameters
+    ----------
+    events : pd.DataFrame
+        Transits with a "target" column (row of targets)
+    targets : pd.DataFrame
+        Target catalog
+    noise : float or array-like
+        Fractional flux uncertainty of one exposure (one value, or one per event)
+    cadence : float or array-like
+        Exposure time (seconds)
+
+    Returns
+    -------
+    pd.DataFrame
+        events plus "sigma_t0" (minutes), "timing_information" (1/sigma_t0^2, 1/min^2) and, when events have
+        the predicted mid-time uncertainty "sigma", "information_gain": the bits a measurement would add on
+        that mid-time, 0.5 log2(1 + sigma^2/sigma_t0^2), which is highest for the worst predicted transits
+    '''
+    target = events["target"].to_numpy()
+    if "depth" in targets.columns:
+        depth = targets["depth"].to_numpy(dtype=float)[target]
+    elif "rp" in targets.columns:
+        depth = targets["rp"].to_numpy(dtype=float)[target]**2
+    else:
+        raise ValueError("The target catalog needs a \"depth\" or \"rp\" column to estimate timing precision.")
+    coverage = [events[column].to_numpy(dtype=float) if column in events.columns else 1. 
+                for column in ("cov_ingress", "cov_egress")]
+    sigma_t0 = calc_timing_precision(depth, calc_ingress_duration(targets)[target], noise, cadence, *coverage)
+    columns = {"sigma_t0": sigma_t0, "timing_information": 1./sigma_t0**2}
+    if "sigma" in events.columns:
+        columns["information_gain"] = 0.5*np.log2(1. + (events["sigma"].to_numpy(dtype=float)*24.*60./sigma_t0)**2)
+    return events.assign(**columns)
+
+def evaluate_transit_coverage(events, targets, observer=boiseState, baseline_hours=1., step_minutes=2., min_altitude=20.,
+                              max_airmass=None, min_moon_separation=30., twilight="nautical", horizon=None, min_coverage=0.9):
+    '''How much of the ingress, flat bottom, egress and out-of-transit baseline of every event can be observed.
+
+    Each window, from T1 - baseline_hours to T4 + baseline_hours, is sampled every step_minutes, and the 
+    altitude, airmass, Moon separation and darkness constraints are checked on the whole events x samples 
+    grid at once. Only the mid-time of each event goes through astropy (calc_event_altaz); the target's hour
+    angle is then advanced at the sidereal rate, the Moon is interpolated from a coarse table 
+    (calc_moon_hadec) and darkness is looked up in the site's night table (is_dark). Events whose window 
+    is all daytime, or whose target never gets above min_altitude, are not sampled at all.
+
+    Parameters
+    ----------
+    events : pd.DataFrame
+        Transits with "target" (row of targets) and "mid" (JD) columns, e.g. from predict_transits or 
+        calc_transit_calendar(..., only_observable=False)
+    targets : pd.DataFrame or str
+        Target catalog, or the path to one (read_target_catalog); ingress durations from calc_ingress_duration
+    observer : Observer
+        Site (default Boise State)
+    baseline_hours : float
+        Out-of-transit baseline wanted on each side of the transit
+    step_minutes : float
+        Sampling of the windows; it should be well below the ingress duration
+    min_altitude : float
+        Lowest target altitude (deg)
+    max_airmass : float, optional
+        Highest airmass allowed
+    min_moon_separation : float
+        Closest approach to the Moon allowed (deg)
+    twilight : str
+        It must be darker than this twilight ("sun", "civil", "nautical" or "astronomical")
+    horizon : array-like, optional
+        Local horizon as (azimuth, altitude) pairs in degrees (azimuth from north through east), linearly
+        interpolated in azimuth; the target has to be above it as well as above min_altitude
+    min_coverage : float
+        Fraction of a phase that has to be observable for the phase to count as covered in "coverage"
+
+    Returns
+    -------
+    pd.DataFrame
+        events plus the sampled window ("window_start", "window_end", JD), the observable fraction of each 
+        phase, "cov_pre", "cov_ingress", "cov_flat", "cov_egress", "cov_post", of the whole transit 
+        ("cov_transit", T1-T4) and of both baselines together ("cov_baseline"), the lowest Moon separation in
+        the window ("moon_separation_min", deg), and "coverage": "full", "one-sided baseline", "no baseline", 
+        "ingress only", "egress only", "partial" or "unobservable"
+    '''
+    if isinstance(targets, str):
+        targets = read_target_catalog(targets)
+    target = events["target"].to_numpy()
+    mid = events["mid"].to_numpy(dtype=float)
+    half_duration = targets["duration"].to_numpy(dtype=float)[target]/24./2.
+    ingress_duration = calc_ingress_duration(targets)[target]/24.
+    ra = targets["ra"].to_numpy(dtype=float)[target]
+    dec = targets["dec"].to_numpy(dtype=float)[target]
+    events = events.assign(window_start=mid - half_duration - baseline_hours/24., 
+                           window_end=mid + half_duration + baseline_hours/24.)
+    coverage_names = COVERAGE_PHASES + ("transit", "baseline")
+    results = {f"cov_{name}": np.zeros(len(events)) for name in coverage_names}
+    results["moon_separation_min"] = np.full(len(events), np.nan)
+    results["coverage"] = np.full(len(events), "unobservable", dtype=object)
+    if len(events) == 0:
+        return events.assign(**results)
+
+    night_table = get_night_table(observer, Time(events["window_start"].min(), format="jd"), 
+                                  Time(events["window_end"].max(), format="jd"))
+    latitude = observer.location.lat.rad
+    # only windows that reach into the night, of targets that culminate above min_altitude, are sampled
+    candidate = np.flatnonzero(overlaps_dark(events["window_start"].to_numpy(), events["window_end"].to_numpy(), 
+                                             night_table, twilight)
+                               & (90. - np.abs(np.degrees(latitude) - dec) >= min_altitude))
+    if len(candidate) == 0:
+        return events.assign(**results)
+    mid, half_duration, ingress_duration = mid[candidate], half_duration[candidate], ingress_duration[candidate]
+    window_start = events["window_start"].to_numpy()[candidate]
+    window_length = events["window_end"].to_numpy()[candidate] - window_start
+    # one fixed step grid for all events, masked past the end of the shorter windows
+    step = step_minutes/24./60.
+    offset = step*np.arange(int(np.ceil(window_length.max()/step)) + 1)
+    in_window = offset <= window_length[:, None]
+    jd = window_start[:, None] + offset
+    relative = jd - mid[:, None]
+    half_duration, ingress_duration = half_duration[:, None], ingress_duration[:, None]
+    phase = np.select([relative < -half_duration, relative < ingress_duration - half_duration,
+                       relative <= half_duration - ingress_duration, relative <= half_duration], [0, 1, 2, 3], 4)
+
+    # target: apparent hour angle and declination at mid-time, hour angle advanced at the sidereal rate
+    mid_altaz = calc_event_altaz(observer, ra[candidate], dec[candidate], Time(mid, format="jd"))
+    hour_angle, dec = altaz_to_hadec(np.radians(mid_altaz["alt"]), np.radians(mid_altaz["az"]), latitude)
+    hour_angle = hour_angle[:, None] + SIDEREAL_RATE*relative
+    dec = dec[:, None]
+    sin_alt = np.sin(latitude)*np.sin(dec) + np.cos(latitude)*np.cos(dec)*np.cos(hour_angle)
+    alt = np.degrees(np.arcsin(np.clip(sin_alt, -1., 1.)))
+    moon_hour_angle, moon_dec = calc_moon_hadec(observer, jd)
+    cos_separation = np.sin(dec)*np.sin(moon_dec) + np.cos(dec)*np.cos(moon_dec)*np.cos(hour_angle - moon_hour_angle)
+    moon_separation = np.degrees(np.arccos(np.clip(cos_separation, -1., 1.)))
+
+    observable = in_window & (alt >= min_altitude) & (moon_separation >= min_moon_separation)
+    if max_airmass is not None:
+        observable &= sin_alt >= 1./max_airmass
+    if horizon is not None:
+        horizon = np.asarray(horizon, dtype=float)
+        az = np.degrees(np.arctan2(-np.cos(dec)*np.sin(hour_angle), 
+                                   np.cos(latitude)*np.sin(dec) - np.sin(latitude)*np.cos(dec)*np.cos(hour_angle)))
+        observable &= alt >= np.interp(np.mod(az, 360.), horizon[:, 0], horizon[:, 1], period=360.)
+    observable &= is_dark(jd, night_table, twilight)
+
+    def covered_fraction(in_phase):
+        n_samples = in_phase.sum(axis=1)
+        return np.where(n_samples > 0, (observable & in_phase).sum(axis=1)/np.maximum(n_samples, 1), np.nan)
+    coverage = {name: covered_fraction(in_window & (phase == idx)) for idx, name in enumerate(COVERAGE_PHASES)}
+    coverage["transit"] = covered_fraction(in_window & (phase >= 1) & (phase <= 3))
+    coverage["baseline"] = covered_fraction(in_window & ((phase == 0) | (phase == 4)))
+    for name in coverage_names:
+        results[f"cov_{name}"][candidate] = coverage[name]
+    results["moon_separation_min"][candidate] = np.where(in_window, moon_separation, np.inf).min(axis=1)
+
+    covered = {name: coverage[name] >= min_coverage for name in COVERAGE_PHASES}
+    whole_transit = covered["ingress"] & covered["flat"] & covered["egress"]
+    results["coverage"][candidate] = np.select([whole_transit & covered["pre"] & covered["post"], 
+                                                whole_transit & (covered["pre"] | covered["post"]), whole_transit, 
+                                                covered["ingress"] & ~covered["egress"], covered["egress"] & ~covered["ingress"],
+                                                coverage["transit"] > 0],
+                                               ["full", "one-sided baseline", "no baseline", "ingress only", "egress only", "partial"], 
+                                               "unobservable")
+    return events.assign(**results)
+
 def calculate_TrES3b_transits(start_time, number_of_transits):
 
     fixed_target = create_target(RA=268.0291, DEC=37.54633, target_name="TrES-3b")
@@ -117,9 +742,9 @@ def calculate_TrES3b_transits(start_time, number_of_transits):
                                     orbital_period=1.30618801690067*u.day, 
                                     eclipse_duration=1.4178*u.hour,
                                     target_name="TrES-3b")
-    ## NOTE: LocalTimeConstraint DOES NOT USE LOCAL TIME. min & max times must be in UTC for it to be functional..
-    dusk = dt.time(1, 0)  # 7pm at Boise State
-    dawn = dt.time(10, 0)  # 4am at Boise State
+    # darkness comes from the Boise State night table, so it is right in every season
+    dusk = None
+    dawn = None
     transit_times = calculate_next_transits(start_time, dusk, dawn, number_of_transits, fixed_target, TrES3b)
     return fixed_target, transit_times
 
@@ -129,9 +754,9 @@ def calculate_HATP23b_transits(start_time, number_of_transits):
                                      orbital_period=1.212914*u.day, 
                                      eclipse_duration=2.1863*u.hour, 
                                      target_name="HAT-P-23b")
-    ## NOTE: LocalTimeConstraint DOES NOT USE LOCAL TIME. min & max times must be in UTC for it to be functional..
-    dusk = dt.time(1, 0)  # 7pm at Boise State
-    dawn = dt.time(10, 0)  # 4am at Boise State
+    # darkness comes from the Boise State night table, so it is right in every season
+    dusk = None
+    dawn = None
     transit_times = calculate_next_transits(start_time, dusk, dawn, number_of_transits, fixed_target, HATP23b)
     return fixed_target, transit_times
 
@@ -141,3 +766,5 @@ if __name__ == "__main__":
     obs_time = Time('2024-10-01 18:00') # Change to date that you want to start looking for transits
     n_transits = 10 # number of transits
     calculate_TrES3b_transits(obs_time, n_transits)
+    # every target in a catalog at once
+    # print(calc_transit_calendar("targets.csv", obs_time, obs_time + 30*u.day))
@@ -0,0 +1,135 @@
+# Generalized Lomb-Scargle periodograms of transit timing (O-C) residuals
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from astropy.timeseries import LombScargle
+from utils import BoiseState_blue, BoiseState_orange
+from ephemeris import fit_ephemeris, calc_ephemeris_model
+
+def calc_ttv_frequency_grid(epochs, samples_per_peak=10, minimum_frequency=None, maximum_frequency=0.5):
+    '''Evenly spaced frequency grid (cycles/epoch) for a TTV periodogram.
+
+    Transits are sampled at integer epochs, so frequencies above 0.5 cycles/epoch are aliases of lower
+    ones and the grid stops just below maximum_frequency by default. 0.5 itself is left out: the sine term
+    vanishes at every integer epoch there, so the power is ill-defined (and the fast and exact methods
+    disagree). The spacing puts samples_per_peak points across a peak of width 1/baseline.
+    '''
+    epochs = np.asarray(epochs, dtype=float)
+    baseline = max(float(np.ptp(epochs)), 1.)
+    df = 1./(baseline*samples_per_peak)
+    minimum_frequency = 0.5*df if minimum_frequency is None else minimum_frequency
+    return minimum_frequency + df*np.arange(int(np.ceil((maximum_frequency - minimum_frequency)/df)))
+
+def is_regular_grid(frequency):
+    '''True for an evenly spaced frequency grid, which the "fast" Lomb-Scargle method needs.'''
+    spacing = np.diff(frequency)
+    return len(spacing) == 0 or np.allclose(spacing, spacing[0])
+
+def calc_power(ls, frequency, method="fast"):
+    '''LombScargle power on frequency; the "fast" method is only used on an evenly spaced grid, any other
+    grid falls back to the exact "cython" method.'''
+    if method == "fast" and not is_regular_grid(frequency):
+        method = "cython"
+    return ls.power(frequency, method=method, assume_regular_frequency=method == "fast")
+
+def calc_ttv_periodogram(epochs, oc, sigma, frequency=None, method="fast", **grid_kwargs):
+    '''Generalized (floating mean, error weighted) Lomb-Scargle periodogram of O-C residuals.
+
+    Parameters
+    ----------
+    epochs : array-like of int
+    oc : array-like of float
+        O-C residuals (any time unit, same as sigma).
+    sigma : array-like of float
+        Uncertainties of the residuals.
+    frequency : array-like of float, optional
+        Frequencies (cycles/epoch). Defaults to calc_ttv_frequency_grid(epochs, **grid_kwargs), which
+        is evenly spaced as the fast method needs.
+    method : str
+        "fast" is the O(N log N) Press & Rybicki extirpolation method, which needs an evenly spaced grid
+        (an uneven frequency grid uses the exact "cython" method instead); any other astropy LombScargle
+        method (e.g. "cython", "slow") is exact but O(N x n_frequencies). Below 0.5 cycles/epoch the fast
+        power agrees with the exact one to ~1e-12 (up to ~1e-6 at frequencies far below 1/baseline for 
+        short baselines); at exactly 0.5 (see calc_ttv_frequency_grid) it can be off by ~1e-3.
+
+    Returns
+    -------
+    dict
+        "frequency", "power", "best_frequency", "best_period" (epochs), "max_power" and the analytic
+        (Baluev 2008) "false_alarm_probability" of the highest peak.
+    '''
+    frequency = calc_ttv_frequency_grid(epochs, **grid_kwargs) if frequency is None else np.asarray(frequency, dtype=float)
+    ls = LombScargle(np.asarray(epochs, dtype=float), oc, sigma)
+    power = calc_power(ls, frequency, method)
+    best = np.argmax(power)
+    return {"frequency": frequency, "power": power, "best_frequency": frequency[best], "best_period": 1./frequency[best],
+            "max_power": power[best],
+            "false_alarm_probability": ls.false_alarm_probability(power[best], method="baluev",
+                                                                  minimum_frequency=frequency[0], maximum_frequency=frequency[-1])}
+
+def _bootstrap_max_power(args):
+    # highest peak of n_bootstraps periodograms of (oc, sigma) resampled with replacement onto the same epochs
+    epochs, oc, sigma, frequency, n_bootstraps, seed = args
+    rng = np.random.default_rng(seed)
+    max_power = np.empty(n_bootstraps)
+    for idx in range(n_bootstraps):
+        resample = rng.integers(0, len(oc), len(oc))
+        max_power[idx] = calc_power(LombScargle(epochs, oc[resample], sigma[resample]), frequency).max()
+    return max_power
+
+def calc_bootstrap_false_alarm(epochs, oc, sigma, max_power, frequency, n_bootstraps=1000, max_workers=None, seed=None):
+    '''Bootstrap false alarm probability of a periodogram peak: the fraction of periodograms of the
+    residuals resampled with replacement (which destroys any periodic signal) whose highest peak is at
+    least max_power. The bootstraps are split across a process pool.
+
+    Returns
+    -------
+    false_alarm_probability : float
+    bootstrap_max_power : np.ndarray
+        Highest peak of every bootstrap periodogram.
+    '''
+    epochs = np.asarray(epochs, dtype=float)
+    oc = np.asarray(oc, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    n_workers = min(max_workers or os.cpu_count() or 1, n_bootstraps)
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+    tasks = [(epochs, oc, sigma, frequency, len(chunk), child_seed)
+             for chunk, child_seed in zip(np.array_split(np.arange(n_bootstraps), n_workers), seeds)]
+    if n_workers == 1:
+        results = list(map(_bootstrap_max_power, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_bootstrap_max_power, tasks))
+    bootstrap_max_power = np.concatenate(results)
+    return np.mean(bootstrap_max_power >= max_power), bootstrap_max_power
+
+def calc_ttv_residual_periodogram(epochs, mid_times, sigma, model="linear", n_bootstraps=0, max_workers=None, seed=None,
+                                  **periodogram_kwargs):
+    '''Fits a linear or quadratic ephemeris (ephemeris.fit_ephemeris) and returns the periodogram of its
+    O-C residuals (in minutes), with a bootstrap false alarm probability if n_bootstraps > 0.'''
+    epochs = np.asarray(epochs)
+    fit = fit_ephemeris(epochs, mid_times, sigma, model)
+    oc = (np.asarray(mid_times) - calc_ephemeris_model(epochs, *fit.params.values()))*24.*60.
+    sigma_minutes = np.asarray(sigma)*24.*60.
+    result = calc_ttv_periodogram(epochs, oc, sigma_minutes, **periodogram_kwargs)
+    result.update({"epochs": epochs, "oc": oc, "sigma": sigma_minutes, "ephemeris": fit})
+    if n_bootstraps > 0:
+        result["bootstrap_false_alarm_probability"], result["bootstrap_max_power"] = calc_bootstrap_false_alarm(
+            epochs, oc, sigma_minutes, result["max_power"], result["frequency"], n_bootstraps, max_workers, seed)
+    return result
+
+def plot_ttv_periodogram(result, ax=None):
+    '''Power against period (epochs) for a calc_ttv_periodogram/calc_ttv_residual_periodogram result.'''
+    import matplotlib.pyplot as plt
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(6*(16/9), 6))
+    ax.plot(1./result["frequency"], result["power"], color=BoiseState_blue, linewidth=1)
+    label = f"P = {result['best_period']:.2f} epochs, FAP = {result['false_alarm_probability']:.2g}"
+    if "bootstrap_false_alarm_probability" in result:
+        label += f" (bootstrap {result['bootstrap_false_alarm_probability']:.2g})"
+    ax.axvline(result["best_period"], color=BoiseState_orange, ls="--", label=label)
+    ax.set_xscale("log")
+    ax.set_xlabel("Period [epochs]")
+    ax.set_ylabel("Lomb-Scargle power")
+    ax.legend()
+    return ax
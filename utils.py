@@ -1,5 +1,7 @@
 import batman
 import numpy as np
+from batman import _nonlinear_ld, _quadratic_ld, _uniform_ld, _logarithmic_ld, _exponential_ld, _power2_ld
+from collections import OrderedDict, namedtuple
 
 # One tiny trick I've adopted:
 # I find that I often make figures that end up in Google slides/powerpoint presentations,
@@ -11,6 +13,82 @@ aspect_ratio = 16./9
 BoiseState_blue = "#0033A0"
 BoiseState_orange = "#D64309"
 
+# column order of the parameter matrix given to calc_batman_curves; limb darkening coefficients follow
+BATCH_PARAM_COLUMNS = ("t0", "per", "rp", "a", "inc", "ecc", "w")
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class TransitModelCache():
+    '''Least-recently-used cache of initialized batman TransitModel objects.
+
+    Building a TransitModel does batman's integration step-size search and computes the 
+    sky-projected separations for every time stamp. A cached model is reused for any new 
+    parameter set on the same time array; batman itself only recomputes the geometry when 
+    t0, per, a, inc, ecc or w change. NOTE: the step-size factor (fac) is found once, from the 
+    rp and u of the first parameter set, exactly as when reusing a batman model by hand.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of models to keep before the least recently used one is evicted.
+    '''
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+
+    @staticmethod
+    def make_key(time, limb_dark, supersample_factor=1, exp_time=0.):
+        '''Key on the content of the time array (not just its id) so a reused buffer that was 
+        modified in place can never hit a stale model.'''
+        time = np.ascontiguousarray(time, dtype=float)
+        return (time.size, hash(time.tobytes()), limb_dark, int(supersample_factor), float(exp_time))
+
+    def get_model(self, params, time, supersample_factor=1, exp_time=0.):
+        '''Returns an initialized TransitModel for this time array and limb darkening law.
+
+        Parameters
+        ----------
+        params : batman.TransitParams
+            Used to initialize the model on a cache miss.
+        time : np.ndarray[float]
+            Times to evaluate the light curve at.
+        supersample_factor : int
+            Number of samples per exposure passed through to batman.
+        exp_time : float
+            Exposure time in days passed through to batman.
+
+        Returns
+        -------
+        batman.TransitModel
+        '''
+        key = self.make_key(time, params.limb_dark, supersample_factor, exp_time)
+        model = self._models.get(key)
+        if model is not None:
+            self.hits += 1
+            self._models.move_to_end(key)
+            return model
+        self.misses += 1
+        # keep a private copy of the times so the caller can't modify the cached model's grid
+        model = batman.TransitModel(params, np.array(time, dtype=float), 
+                                    supersample_factor=supersample_factor, exp_time=exp_time)
+        self._models[key] = model
+        if len(self._models) > self.maxsize:
+            self._models.popitem(last=False)
+        return model
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._models))
+
+    def clear(self):
+        self._models.clear()
+        self.hits = 0
+        self.misses = 0
+
+# shared by every call to calc_batman_curve
+batman_model_cache = TransitModelCache()
+
 def calc_chi_sq(data, model, sigma):
     return np.sum(((data - model)/sigma)**2)
 
@@ -21,7 +99,8 @@ def calc_BIC(data, model, sigma, num_params):
     chi_sq = calc_chi_sq(data, model, sigma)
     return chi_sq + num_params*np.log(len(data))
 
-def calc_batman_curve(time, t0, per, rp, a, inc, u, limb_dark="uniform", ecc=0, w=90.):
+def calc_batman_curve(time, t0, per, rp, a, inc, u, limb_dark="uniform", ecc=0, w=90., use_cache=True, 
+                      supersample_factor=1, exp_time=0., selective_supersample=True, transit_window=False):
     # initial guesses
     params = batman.TransitParams()
     params.t0 = t0                       #time of inferior conjunction
@@ -34,7 +113,289 @@ def calc_batman_curve(time, t0, per, rp, a, inc, u, limb_dark="uniform", ecc=0,
     params.u = u                #limb darkening coefficient - using uniform, so no LDC
     params.limb_dark = limb_dark       #limb darkening model
 
-    m = batman.TransitModel(params, time)    #initializes model
+    # only evaluate the points that can be in transit (time needn't be sorted, but sorted is cheaper)
+    if transit_window:
+        time = np.asarray(time, dtype=float)
+        idx = calc_transit_window_indices(time, t0, per, rp, a, inc, ecc, pad=exp_time/2.)
+        flux = np.ones(len(time))
+        if idx.size == 0:
+            return flux
+        if not use_cache:
+            flux[idx] = calc_batman_curve(time[idx], t0, per, rp, a, inc, u, limb_dark, ecc, w, use_cache, 
+                                          supersample_factor, exp_time, selective_supersample)
+            return flux
+        # the step size comes from a cached model of the full grid: the window moves with t0, so caching 
+        # models of the window itself would build a new one for every t0
+        fac = batman_model_cache.get_model(params, time).fac
+        if supersample_factor > 1 and selective_supersample:
+            flux[idx] = calc_supersampled_flux(time[idx], params, supersample_factor, exp_time, fac)
+            return flux
+        offsets = np.linspace(-exp_time/2., exp_time/2., int(supersample_factor)) if supersample_factor > 1 else np.zeros(1)
+        ds = calc_rsky(time[idx, np.newaxis] + offsets, t0, per, a, inc, ecc, w)
+        flux[idx] = calc_ld_flux(ds.ravel(), rp, u, limb_dark, fac).reshape(ds.shape).mean(axis=1)
+        return flux
+
+    # integrate over the exposure (exp_time in days) only around ingress/egress
+    if supersample_factor > 1 and selective_supersample:
+        return calc_supersampled_flux(time, params, supersample_factor, exp_time)
+
+    if use_cache:
+        m = batman_model_cache.get_model(params, time, supersample_factor, exp_time)    #reuses an initialized model when possible
+    else:
+        m = batman.TransitModel(params, time, supersample_factor=supersample_factor, exp_time=exp_time)    #initializes model
     flux = m.light_curve(params)          #calculates light curve
 
     return flux
+
+def calc_transit_half_window(per, rp, a, inc, ecc=0.):
+    """Conservative half-width (days) around each mid-transit time outside of which no transit is possible.
+
+    Uses the b = 0 total duration for the given a/R* and inc, widened by the largest speed-up an 
+    eccentric orbit can give (sqrt((1+e)/(1-e))) so it never clips ingress or egress.
+    """
+    sin_arg = np.clip((1. + np.abs(rp))/(a*np.sin(np.deg2rad(inc))), 0., 1.)
+    return per/(2.*np.pi)*np.arcsin(sin_arg)*np.sqrt((1. + ecc)/(1. - ecc))
+
+def calc_transit_window_indices(time, t0, per, rp, a, inc, ecc=0., pad=0.):
+    """Indices of a time array that can fall inside a transit of the given ephemeris.
+
+    The window edges for every epoch covered by the time array are found with one searchsorted call, 
+    so the cost scales with the number of epochs and in-transit points rather than the array length.
+    An unsorted array is argsorted first, which costs O(n log n).
+
+    Parameters
+    ----------
+    time : np.ndarray[float]
+        Times, preferably sorted in ascending order.
+    t0, per, rp, a, inc, ecc : float
+        Mid-transit time, period, Rp/R*, a/R*, inclination (deg) and eccentricity.
+    pad : float
+        Extra time added to both sides of each window, e.g. half an exposure when supersampling.
+
+    Returns
+    -------
+    np.ndarray[int]
+        Indices of the points within the transit windows, in ascending order.
+    """
+    time = np.asarray(time)
+    if time.size == 0:
+        return np.array([], dtype=int)
+    if np.any(time[1:] < time[:-1]):
+        # searchsorted needs sorted times: find the windows in a sorted copy and map them back
+        order = np.argsort(time, kind="stable")
+        return np.sort(order[calc_transit_window_indices(time[order], t0, per, rp, a, inc, ecc, pad)])
+    half_window = calc_transit_half_window(per, rp, a, inc, ecc) + pad
+    epochs = np.arange(np.floor((time[0] - half_window - t0)/per), np.ceil((time[-1] + half_window - t0)/per) + 1)
+    mid_times = t0 + epochs*per
+    starts = np.searchsorted(time, mid_times - half_window, side="left")
+    stops = np.searchsorted(time, mid_times + half_window, side="right")
+    lengths = stops - starts
+    # concatenate the ranges [start, stop) without a Python loop
+    return np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+def solve_kepler(M, ecc, tol=1.0e-10, max_iter=50):
+    """Solves Kepler's equation M = E - e*sin(E) for the eccentric anomaly with vectorized Newton steps."""
+    M, ecc = np.broadcast_arrays(np.asarray(M, dtype=float), np.asarray(ecc, dtype=float))
+    E = M + ecc*np.sin(M)
+    for _ in range(max_iter):
+        dE = (E - ecc*np.sin(E) - M)/(1. - ecc*np.cos(E))
+        E = E - dE
+        if np.all(np.abs(dE) < tol):
+            break
+    return E
+
+def calc_rsky(time, t0, per, a, inc, ecc=0., w=90., out=None):
+    """Sky-projected planet-star separation in stellar radii, the same geometry batman computes.
+
+    Parameters broadcast against each other, so column vectors of parameters and a row of times 
+    give an (n_params x n_times) result. Points with the planet behind the star are set to 100 
+    (as batman does) so they never register as in transit.
+
+    Parameters
+    ----------
+    time : np.ndarray[float]
+        Times to evaluate at.
+    t0, per, a, inc, ecc, w : float or np.ndarray[float]
+        Mid-transit time, period, a/R*, inclination (deg), eccentricity and longitude of periastron (deg).
+    out : np.ndarray[float], optional
+        Buffer of the broadcast shape to write the separations into.
+
+    Returns
+    -------
+    np.ndarray[float]
+    """
+    inc = np.deg2rad(inc)
+    w = np.deg2rad(w)
+    ecc = np.asarray(ecc, dtype=float)
+    # time of periastron from the true anomaly at mid-transit
+    f_tc = np.pi/2. - w
+    E_tc = 2.*np.arctan(np.sqrt((1. - ecc)/(1. + ecc))*np.tan(f_tc/2.))
+    tp = t0 - per*(E_tc - ecc*np.sin(E_tc))/(2.*np.pi)
+    M = 2.*np.pi*(time - tp)/per
+    if np.any(ecc > 1.0e-5):
+        E = solve_kepler(M, ecc)
+        f = 2.*np.arctan(np.sqrt((1. + ecc)/(1. - ecc))*np.tan(E/2.))
+    else:
+        f = M
+    sin_wf_inc = np.sin(w + f)*np.sin(inc)
+    d = np.multiply(a*(1. - ecc**2)/(1. + ecc*np.cos(f)), np.sqrt(1. - sin_wf_inc**2), out=out)
+    d[np.broadcast_to(sin_wf_inc <= 0., d.shape)] = 100.
+    return d
+
+def calc_uniform_flux(z, rp, out=None):
+    """Uniform-disk transit flux (Mandel & Agol 2002) for separations z, with rp broadcast against z."""
+    p = np.broadcast_to(np.abs(rp), np.shape(z))
+    z = np.asarray(z)
+    occulted = np.zeros(z.shape)
+    inside = z <= 1. - p
+    occulted[inside] = p[inside]**2
+    occulted[z <= p - 1.] = 1.
+    edge = (z > np.abs(1. - p)) & (z < 1. + p)
+    ze, pe = z[edge], p[edge]
+    kap0 = np.arccos(np.clip((pe**2 + ze**2 - 1.)/(2.*pe*ze), -1., 1.))
+    kap1 = np.arccos(np.clip((1. - pe**2 + ze**2)/(2.*ze), -1., 1.))
+    occulted[edge] = (pe**2*kap0 + kap1 - 0.5*np.sqrt(np.clip(4.*ze**2 - (1. + ze**2 - pe**2)**2, 0., None)))/np.pi
+    flux = np.subtract(1., occulted, out=out)
+    # batman treats rp < 0 as an inverse transit
+    inverse = np.broadcast_to(np.asarray(rp) < 0., flux.shape)
+    flux[inverse] = 2. - flux[inverse]
+    return flux
+
+def calc_ld_flux(ds, rp, u, limb_dark, fac=None):
+    """Evaluates one batman limb-darkening kernel on a flat array of separations."""
+    ds = np.ascontiguousarray(ds, dtype=float)
+    p = np.abs(rp)
+    if limb_dark == "uniform":
+        flux = _uniform_ld._uniform_ld(ds, p, 1)
+    elif limb_dark == "linear":
+        flux = _quadratic_ld._quadratic_ld(ds, p, u[0], 0., 1)
+    elif limb_dark == "quadratic":
+        flux = _quadratic_ld._quadratic_ld(ds, p, u[0], u[1], 1)
+    elif limb_dark == "nonlinear":
+        flux = _nonlinear_ld._nonlinear_ld(ds, p, u[0], u[1], u[2], u[3], fac, 1)
+    elif limb_dark == "squareroot":
+        flux = _nonlinear_ld._nonlinear_ld(ds, p, u[1], u[0], 0., 0., fac, 1)
+    elif limb_dark == "logarithmic":
+        flux = _logarithmic_ld._logarithmic_ld(ds, p, u[0], u[1], fac, 1)
+    elif limb_dark == "exponential":
+        flux = _exponential_ld._exponential_ld(ds, p, u[0], u[1], fac, 1)
+    elif limb_dark == "power2":
+        flux = _power2_ld._power2_ld(ds, p, u[0], u[1], fac, 1)
+    else:
+        raise ValueError(f"Limb darkening law '{limb_dark}' is not supported for batched light curves.")
+    if rp < 0.:
+        flux = 2. - flux
+    return flux
+
+def calc_supersampled_flux(time, params, supersample_factor, exp_time, fac=None):
+    """Exposure-integrated light curve that only supersamples exposures overlapping ingress or egress.
+
+    Each exposure is classified from its mid-exposure separation and the largest distance the planet 
+    can move on the sky within half an exposure. Exposures entirely out of transit are exactly 1. 
+    Only exposures that can straddle the contact ring 1-rp < z < 1+rp are evaluated on every 
+    sub-exposure, spaced like batman's. Inside the flat bottom the limb-darkened profile is smooth, 
+    so those exposures are integrated with a 3-point Simpson rule (start, middle, end); this is exact 
+    for the uniform law, and for limb-darkened transits its error is far below the discretization 
+    error of the supersampled contact points, so the result is as accurate as full supersampling.
+
+    Parameters
+    ----------
+    time : np.ndarray[float]
+        Mid-exposure times.
+    params : batman.TransitParams
+        Transit parameters.
+    supersample_factor : int
+        Number of samples per exposure, spaced like batman's (including both exposure edges).
+    exp_time : float
+        Exposure (or bin) length, same units as time (days).
+    fac : float, optional
+        batman integration step size factor; by default taken from a cached model of time.
+
+    Returns
+    -------
+    np.ndarray[float]
+    """
+    if exp_time <= 0.:
+        raise ValueError("exp_time must be greater than 0 to calculate supersampled light curves.")
+    time = np.asarray(time, dtype=float)
+    geometry = (params.t0, params.per, params.a, params.inc, params.ecc, params.w)
+    p = np.abs(params.rp)
+    # fastest the planet can move on the sky (periastron speed) over half an exposure, in stellar radii
+    max_step = 2.*np.pi*params.a/params.per*np.sqrt((1. + params.ecc)/(1. - params.ecc))*exp_time/2.
+    mid_ds = calc_rsky(time, *geometry)
+    flat_bottom = mid_ds + max_step <= 1. - p
+    contact = ~flat_bottom & (mid_ds - max_step < 1. + p)
+    flux = np.ones(time.size)
+    if not np.any(flat_bottom | contact):
+        return flux
+    if fac is None:
+        fac = batman_model_cache.get_model(params, time).fac
+    # one kernel call: start/middle/end of each flat-bottom exposure, then every sub-exposure near contact
+    simpson_ds = calc_rsky(time[flat_bottom, np.newaxis] + np.array([-exp_time/2., 0., exp_time/2.]), *geometry)
+    offsets = np.linspace(-exp_time/2., exp_time/2., int(supersample_factor))
+    contact_ds = calc_rsky(time[contact, np.newaxis] + offsets, *geometry)
+    lc = calc_ld_flux(np.concatenate((simpson_ds.ravel(), contact_ds.ravel())), params.rp, params.u, params.limb_dark, fac)
+    flux[flat_bottom] = lc[:simpson_ds.size].reshape(-1, 3) @ np.array([1., 4., 1.])/6.
+    flux[contact] = lc[simpson_ds.size:].reshape(-1, offsets.size).mean(axis=1)
+    return flux
+
+def calc_batman_curves(time, param_matrix, limb_dark="uniform", out=None, fac=None):
+    """Batched counterpart of calc_batman_curve: many parameter sets on one shared time grid.
+
+    The orbital geometry for every parameter set is computed in one vectorized pass into a single 
+    (n_params x n_times) buffer, which is then overwritten in place with the fluxes. Uniform limb 
+    darkening is evaluated fully vectorized.
+
+    The other laws are NOT vectorized over rows: there is a Python loop with one batman C kernel call per
+    distinct (rp, u) combination. Grids over t0, per, a, inc, ecc or w with shared rp and u cost a single
+    call, but a grid over rp or the limb darkening coefficients (e.g. the rp +/- h rows of a numerical 
+    derivative) costs one call per row. Integrating the annuli for all rows at once in numpy was tried 
+    and was slower than this loop (1.5-3x for the numerically integrated laws, far more against the 
+    analytic quadratic kernel), because the kernel's integration, not the loop, dominates the cost.
+
+    Parameters
+    ----------
+    time : np.ndarray[float]
+        Shared time grid of length n_times.
+    param_matrix : np.ndarray[float]
+        (n_params x 7+n_u) array with columns t0, per, rp, a, inc, ecc, w (see BATCH_PARAM_COLUMNS)
+        followed by the limb darkening coefficients of `limb_dark`.
+    limb_dark : str
+        batman limb darkening law shared by every parameter set.
+    out : np.ndarray[float], optional
+        Preallocated (n_params x n_times) buffer to reuse between calls.
+    fac : float, optional
+        batman integration step size factor. If not given, batman's step-size search is run on the first 
+        parameter set, which for the numerically integrated laws costs far more than the curves themselves:
+        repeated callers (e.g. a fit) should find it once and pass it in.
+
+    Returns
+    -------
+    np.ndarray[float]
+        (n_params x n_times) array of relative fluxes.
+    """
+    time = np.asarray(time, dtype=float)
+    param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+    n_ld = param_matrix.shape[1] - len(BATCH_PARAM_COLUMNS)
+    if n_ld < 0:
+        raise ValueError(f"param_matrix needs at least the columns {BATCH_PARAM_COLUMNS}.")
+    if out is None:
+        out = np.empty((param_matrix.shape[0], time.size))
+    t0, per, rp, a, inc, ecc, w = (param_matrix[:, i, np.newaxis] for i in range(len(BATCH_PARAM_COLUMNS)))
+    ds = calc_rsky(time, t0, per, a, inc, ecc, w, out=out)
+    if limb_dark == "uniform":
+        return calc_uniform_flux(ds, rp, out=out)
+    if fac is None:
+        # the integration step size is found from the first parameter set, as in TransitModelCache
+        params = batman.TransitParams()
+        params.t0, params.per, params.rp, params.a, params.inc, params.ecc, params.w = param_matrix[0, :len(BATCH_PARAM_COLUMNS)]
+        params.u = list(param_matrix[0, len(BATCH_PARAM_COLUMNS):])
+        params.limb_dark = limb_dark
+        fac = batman.TransitModel(params, time[:1]).fac
+    rp_u = param_matrix[:, 2:3] if n_ld == 0 else np.hstack((param_matrix[:, 2:3], param_matrix[:, len(BATCH_PARAM_COLUMNS):]))
+    groups, group_idx = np.unique(rp_u, axis=0, return_inverse=True)
+    group_idx = group_idx.ravel()
+    for g, (group_rp, *group_u) in enumerate(groups):
+        rows = np.flatnonzero(group_idx == g)
+        out[rows] = calc_ld_flux(ds[rows].ravel(), group_rp, group_u, limb_dark, fac).reshape(rows.size, time.size)
+    return out